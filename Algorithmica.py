@@ -1,17 +1,41 @@
+import heapq
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import osmnx as ox
 import networkx as nx
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import geopandas as gpd
+from scipy.sparse.csgraph import dijkstra
 from shapely.geometry import Point
 from Open_Street_Map import Open_Street_Map
+from Compiled_Graph import CompiledGraph
+from Batch_Routing import init_route_worker, origin_tasks, route_origin_chunk
+import Profiling
 import pandas as pd
 
 
-
 class Algorithmic:
     def __init__(self, open_object : Open_Street_Map):
         self.open_street_map_object = open_object
+        self.compiled = None
+
+    def compiled_graph(self, cost_names=(), refresh=False):
+        """
+        CompiledGraph of the current G with 'length' and cost_1..cost_4, cached on the instance.
+        Other cost names are copied from the edge attributes. Use refresh=True after G changed.
+        """
+        if refresh:
+            # The snapping index rows follow the same edges as the compiled graph
+            self.open_street_map_object.invalidate_snap_index()
+        if refresh or self.compiled is None or any(name not in self.compiled.costs for name in cost_names):
+            compiled = CompiledGraph.from_graph(self.open_street_map_object.G).add_shade_costs()
+            extra = [name for name in cost_names if name not in compiled.costs]
+            if extra:
+                compiled = CompiledGraph.from_graph(self.open_street_map_object.G, extra).add_shade_costs()
+            self.compiled = compiled
+        return self.compiled
 
     def shortest_path_near_bgu_with_buildings(self, dest, original):
         """
@@ -29,8 +53,7 @@ class Algorithmic:
         orig_node_32636, dest_node_32636 = 3664673537, 3664678549
         G = self.open_street_map_object.G
         # Shortest path by length (in meters)
-        route_nodes = nx.shortest_path(G, orig_node_32636, dest_node_32636, weight='length')
-        route_length = nx.shortest_path_length(G, orig_node_32636, dest_node_32636, weight='length')
+        route_length, route_nodes = nx.single_source_dijkstra(G, orig_node_32636, dest_node_32636, weight='length')
         print("Route node IDs:", route_nodes)
         print(f"Route distance: {route_length:.2f} meters")
 
@@ -117,8 +140,7 @@ class Algorithmic:
         # Loop through weights to calculate and plot each route
         for cost_names, color in zip(cost_names, colors):
             # Calculate the shortest path for the current weight
-            route_nodes = nx.shortest_path(G, orig_node_32636, dest_node_32636, weight=cost_names)
-            route_length = nx.shortest_path_length(G, orig_node_32636, dest_node_32636, weight=cost_names)
+            route_length, route_nodes = nx.single_source_dijkstra(G, orig_node_32636, dest_node_32636, weight=cost_names)
             # Print route information
             print(f"Weight: {cost_names}")
             print(f"Route node IDs: {route_nodes}")
@@ -153,5 +175,369 @@ class Algorithmic:
             route_map.save(f"route_{cost_names}.html")
             print(f"Folium map saved to route_{cost_names}.html")
 
+    @Profiling.stage('routing', items=1)
+    def time_dependent_shortest_path(self, orig_node, dest_node, departure, timetable, delta=10, speed=1.4,
+                                     use_heuristic=True):
+        """
+        Shade-aware route where every edge is costed at the time the walker reaches it.
+
+        The cost of an edge is sun_length + shade_length / delta (as in make_new_weights), with the shaded
+        fraction read from a ShadeTimetable at departure + walked_distance / speed (speed in m/s). Every
+        label carries the distance walked so far, so the arrival time at an edge follows the route that
+        reaches it.
+
+        The search keeps one label (the cheapest) per node, so it is a heuristic: a costlier label that
+        would reach later edges at a shadier time is dropped. The route is the exact optimum when the
+        walk stays within one timetable slot, and otherwise a good route that need not be the cheapest.
+        With use_heuristic the search is an A* whose Euclidean heuristic is scaled by
+        min(1, 1 / delta), the lowest possible cost per meter (all shade for delta > 1, all sun for
+        delta < 1), so it stays admissible.
+
+        Returns (route_nodes, cost, arrival_time).
+        """
+        if delta <= 0:
+            raise ValueError("delta must be positive.")
+        G = self.open_street_map_object.G
+        day, start_minute = timetable.departure_clock(departure)
+        target_x, target_y = G.nodes[dest_node]['x'], G.nodes[dest_node]['y']
+        scale = min(1.0, 1.0 / delta)
+
+        def heuristic(node):
+            if not use_heuristic:
+                return 0.0
+            return math.hypot(G.nodes[node]['x'] - target_x, G.nodes[node]['y'] - target_y) * scale
+
+        best_cost = {orig_node: 0.0}
+        walked = {orig_node: 0.0}
+        parent = {orig_node: None}
+        settled = set()
+        counter = 0
+        heap = [(heuristic(orig_node), 0.0, counter, orig_node)]
+
+        while heap:
+            _, cost, _, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == dest_node:
+                break
+
+            column = timetable.column_at(day, start_minute + walked[node] / speed / 60)
+            for neighbor, parallel_edges in G[node].items():
+                if neighbor in settled:
+                    continue
+                for key, edge in parallel_edges.items():
+                    path = edge.get('geometry')
+                    length = path.length if path is not None else edge['length']
+                    if column < 0:
+                        fraction = 1.0
+                    else:
+                        row = timetable.edge_index[(node, neighbor, key)]
+                        fraction = float(timetable.fractions[row, column]) / timetable.scale
+                    new_cost = cost + length * (1 - fraction) + length * fraction / delta
+                    if new_cost < best_cost.get(neighbor, math.inf):
+                        best_cost[neighbor] = new_cost
+                        walked[neighbor] = walked[node] + length
+                        parent[neighbor] = node
+                        counter += 1
+                        heapq.heappush(heap, (new_cost + heuristic(neighbor), new_cost, counter, neighbor))
+
+        if dest_node not in settled:
+            raise nx.NetworkXNoPath(f"No path between {orig_node} and {dest_node}.")
+
+        route_nodes = [dest_node]
+        while parent[route_nodes[-1]] is not None:
+            route_nodes.append(parent[route_nodes[-1]])
+        route_nodes.reverse()
+
+        arrival_time = pd.Timestamp(departure) + pd.Timedelta(seconds=walked[dest_node] / speed)
+        return route_nodes, best_cost[dest_node], arrival_time
+
+    @Profiling.stage('routing', items=1)
+    def pareto_routes(self, orig_node, dest_node):
+        """
+        Full Pareto front of (walking distance, sun exposed distance) routes in one label-setting search.
+
+        Sun exposed distance of an edge is length * (1 - shadow_coverage / 100). Labels are settled in
+        lexicographic (distance, sun) order, so a label is kept only if its sun distance is below every
+        label already settled at its node and at the destination. The cost_i route of make_new_weights
+        (sun + shade / delta) for any delta is one of the returned routes.
+
+        Returns a list of (distance, sun_distance, route_nodes) sorted by distance.
+        """
+        G = self.open_street_map_object.G
+
+        # Labels are (distance, sun_distance, node, parent label index)
+        labels = [(0.0, 0.0, orig_node, None)]
+        min_sun = {}
+        front = []
+        heap = [(0.0, 0.0, 0)]
+
+        while heap:
+            distance, sun, label_id = heapq.heappop(heap)
+            node = labels[label_id][2]
+            if sun >= min_sun.get(node, math.inf) or sun >= min_sun.get(dest_node, math.inf):
+                continue
+            min_sun[node] = sun
+            if node == dest_node:
+                front.append(label_id)
+                continue
+
+            for neighbor, parallel_edges in G[node].items():
+                for key, edge in parallel_edges.items():
+                    path = edge.get('geometry')
+                    length = path.length if path is not None else edge['length']
+                    new_distance = distance + length
+                    new_sun = sun + length * (1 - edge.get('shadow_coverage', 0) / 100)
+                    if new_sun >= min_sun.get(neighbor, math.inf) or new_sun >= min_sun.get(dest_node, math.inf):
+                        continue
+                    labels.append((new_distance, new_sun, neighbor, label_id))
+                    heapq.heappush(heap, (new_distance, new_sun, len(labels) - 1))
+
+        routes = []
+        for label_id in front:
+            distance, sun = labels[label_id][0], labels[label_id][1]
+            route_nodes = []
+            while label_id is not None:
+                route_nodes.append(labels[label_id][2])
+                label_id = labels[label_id][3]
+            route_nodes.reverse()
+            routes.append((distance, sun, route_nodes))
+        return routes
+
+    def batch_routes(self, od_pairs, cost_names=('length',), processes=None, chunk_size=64):
+        """
+        Route many (origin node, destination node) pairs for every cost name.
+
+        Pairs are grouped by origin so one single-source search serves all destinations of an origin, and
+        chunks of origins are spread over a process pool (processes=1 runs in this process). Each worker
+        receives the compiled graph once.
+
+        Returns {cost name: {'cost', 'length', 'shaded_length', 'route_nodes', 'route_offsets'}} where
+        the routes of all pairs are concatenated node ids, route i being
+        route_nodes[route_offsets[i]:route_offsets[i + 1]] (empty if unreachable, cost inf).
+        """
+        with Profiling.stage('routing', items=len(od_pairs)):
+            compiled = self.compiled_graph(cost_names)
+            od_pairs = np.asarray(od_pairs)
+            if len(od_pairs) == 0:
+                return {weight: {'cost': np.zeros(0), 'length': np.zeros(0), 'shaded_length': np.zeros(0),
+                                 'route_nodes': compiled.node_ids[:0], 'route_offsets': np.zeros(1, dtype=np.int64)}
+                        for weight in cost_names}
+            origins = compiled.node_index(od_pairs[:, 0])
+            destinations = compiled.node_index(od_pairs[:, 1])
+
+            tasks = [task for weight in cost_names for task in origin_tasks(weight, origins, destinations, chunk_size)]
+
+            results = {weight: {'cost': np.full(len(od_pairs), np.inf),
+                                'length': np.zeros(len(od_pairs)),
+                                'shaded_length': np.zeros(len(od_pairs)),
+                                'routes': [None] * len(od_pairs)} for weight in cost_names}
+
+            if processes == 1:
+                init_route_worker(compiled)
+                outputs = map(route_origin_chunk, tasks)
+            else:
+                executor = ProcessPoolExecutor(max_workers=processes, initializer=init_route_worker,
+                                               initargs=(compiled,))
+                outputs = executor.map(route_origin_chunk, tasks)
+
+            try:
+                for weight, od_rows, costs, lengths, shaded, routes in outputs:
+                    result = results[weight]
+                    result['cost'][od_rows] = costs
+                    result['length'][od_rows] = lengths
+                    result['shaded_length'][od_rows] = shaded
+                    for row, route in zip(od_rows, routes):
+                        result['routes'][row] = route
+            finally:
+                if processes != 1:
+                    executor.shutdown()
+
+            for result in results.values():
+                routes = result.pop('routes')
+                result['route_offsets'] = np.concatenate([[0], np.cumsum([len(route) for route in routes])])
+                result['route_nodes'] = compiled.node_ids[np.concatenate(routes)] if routes else compiled.node_ids[:0]
+            return results
+
+    @Profiling.stage('routing', items=1)
+    def astar_path(self, orig_node, dest_node, weight='length', use_heuristic=True):
+        """
+        Goal-directed single pair search on the compiled graph.
+
+        The graph is projected (meters), so the heuristic is the Euclidean distance to the destination
+        times the minimum cost per meter of the chosen weight, which never overestimates. With
+        use_heuristic=False this is Dijkstra stopped at the destination.
+
+        Returns (route node ids, cost, number of settled nodes).
+        """
+        compiled = self.compiled_graph([weight])
+        orig, dest = compiled.node_index([orig_node, dest_node]).tolist()
+        indptr, targets, costs = compiled.adjacency(weight)
+        scale = compiled.min_cost_per_meter(weight) if use_heuristic else 0.0
+        x, y = compiled.x, compiled.y
+        target_x, target_y = x[dest], y[dest]
+
+        best_cost = {orig: 0.0}
+        parent = {orig: -1}
+        settled = set()
+        heap = [(scale * math.hypot(x[orig] - target_x, y[orig] - target_y), 0.0, orig)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            if node == dest:
+                break
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = targets[i]
+                new_cost = cost + costs[i]
+                if new_cost < best_cost.get(neighbor, math.inf):
+                    best_cost[neighbor] = new_cost
+                    parent[neighbor] = node
+                    estimate = new_cost + scale * math.hypot(x[neighbor] - target_x, y[neighbor] - target_y)
+                    heapq.heappush(heap, (estimate, new_cost, neighbor))
+
+        if dest not in settled:
+            return [], math.inf, len(settled)
+        route = [dest]
+        while parent[route[-1]] != -1:
+            route.append(parent[route[-1]])
+        route.reverse()
+        return compiled.node_ids[route].tolist(), best_cost[dest], len(settled)
+
+    @Profiling.stage('routing', items=1)
+    def bidirectional_path(self, orig_node, dest_node, weight='length', use_heuristic=True):
+        """
+        Bidirectional search on the compiled graph, with the average of the forward and backward Euclidean
+        heuristics as potential (bidirectional A*); use_heuristic=False gives bidirectional Dijkstra.
+
+        Both searches run Dijkstra on the same reduced costs, so the usual stopping rule applies: stop when
+        the two smallest keys add up to the best meeting cost found so far.
+
+        Returns (route node ids, cost, number of settled nodes).
+        """
+        compiled = self.compiled_graph([weight])
+        orig, dest = compiled.node_index([orig_node, dest_node]).tolist()
+        if orig == dest:
+            return [orig_node], 0.0, 0
+        scale = compiled.min_cost_per_meter(weight) if use_heuristic else 0.0
+        x, y = compiled.x, compiled.y
+
+        def potential(node):
+            to_dest = math.hypot(x[node] - x[dest], y[node] - y[dest])
+            from_orig = math.hypot(x[node] - x[orig], y[node] - y[orig])
+            return scale * (to_dest - from_orig) / 2
+
+        # direction 0 searches forward from orig, direction 1 backward from dest; potentials have opposite signs
+        adjacency = [compiled.adjacency(weight), compiled.adjacency(weight, reverse=True)]
+        sign = [1.0, -1.0]
+        start = [orig, dest]
+        best_cost = [{orig: 0.0}, {dest: 0.0}]
+        parent = [{orig: -1}, {dest: -1}]
+        settled = [set(), set()]
+        heaps = [[(0.0, orig)], [(0.0, dest)]]
+        offset = [-potential(orig), potential(dest)]
+
+        best_total = math.inf
+        meeting = None
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best_total + potential(dest) - potential(orig):
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            _, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+
+            indptr, targets, costs = adjacency[side]
+            cost = best_cost[side][node]
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = targets[i]
+                new_cost = cost + costs[i]
+                if new_cost < best_cost[side].get(neighbor, math.inf):
+                    best_cost[side][neighbor] = new_cost
+                    parent[side][neighbor] = node
+                    key = new_cost + sign[side] * potential(neighbor) + offset[side]
+                    heapq.heappush(heaps[side], (key, neighbor))
+                    other = best_cost[1 - side].get(neighbor)
+                    if other is not None and new_cost + other < best_total:
+                        best_total = new_cost + other
+                        meeting = neighbor
+
+        if meeting is None:
+            return [], math.inf, len(settled[0]) + len(settled[1])
+
+        route = [meeting]
+        while parent[0][route[-1]] != -1:
+            route.append(parent[0][route[-1]])
+        route.reverse()
+        node = meeting
+        while parent[1][node] != -1:
+            node = parent[1][node]
+            route.append(node)
+        return compiled.node_ids[route].tolist(), best_total, len(settled[0]) + len(settled[1])
+
+    @Profiling.stage('routing', items=1)
+    def partial_route(self, orig_xy, dest_xy, intervals, weight='length'):
+        """
+        Route between two points snapped onto the middle of their nearest edges.
+
+        The walk starts at the snapped origin, leaves its edge through either end node, and ends on the
+        destination edge at the snapped destination; both points on the same street (one edge or its
+        reverse twin) are joined directly. Parts of edges are costed from the shaded stretches of a
+        ShadedIntervals built for the current G, so 'cost_i' of a part uses the shade of that part only.
+        Edge ends can be walked in either direction, as on foot.
+
+        Returns {'route_nodes', 'cost', 'length', 'shaded_length', 'edges', 'starts', 'ends', 'profile'}:
+        the walk is parts starts[i] -> ends[i] (meters along edges[i], rows of SnapIndex.edge_keys; end
+        before start means walked backwards) and profile is its ShadedIntervals.profile table.
+        """
+        compiled = self.compiled_graph([weight])
+        if len(intervals.lengths) != len(compiled.length):
+            raise ValueError("The shaded intervals were built for a different graph.")
+        edges, _, offsets = self.open_street_map_object.snap_index().nearest_edges(
+            [orig_xy[0], dest_xy[0]], [orig_xy[1], dest_xy[1]])
+        orig_edge, dest_edge = edges.tolist()
+        orig_offset, dest_offset = offsets.tolist()
+        orig_length, dest_length = intervals.lengths[[orig_edge, dest_edge]].tolist()
+
+        def cost(edge, start, end):
+            return float(intervals.piece_costs([edge], [start], [end], weight, compiled.costs[weight])[0])
+
+        candidates = []
+        # Both points on one street: walk straight along it
+        twin = (compiled.edge_u[dest_edge] == compiled.edge_v[orig_edge]
+                and compiled.edge_v[dest_edge] == compiled.edge_u[orig_edge]
+                and abs(dest_length - orig_length) < 1e-6)
+        if dest_edge == orig_edge or twin:
+            end = dest_offset if dest_edge == orig_edge else orig_length - dest_offset
+            candidates.append((cost(orig_edge, orig_offset, end), [], [(orig_edge, orig_offset, end)]))
 
+        # Leave the origin edge through u (backwards) or v, reach the destination edge at u or v (backwards)
+        exits = [(compiled.edge_u[orig_edge], (orig_edge, orig_offset, 0.0)),
+                 (compiled.edge_v[orig_edge], (orig_edge, orig_offset, orig_length))]
+        entries = [(compiled.edge_u[dest_edge], (dest_edge, 0.0, dest_offset)),
+                   (compiled.edge_v[dest_edge], (dest_edge, dest_length, dest_offset))]
+        distances, predecessors = dijkstra(compiled.matrix(weight)[0], indices=[node for node, _ in exits],
+                                           return_predecessors=True)
+        for row, (exit_node, first) in enumerate(exits):
+            for entry_node, last in entries:
+                if np.isinf(distances[row, entry_node]):
+                    continue
+                total = cost(*first) + distances[row, entry_node] + cost(*last)
+                route = CompiledGraph.route_from_predecessors(predecessors[row], exit_node, entry_node)
+                middle = [(edge, 0.0, intervals.lengths[edge]) for edge in compiled.pair_edges(weight, route).tolist()]
+                candidates.append((float(total), route, [first] + middle + [last]))
 
+        if not candidates:
+            return {'route_nodes': [], 'cost': math.inf, 'length': 0.0, 'shaded_length': 0.0,
+                    'edges': np.array([], dtype=np.int64), 'starts': np.array([]), 'ends': np.array([]),
+                    'profile': intervals.profile([])}
+        total, route, parts = min(candidates, key=lambda candidate: candidate[0])
+        edges, starts, ends = (np.array(values) for values in zip(*parts))
+        edges = edges.astype(np.int64)
+        length, shaded = intervals.totals(edges, starts, ends)
+        return {'route_nodes': compiled.node_ids[route].tolist(), 'cost': total, 'length': length,
+                'shaded_length': shaded, 'edges': edges, 'starts': starts, 'ends': ends,
+                'profile': intervals.profile(edges, starts, ends)}
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+from Compiled_Graph import CompiledGraph
+
+# Compiled graph of a batch routing worker process, set once by init_route_worker
+_worker_graph = None
+
+
+def init_route_worker(compiled):
+    """Process pool initializer: the compiled graph the route_origin_chunk tasks of this process search"""
+    global _worker_graph
+    _worker_graph = compiled
+
+
+def route_origin_chunk(task):
+    """
+    One single-source search per origin of the chunk, serving all the destinations of that origin.
+    """
+    weight, origins, od_rows, od_origin, od_dest = task
+    compiled = _worker_graph
+    matrix = compiled.matrix(weight)[0]
+    distances, predecessors = dijkstra(matrix, indices=origins, return_predecessors=True)
+
+    costs = distances[od_origin, od_dest]
+    lengths = np.zeros(len(od_rows))
+    shaded = np.zeros(len(od_rows))
+    routes = []
+    for i, (row, dest) in enumerate(zip(od_origin, od_dest)):
+        route = CompiledGraph.route_from_predecessors(predecessors[row], origins[row], dest)
+        edges = compiled.pair_edges(weight, route)
+        lengths[i] = compiled.length[edges].sum()
+        shaded[i] = compiled.shaded_length[edges].sum()
+        routes.append(np.asarray(route, dtype=np.int64))
+    return weight, od_rows, costs, lengths, shaded, routes
+
+
+def origin_tasks(weight, origins, destinations, chunk_size=64):
+    """
+    Group OD pairs (node positions) by origin and cut the distinct origins into route_origin_chunk tasks.
+    """
+    order = np.argsort(origins, kind='stable')
+    unique_origins, origin_row = np.unique(origins[order], return_inverse=True)
+    # origin_row is sorted, so the pairs of each chunk of origins are one slice of order
+    chunk_starts = np.arange(0, len(unique_origins), chunk_size)
+    bounds = np.searchsorted(origin_row, np.append(chunk_starts, len(unique_origins))).tolist()
+    tasks = []
+    for start, low, high in zip(chunk_starts.tolist(), bounds[:-1], bounds[1:]):
+        tasks.append((weight, unique_origins[start:start + chunk_size], order[low:high],
+                      origin_row[low:high] - start, destinations[order[low:high]]))
+    return tasks
@@ -0,0 +1,138 @@
+import argparse
+import json
+import time
+import numpy as np
+import geopandas as gpd
+from Synthetic_City import SyntheticCity
+from Open_Street_Map import Open_Street_Map
+from Class_Shadow import Class_Shadow
+from Snap_Index import SnapIndex
+from Algorithmica import Algorithmic
+
+SCALES = [100, 1000, 10000, 100000]
+# A fixed afternoon sun so runs are comparable
+AZIMUTH = 220.0
+ALTITUDE = 35.0
+
+
+class Benchmark:
+    """
+    Times every stage of the shadow and routing pipeline on synthetic cities of growing size.
+
+    Stages run in pipeline order on the same city, each repeated and reported by its best wall time:
+    shadows (generate_shadows), coverage (compute_coverage), costs (make_new_weights and the compiled
+    cost columns), snapping (index build and a batch of point queries) and routing (batch_routes and
+    A* over random origin-destination pairs).
+    """
+
+    def __init__(self, scales=SCALES, repeat=3, queries=1000, pairs=200, seed=0):
+        self.scales = scales
+        self.repeat = repeat
+        self.queries = queries
+        self.pairs = pairs
+        self.seed = seed
+
+    def best_time(self, stage):
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            stage()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def run_scale(self, n_buildings):
+        rng = np.random.default_rng(self.seed)
+        results = {}
+        start = time.perf_counter()
+        G, buildings = SyntheticCity.generate(n_buildings, self.seed)
+        results['generate'] = time.perf_counter() - start
+        osm_object = Open_Street_Map.from_data(G, buildings)
+
+        shadows = Class_Shadow.generate_shadows(buildings, AZIMUTH, ALTITUDE)
+        results['shadows'] = self.best_time(lambda: Class_Shadow.generate_shadows(buildings, AZIMUTH, ALTITUDE))
+
+        shadow_gdf = gpd.GeoDataFrame(geometry=shadows, crs=buildings.crs)
+        results['coverage'] = self.best_time(lambda: Class_Shadow.compute_coverage(G, shadow_gdf))
+
+        algorithmic = Algorithmic(osm_object)
+        cost_names = ('length', 'cost_2', 'cost_4')
+
+        def costs():
+            Class_Shadow.make_new_weights(G)
+            algorithmic.compiled_graph(refresh=True).add_shade_costs()
+        results['costs'] = self.best_time(costs)
+
+        bounds = osm_object.combined_bounds
+        x = rng.uniform(bounds[0], bounds[2], self.queries)
+        y = rng.uniform(bounds[1], bounds[3], self.queries)
+
+        def snapping():
+            index = SnapIndex(G)
+            index.nearest_nodes(x, y)
+            index.nearest_edges(x, y)
+        results['snapping'] = self.best_time(snapping)
+
+        node_ids = np.array(list(G.nodes))
+        od_pairs = rng.choice(node_ids, size=(self.pairs, 2))
+        results['routing'] = self.best_time(lambda: algorithmic.batch_routes(od_pairs, cost_names, processes=1))
+        results['astar'] = self.best_time(lambda: [algorithmic.astar_path(orig, dest, 'cost_2')
+                                                   for orig, dest in od_pairs[:20].tolist()])
+        return {'buildings': len(buildings), 'nodes': len(G), 'edges': G.number_of_edges(), 'seconds': results}
+
+    def run(self):
+        report = []
+        for n_buildings in self.scales:
+            report.append(self.run_scale(n_buildings))
+            self.print_row(report[-1])
+        return report
+
+    @staticmethod
+    def print_row(row):
+        stages = '  '.join(f"{name} {seconds * 1000:9.1f} ms" for name, seconds in row['seconds'].items())
+        print(f"{row['buildings']:>7} buildings {row['edges']:>7} edges  {stages}")
+
+    @staticmethod
+    def regressions(report, baseline, tolerance=0.25):
+        """
+        (buildings, stage, seconds, baseline seconds) of every stage more than tolerance slower than the
+        baseline report at the same scale.
+        """
+        baseline_rows = {row['buildings']: row['seconds'] for row in baseline}
+        slower = []
+        for row in report:
+            for stage, seconds in row['seconds'].items():
+                reference = baseline_rows.get(row['buildings'], {}).get(stage)
+                if reference is not None and seconds > reference * (1 + tolerance):
+                    slower.append((row['buildings'], stage, seconds, reference))
+        return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shadow/routing pipeline on synthetic cities")
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help="numbers of buildings")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=1000, help="snapping queries per scale")
+    parser.add_argument('--pairs', type=int, default=200, help="origin-destination pairs per scale")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write the report as JSON")
+    parser.add_argument('--baseline', default=None, help="JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    report = Benchmark(args.scales, args.repeat, args.queries, args.pairs, args.seed).run()
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            slower = Benchmark.regressions(report, json.load(file), args.tolerance)
+        for n_buildings, stage, seconds, reference in slower:
+            print(f"REGRESSION {n_buildings} buildings {stage}: {seconds * 1000:.1f} ms "
+                  f"(baseline {reference * 1000:.1f} ms)")
+        if slower:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
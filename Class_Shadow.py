@@ -1,12 +1,19 @@
+import logging
 import numpy as np
 import osmnx as ox
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
+import shapely
 from shapely.geometry import MultiPolygon, Polygon, LineString, MultiLineString, GeometryCollection
 from shapely.ops import unary_union
 from shapely.ops import linemerge
-import re
+import Profiling
+
+logger = logging.getLogger(__name__)
+
+# Shade discounts of the cost_1..cost_4 edge weights: shaded meters count as 1/delta meters
+DELTAS = [1, 10, 50, 80]
 
 
 class Class_Shadow:
@@ -18,6 +25,7 @@ class Class_Shadow:
         return Polygon(shadow_coords)
 
     @staticmethod
+    @Profiling.traced
     def generate_distorted_shadow(building, azimuth, altitude):
         """
         Generate a realistically distorted shadow for a building polygon based on sun altitude and azimuth.
@@ -48,7 +56,7 @@ class Class_Shadow:
         # Ensure the geometry is valid
         if isinstance(footprint, (Polygon, MultiPolygon)):
             if footprint.is_empty:
-                print("Warning: Empty geometry for building.")
+                logger.warning("Empty geometry for building.")
                 return footprint
 
             # Get the coordinates of the polygon's exterior
@@ -85,8 +93,8 @@ class Class_Shadow:
             combined_polygon = unary_union([inflated_footprint, buffered_shadow])
 
             # Print information for debugging or verification
-            print(f"Building Height: {height}, Altitude: {altitude_value}, Shadow Length: {shadow_length}")
-            print(f"Azimuth: {azimuth}, Shadow Vector: {shadow_vector}")
+            logger.debug("Building Height: %s, Altitude: %s, Shadow Length: %s", height, altitude_value, shadow_length)
+            logger.debug("Azimuth: %s, Shadow Vector: %s", azimuth, shadow_vector)
 
             if isinstance(combined_polygon, Polygon):
                 # Create a new Polygon without holes
@@ -102,6 +110,184 @@ class Class_Shadow:
             raise ValueError(f"Invalid geometry type for footprint: {type(footprint)}")
 
     @staticmethod
+    def _scalar(value):
+        """
+        Extract a float from a sun position value (pvlib returns one-element Series).
+        """
+        if isinstance(value, pd.Series):
+            return float(value.iloc[0])
+        return float(value)
+
+    @staticmethod
+    def generate_shadows(buildings_gdf, azimuth, altitude, mode='distorted', bounds=None, cache=None, executor=None):
+        """
+        Vectorized version of generate_distorted_shadow for all buildings at once.
+        mode='prism' returns the exact shadows of generate_prism_shadows instead (bounds is only used there).
+        cache: a Shadow_Cache.ShadowCache that reuses the shadows of earlier calls (at its quantized sun position).
+        executor: a Shared_Executor.SharedExecutor that spreads the buildings over its process pool.
+
+        Works on the flat coordinate array of every footprint exterior, so the per-vertex
+        stretch, the 0.5 m buffers, the union and the hole filling run as shapely array
+        operations instead of one Python loop per building. MultiPolygon footprints are
+        split into their parts, each part gets its own shadow and the parts are merged back.
+
+        Returns a GeoSeries aligned with buildings_gdf.index (None where there is no shadow:
+        non polygonal or empty footprints and buildings without height).
+        """
+        if cache is not None:
+            return cache.shadows(buildings_gdf, azimuth, altitude, mode=mode, bounds=bounds)
+        if executor is not None:
+            return executor.shadows(buildings_gdf, azimuth, altitude, mode=mode, bounds=bounds)
+        with Profiling.stage('shadows', items=len(buildings_gdf)):
+            if mode == 'prism':
+                return Class_Shadow.generate_prism_shadows(buildings_gdf, azimuth, altitude, bounds)
+            if mode != 'distorted':
+                raise ValueError(f"Unknown shadow mode '{mode}', expected 'distorted' or 'prism'.")
+            return Class_Shadow._generate_shadows(buildings_gdf, azimuth, altitude)
+
+    @staticmethod
+    def _generate_shadows(buildings_gdf, azimuth, altitude):
+        azimuth = Class_Shadow._scalar(azimuth)
+        altitude = Class_Shadow._scalar(altitude)
+
+        footprints = buildings_gdf.geometry.to_numpy()
+        heights = pd.to_numeric(buildings_gdf['height'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        shadow_lengths = heights / max(0.1, np.tan(np.radians(altitude)))
+
+        result = np.full(len(footprints), None, dtype=object)
+
+        # Split MultiPolygons into parts and keep only non empty polygons of buildings with a shadow
+        parts, part_building = shapely.get_parts(footprints, return_index=True)
+        keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts) & (shadow_lengths[part_building] > 0)
+        parts, part_building = parts[keep], part_building[keep]
+        if len(parts) == 0:
+            return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+        # Flat exterior coordinates of all parts, ring_idx maps every vertex to its part
+        coords, ring_idx = shapely.get_coordinates(shapely.get_exterior_ring(parts), return_index=True)
+        counts = np.bincount(ring_idx)
+        centroids = np.column_stack([
+            np.bincount(ring_idx, weights=coords[:, 0]) / counts,
+            np.bincount(ring_idx, weights=coords[:, 1]) / counts,
+        ])
+
+        # Shadow direction (away from the sun) and per vertex stretch, same rules as generate_distorted_shadow
+        azimuth_radians = np.radians(azimuth)
+        direction = np.array([-np.sin(azimuth_radians), -np.cos(azimuth_radians)])
+        vertex_building = part_building[ring_idx]
+        vertex_height = heights[vertex_building]
+        vertex_length = shadow_lengths[vertex_building]
+        projection = (coords - centroids[ring_idx]) @ direction
+        stretch_factor = np.where(projection >= 0, 0.5 + projection / (2 * vertex_height), 0.2)
+        distorted = coords + direction * (vertex_length * stretch_factor)[:, None]
+
+        shadow_polygons = shapely.polygons(shapely.linearrings(distorted, indices=ring_idx))
+        # quad_segs=16 matches the default of Polygon.buffer used by generate_distorted_shadow
+        combined = shapely.union(shapely.buffer(parts, 0.5, quad_segs=16), shapely.buffer(shadow_polygons, 0.5, quad_segs=16))
+
+        # Fill the holes of every piece and merge the pieces that belong to the same building
+        pieces, piece_part = shapely.get_parts(combined, return_index=True)
+        filled = shapely.polygons(shapely.get_exterior_ring(pieces))
+        Class_Shadow._merge_pieces(result, filled, part_building[piece_part])
+        return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+    @staticmethod
+    def _merge_pieces(result, pieces, piece_building):
+        """Store every building's piece in result, the union where a building has several pieces"""
+        piece_counts = np.bincount(piece_building, minlength=len(result))
+        single = piece_counts[piece_building] == 1
+        result[piece_building[single]] = pieces[single]
+        multi = np.flatnonzero(~single)
+        if len(multi):
+            multi = multi[np.argsort(piece_building[multi], kind='stable')]
+            groups = np.split(multi, np.flatnonzero(np.diff(piece_building[multi])) + 1)
+            for group in groups:
+                result[piece_building[group[0]]] = shapely.union_all(pieces[group])
+
+    @staticmethod
+    def generate_prism_shadows(buildings_gdf, azimuth, altitude, bounds=None):
+        """
+        Exact shadow on flat ground of every footprint extruded to its height.
+
+        The shadow is the footprint swept along the sun vector over height / tan(altitude) meters (a
+        Minkowski sum with a segment): the convex hull of the footprint and its translated copy for
+        convex footprints, and otherwise the union of both copies with the parallelogram swept by every
+        ring edge. The footprint is part of the shadow, as in generate_shadows.
+
+        bounds (minx, miny, maxx, maxy): analysis extent; shadows are shortened to where they leave it and
+        clipped to it, so a sun near the horizon does not produce kilometer long polygons. Returns a
+        GeoSeries aligned with buildings_gdf.index, all None when the sun is below the horizon.
+        """
+        azimuth = Class_Shadow._scalar(azimuth)
+        altitude = Class_Shadow._scalar(altitude)
+        footprints = buildings_gdf.geometry.to_numpy()
+        result = np.full(len(footprints), None, dtype=object)
+        if altitude <= 0:
+            return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+        heights = pd.to_numeric(buildings_gdf['height'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        parts, part_building = shapely.get_parts(footprints, return_index=True)
+        keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts) & (heights[part_building] > 0)
+        parts, part_building = parts[keep], part_building[keep]
+        if len(parts) == 0:
+            return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+        # Shadow vector of every part, away from the sun
+        azimuth_radians = np.radians(azimuth)
+        direction = np.array([-np.sin(azimuth_radians), -np.cos(azimuth_radians)])
+        length = heights[part_building] / np.tan(np.radians(altitude))
+        if bounds is not None:
+            # Beyond this length the translated footprint has left the bounds on the x or the y axis
+            part_bounds = shapely.bounds(parts)
+            for axis in (0, 1):
+                if direction[axis] > 1e-12:
+                    length = np.minimum(length, (bounds[axis + 2] - part_bounds[:, axis]) / direction[axis])
+                elif direction[axis] < -1e-12:
+                    length = np.minimum(length, (bounds[axis] - part_bounds[:, axis + 2]) / direction[axis])
+            length = np.maximum(length, 0.0)
+        vector = length[:, None] * direction
+
+        coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+        translated = shapely.transform(parts, lambda xy: xy + vector[coord_part])
+        shadows = np.empty(len(parts), dtype=object)
+
+        area = shapely.area(parts)
+        convex = shapely.area(shapely.convex_hull(parts)) - area <= 1e-9 * np.maximum(1.0, area)
+        convex_idx = np.flatnonzero(convex)
+        if len(convex_idx):
+            # Hull of the vertices of both copies, numbered 0..n-1 over the convex parts for multipoints
+            selected = convex[coord_part]
+            hull_index = (np.cumsum(convex) - 1)[coord_part[selected]]
+            hull_coords = np.concatenate([coords[selected], coords[selected] + vector[coord_part[selected]]])
+            hull_index = np.concatenate([hull_index, hull_index])
+            order = np.argsort(hull_index, kind='stable')
+            shadows[convex_idx] = shapely.convex_hull(shapely.multipoints(hull_coords[order], indices=hull_index[order]))
+
+        concave = np.flatnonzero(~convex)
+        if len(concave):
+            # Parallelogram swept by every ring edge of the concave parts
+            rings, ring_part = shapely.get_rings(parts[concave], return_index=True)
+            ring_coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+            segment = np.flatnonzero(ring_idx[1:] == ring_idx[:-1])
+            segment_part = ring_part[ring_idx[segment]]
+            offset = vector[concave][segment_part]
+            a, b = ring_coords[segment], ring_coords[segment + 1]
+            swept = shapely.polygons(np.stack([a, b, b + offset, a + offset, a], axis=1))
+            order = np.argsort(segment_part, kind='stable')
+            groups = np.split(order, np.flatnonzero(np.diff(segment_part[order])) + 1)
+            for group in groups:
+                part = concave[segment_part[group[0]]]
+                shadows[part] = shapely.union_all(np.concatenate([[parts[part], translated[part]], swept[group]]))
+
+        if bounds is not None:
+            shadows = shapely.clip_by_rect(shadows, *bounds)
+        pieces, piece_part = shapely.get_parts(shadows, return_index=True)
+        polygonal = shapely.get_type_id(pieces) == 3
+        Class_Shadow._merge_pieces(result, pieces[polygonal], part_building[piece_part[polygonal]])
+        return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+    @staticmethod
+    @Profiling.traced
     def project_shadow(building, azimuth, altitude):
         """
         Creates a shadow polygon for a building by calling the shadow generation function.
@@ -123,7 +309,7 @@ class Class_Shadow:
         # Ensure the footprint is valid
         if isinstance(footprint, (Polygon, MultiPolygon)):
             if footprint.is_empty:
-                print("Warning: Empty geometry for building.")
+                logger.warning("Empty geometry for building.")
                 return footprint
 
             # Call the shadow generation function
@@ -134,14 +320,15 @@ class Class_Shadow:
             # Combine the building footprint and the shadow to ensure continuity
             extended_polygon = footprint.union(shadow_polygon)
 
-            print(f"Building Height: {height}, Altitude: {altitude_value}, Shadow Length: {shadow_length}")
-            print(f"Azimuth: {azimuth}, Shadow Polygon Created: {shadow_polygon is not None}")
+            logger.debug("Building Height: %s, Altitude: %s, Shadow Length: %s", height, altitude_value, shadow_length)
+            logger.debug("Azimuth: %s, Shadow Polygon Created: %s", azimuth, shadow_polygon is not None)
 
             return extended_polygon
         else:
             raise ValueError(f"Invalid geometry type for footprint: {type(footprint)}")
 
     @staticmethod
+    @Profiling.traced
     def calculate_shadow_weight(edge, shadows):
         edge_geom = edge['geometry']
         shadowed_length = 0
@@ -152,10 +339,50 @@ class Class_Shadow:
 
         return shadowed_length / edge_geom.length  # Fraction of edge in shadow
 
+    @staticmethod
+    def _label_buildings(ax, buildings):
+        """
+        Write the numeric part of 'addr:housenumber' at the centroid of every building that has one.
+        """
+        if 'addr:housenumber' not in buildings.columns:
+            return
+        numeric = buildings['addr:housenumber'].astype('string').str.findall(r'\d+').str.join('')
+        labeled = numeric.notna() & (numeric != '')
+        centroids = buildings.geometry[labeled].centroid
+        for x, y, text in zip(centroids.x, centroids.y, numeric[labeled]):
+            ax.text(x, y, text, fontsize=8, color='black', alpha=0.9, ha='center')
+
+    @staticmethod
+    def _zoom_out(ax, margin=0.1):
+        """
+        Add a margin (10% by default) around the current axis limits.
+        """
+        x_min, x_max = ax.get_xlim()
+        y_min, y_max = ax.get_ylim()
+        x_margin = (x_max - x_min) * margin
+        y_margin = (y_max - y_min) * margin
+        ax.set_xlim(x_min - x_margin, x_max + x_margin)
+        ax.set_ylim(y_min - y_margin, y_max + y_margin)
+
+    @staticmethod
+    def _to_graph_crs(G, shadow_gdf):
+        """
+        Return shadow_gdf in the CRS of G, which must be defined.
+        """
+        graph_crs = G.graph.get('crs', None)
+        if graph_crs is None:
+            raise ValueError("Graph G does not have a defined CRS. Please make sure it has a valid CRS.")
+        if shadow_gdf.crs != graph_crs:
+            shadow_gdf = shadow_gdf.to_crs(graph_crs)
+        return shadow_gdf
+
     @staticmethod
     def analyze_and_plot_coverage(G, buildings, custom_bounds=None, plot=True):
-        # Step 1: Create a MultiPolygon for all shadow geometries
-        all_shadows = MultiPolygon([shadow for shadow in buildings['shadow_geometry'] if shadow is not None])
+        if not plot:
+            return None
+
+        # Step 1: Collect all shadow geometries
+        all_shadows = gpd.GeoSeries([shadow for shadow in buildings['shadow_geometry'] if shadow is not None])
 
         # Step 2: Plot all the shadows, paths, and buildings with numeric addresses
         fig, ax = plt.subplots(figsize=(14, 14))
@@ -164,54 +391,52 @@ class Class_Shadow:
         ox.plot_graph(G, ax=ax, show=False, close=False, edge_color='gray', edge_linewidth=0.5)
 
         # Plot all shadows on top of roads
-        shadows_gdf = gpd.GeoSeries(all_shadows)
-        shadows_gdf.plot(ax=ax, color='darkgrey', alpha=0.7, label='Shadows')
+        all_shadows.plot(ax=ax, color='darkgrey', alpha=0.7, label='Shadows')
 
         # Plot buildings
         buildings.plot(ax=ax, color='orange', alpha=0.7, edgecolor='black')
 
-        # Adding numeric house number labels to buildings if available
-        for idx, building in buildings.iterrows():
-            housenumber = building.get('addr:housenumber', None)
-
-            if pd.notna(housenumber):
-                # Extract only the numeric part of the house number
-                numeric_housenumber = ''.join(re.findall(r'\d+', str(housenumber)))
-
-                if numeric_housenumber:  # Only label if a numeric part exists
-                    centroid = building.geometry.centroid
-                    ax.text(centroid.x, centroid.y, numeric_housenumber, fontsize=8, color='black', alpha=0.9,
-                            ha='center')
-
-        x_min, x_max = ax.get_xlim()
-        y_min, y_max = ax.get_ylim()
-
-        # Add a margin to zoom out (e.g., 10% margin)
-        margin = 0.1  # 10% margin
-        x_margin = (x_max - x_min) * margin
-        y_margin = (y_max - y_min) * margin
-
-        # Set new limits with the added margin
-        ax.set_xlim(x_min - x_margin, x_max + x_margin)
-        ax.set_ylim(y_min - y_margin, y_max + y_margin)
+        Class_Shadow._label_buildings(ax, buildings)
+        Class_Shadow._zoom_out(ax)
 
         # Add legend and labels
         ax.set_title('Buildings, Shadows, and Paths at Ben Gurion University with Numeric House Numbers')
         ax.set_xlabel('Longitude')
         ax.set_ylabel('Latitude')
-        if plot:
-            plt.show()
+        plt.show()
+        return fig, ax
 
     @staticmethod
-    def analyze_coverage(G, shadow_gdf, buildings, custom_bounds=None,plot=True):
-        # Ensure CRS consistency before analyzing paths
-        graph_crs = G.graph.get('crs', None)
-        if graph_crs is None:
-            raise ValueError("Graph G does not have a defined CRS. Please make sure it has a valid CRS.")
+    def compute_coverage(G, shadow_gdf, tile_size=100.0, engine=None, raster=None, executor=None):
+        """
+        Headless coverage stage: no figure and no output.
 
-        # Ensure both datasets are in the same CRS
-        if shadow_gdf.crs != graph_crs:
-            shadow_gdf = shadow_gdf.to_crs(graph_crs)
+        Writes 'shadow_coverage' (percent) and 'shaded_length' on every edge of G with one bulk query
+        against the dissolved shadow layer, and returns the per edge table
+        (u, v, key, shaded_length, total_length, fraction).
+        raster: a Raster_Coverage.RasterCoverage of G for the fast approximate mode instead.
+        executor: a Shared_Executor.SharedExecutor that spreads the edges over its process pool.
+        """
+        with Profiling.stage('coverage', items=G.number_of_edges()):
+            shadow_gdf = Class_Shadow._to_graph_crs(G, shadow_gdf)
+            if raster is not None:
+                return raster.apply_to_graph(G, shadow_gdf.geometry)
+            if executor is not None:
+                return executor.apply_to_graph(G, shadow_gdf.geometry)
+            if engine is None:
+                engine = ShadowCoverage(shadow_gdf.geometry, tile_size=tile_size)
+            return engine.apply_to_graph(G)
+
+    @staticmethod
+    def plot_coverage(G, shadow_gdf, buildings, engine=None, show=True):
+        """
+        Rendering stage: shadows, buildings, all paths and their shaded parts in red.
+
+        Edges and shaded pieces are drawn as one collection each instead of one ax.plot per edge.
+        """
+        shadow_gdf = Class_Shadow._to_graph_crs(G, shadow_gdf)
+        if engine is None:
+            engine = ShadowCoverage(shadow_gdf.geometry)
 
         # Create a larger figure for visualization
         fig, ax = plt.subplots(figsize=(15, 15), dpi=100)
@@ -225,82 +450,15 @@ class Class_Shadow:
         # Plot the graph with all paths using osmnx
         ox.plot_graph(G, ax=ax, show=False, close=False, edge_color="gray", edge_linewidth=1)
 
-        for u, v, key, edge in G.edges(keys=True, data=True):
-            path = edge.get('geometry')
-
-            if path is not None and isinstance(path, (LineString, MultiLineString)):
-                if isinstance(path, MultiLineString):
-                    path = linemerge(path)  # Merge MultiLineString into LineString
-
-                # Validate and buffer the path slightly to improve intersection accuracy
-                if not path.is_valid:
-                    path = path.buffer(0)
-
-                # Step 6: Find the intersection of the path with the combined geometry
-                intersection = shadow_gdf.unary_union.intersection(path)
-
-                # Step 7: Calculate the covered length
-                covered_path_length = 0
-                if isinstance(intersection, LineString):
-                    covered_path_length = intersection.length
-                elif isinstance(intersection, MultiLineString):
-                    covered_path_length = sum(line.length for line in intersection.geoms)
-                elif isinstance(intersection, GeometryCollection):
-                    covered_path_length = sum(
-                        geom.length for geom in intersection.geoms if isinstance(geom, (LineString, MultiLineString)))
-
-                # Calculate the length of the path
-                total_path_length = path.length
-
-                # Calculate coverage percentage
-                coverage_percentage = (covered_path_length / total_path_length) * 100 if total_path_length > 0 else 0
-
-                # Add the coverage percentage as an attribute to the edge
-                G[u][v][key]['shadow_coverage'] = coverage_percentage
-
-                # Plot the path
-                x, y = path.xy
-                ax.plot(x, y, color='gray', linestyle='-', linewidth=2, alpha=0.7)
-
-                # Plot the covered portion of the path in red
-                if not intersection.is_empty:
-                    if isinstance(intersection, LineString):
-                        x, y = intersection.xy
-                        ax.plot(x, y, color='red', linestyle='-', linewidth=3, alpha=0.9)
-                    elif isinstance(intersection, MultiLineString):
-                        for line in intersection.geoms:
-                            x, y = line.xy
-                            ax.plot(x, y, color='red', linestyle='-', linewidth=3, alpha=0.9)
-
-        # Step 8: Output the results for each path
-        for u, v, key, data in G.edges(keys=True, data=True):
-            coverage = data.get('shadow_coverage', 0)
-            print(f"Edge {u}-{v}: {coverage:.2f}% covered by shadow/buildings")
-
-        # Adding numeric house number labels to buildings if available
-        for idx, building in buildings.iterrows():
-            housenumber = building.get('addr:housenumber', None)
-
-            if pd.notna(housenumber):
-                # Extract only the numeric part of the house number
-                numeric_housenumber = ''.join(re.findall(r'\d+', str(housenumber)))
-
-                if numeric_housenumber:  # Only label if a numeric part exists
-                    centroid = building.geometry.centroid
-                    ax.text(centroid.x, centroid.y, numeric_housenumber, fontsize=8, color='black', alpha=0.9,
-                            ha='center')
+        # Plot the paths and the covered portion of the paths in red
+        edge_keys, edge_geoms = engine.edge_arrays(G)
+        gpd.GeoSeries(edge_geoms).plot(ax=ax, color='gray', linestyle='-', linewidth=2, alpha=0.7)
+        _, pieces = engine.shaded_pieces(edge_geoms)
+        if len(pieces):
+            gpd.GeoSeries(pieces).plot(ax=ax, color='red', linestyle='-', linewidth=3, alpha=0.9)
 
-        x_min, x_max = ax.get_xlim()
-        y_min, y_max = ax.get_ylim()
-
-        # Add a margin to zoom out (e.g., 10% margin)
-        margin = 0.1  # 10% margin
-        x_margin = (x_max - x_min) * margin
-        y_margin = (y_max - y_min) * margin
-
-        # Set new limits with the added margin
-        ax.set_xlim(x_min - x_margin, x_max + x_margin)
-        ax.set_ylim(y_min - y_margin, y_max + y_margin)
+        Class_Shadow._label_buildings(ax, buildings)
+        Class_Shadow._zoom_out(ax)
 
         # Add title and labels
         plt.title("Buildings, Shadows, and Paths at Ben Gurion University", fontsize=20)
@@ -310,26 +468,215 @@ class Class_Shadow:
         # Improve visibility of plot grid and background
         ax.grid(True, linestyle='--', linewidth=0.5)
 
-        # Show the plot
         plt.tight_layout()
-        if plot:
+        if show:
             plt.show()
+        return fig, ax
+
+    @staticmethod
+    def analyze_coverage(G, shadow_gdf, buildings, custom_bounds=None, plot=True):
+        """
+        Compute the coverage table of all edges and, only if plot is True, render it.
+        """
+        shadow_gdf = Class_Shadow._to_graph_crs(G, shadow_gdf)
+        engine = ShadowCoverage(shadow_gdf.geometry)
+        coverage = Class_Shadow.compute_coverage(G, shadow_gdf, engine=engine)
+        if plot:
+            Class_Shadow.plot_coverage(G, shadow_gdf, buildings, engine=engine)
+        return coverage
+
+    @staticmethod
+    def edge_costs(total_length, shaded_length, delta=DELTAS):
+        """
+        cost_i = sun distance + shade distance / delta[i - 1], as arrays over all edges.
+        """
+        total_length = np.asarray(total_length, dtype=np.float64)
+        shaded_length = np.asarray(shaded_length, dtype=np.float64)
+        distance_sun = total_length - shaded_length
+        return {f"cost_{i}": distance_sun + shaded_length / d for i, d in enumerate(delta, start=1)}
 
     @staticmethod
-    def make_new_weights(G):
-        delta = [1, 10, 50, 80]
-        for u, v, key, edge in G.edges(keys=True, data=True):
-            coverage = edge.get('shadow_coverage', 0)
-            path = edge.get('geometry')
-            total_path_length = path.length
+    def make_new_weights(G, delta=DELTAS):
+        with Profiling.stage('weights', items=G.number_of_edges()):
+            edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+            total_path_length = shapely.length(edge_geoms)
+            coverage = np.array([G[u][v][key].get('shadow_coverage', 0) for u, v, key in edge_keys], dtype=np.float64)
             distance_shadow = (coverage * total_path_length) / 100
-            i = 1
-            for d in delta:
-                new_distance_shadow = distance_shadow / d
-                print(f"new_distance_shadow: {new_distance_shadow}\n")
-                d_name = f"cost_{i}"
-                i = i + 1
-                distance_sun = total_path_length - distance_shadow
-                G[u][v][key][d_name] = distance_sun + new_distance_shadow
 
+            costs = Class_Shadow.edge_costs(total_path_length, distance_shadow, delta)
+            for d_name, values in costs.items():
+                for (u, v, key), value in zip(edge_keys, values.tolist()):
+                    G[u][v][key][d_name] = value
+            return costs
+
+class ShadowCoverage:
+    """
+    Shadow layer dissolved once and indexed with an STRtree for bulk edge coverage queries.
+
+    The shadows are cut into square tiles and dissolved tile by tile, so no single polygon grows to the
+    size of the whole campus. Every edge is then intersected only with the tiles it touches, and the
+    pieces are merged as intervals along the edge so tile borders are not counted twice.
+    """
+
+    def __init__(self, shadows, tile_size=100.0, boxes=None):
+        """boxes: optional tile polygons to dissolve instead of the whole grid over the shadows"""
+        geoms = np.asarray(shadows, dtype=object)
+        geoms = geoms[~shapely.is_missing(geoms)]
+        geoms = geoms[~shapely.is_empty(geoms)]
+        self.tile_size = tile_size
+        self.tiles = self.dissolve_tiles(geoms, tile_size, boxes)
+        shapely.prepare(self.tiles)
+        self.tree = shapely.STRtree(self.tiles)
+
+    @staticmethod
+    def dissolve_tiles(geoms, tile_size, boxes=None):
+        """
+        Union the shadow polygons inside every tile of a regular grid (or of the given boxes, which must not
+        overlap) and return the polygon parts.
+        """
+        if len(geoms) == 0:
+            return np.array([], dtype=object)
+
+        if boxes is None:
+            xmin, ymin, xmax, ymax = shapely.total_bounds(geoms)
+            grid_x, grid_y = np.meshgrid(np.arange(xmin, xmax, tile_size), np.arange(ymin, ymax, tile_size))
+            grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+            boxes = shapely.box(grid_x, grid_y, grid_x + tile_size, grid_y + tile_size)
+        if len(boxes) == 0:
+            return np.array([], dtype=object)
+
+        tile_idx, geom_idx = shapely.STRtree(geoms).query(boxes, predicate='intersects')
+        order = np.argsort(tile_idx, kind='stable')
+        tile_idx, geom_idx = tile_idx[order], geom_idx[order]
+        clipped = shapely.intersection(geoms[geom_idx], boxes[tile_idx])
+
+        groups = np.split(clipped, np.flatnonzero(np.diff(tile_idx)) + 1)
+        dissolved = shapely.get_parts(np.array([shapely.union_all(group) for group in groups], dtype=object))
+        return dissolved[shapely.get_type_id(dissolved) == 3]
 
+    @staticmethod
+    def edge_arrays(G):
+        """
+        Stable edge order of G and the matching array of edge geometries.
+
+        Edges are sorted by (u, v, key). Missing geometries are replaced by a straight line between the
+        nodes and MultiLineStrings are merged, as in analyze_coverage.
+        """
+        edge_keys = sorted(G.edges(keys=True))
+        geoms = np.empty(len(edge_keys), dtype=object)
+        for i, (u, v, key) in enumerate(edge_keys):
+            path = G[u][v][key].get('geometry')
+            if path is None:
+                path = LineString([(G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y'])])
+            elif isinstance(path, MultiLineString):
+                path = linemerge(path)
+            geoms[i] = path
+        return edge_keys, geoms
+
+    def shaded_pieces(self, edge_geoms):
+        """
+        Bulk STRtree query of the edges against the shadow tiles.
+
+        Returns (edge_idx, pieces): every non empty linear piece of an edge that lies inside a shadow tile.
+        """
+        edge_geoms = np.asarray(edge_geoms, dtype=object)
+        edge_idx, tile_idx = self.tree.query(edge_geoms, predicate='intersects')
+        pieces, piece_idx = shapely.get_parts(
+            shapely.intersection(edge_geoms[edge_idx], self.tiles[tile_idx]), return_index=True)
+        edge_idx = edge_idx[piece_idx]
+        linear = shapely.length(pieces) > 0
+        return edge_idx[linear], pieces[linear]
+
+    @staticmethod
+    def _segments(edge_geoms):
+        """
+        Straight segments of the edges as (segments, edge row, offset of the segment start along its edge),
+        zero length segments left out.
+        """
+        coords, coord_edge = shapely.get_coordinates(edge_geoms, return_index=True)
+        same_edge = coord_edge[:-1] == coord_edge[1:]
+        step = np.hypot(*np.diff(coords, axis=0).T)
+        step[~same_edge] = 0.0
+        # Offset of every vertex along its edge: running length, restarted at the first vertex of each edge
+        along = np.concatenate([[0.0], np.cumsum(step)])
+        first = np.searchsorted(coord_edge, coord_edge)
+        along -= along[first]
+        kept = np.flatnonzero(same_edge & (step > 0))
+        segments = shapely.linestrings(np.stack([coords[kept], coords[kept + 1]], axis=1))
+        return segments, coord_edge[kept], along[kept]
+
+    def shaded_intervals(self, edge_geoms):
+        """
+        Shaded stretches of every edge as offsets along its geometry, measured from the first vertex.
+
+        Returns (edge_idx, starts, ends) sorted by edge and start, with the overlapping pieces of an edge
+        (split on a tile border) merged, so the intervals of an edge are disjoint.
+        """
+        edge_geoms = np.asarray(edge_geoms, dtype=object)
+        edge_lengths = shapely.length(edge_geoms)
+        # A point on an edge that crosses or closes on itself has more than one offset, so such edges are
+        # queried segment by segment instead: a piece of a straight segment has exactly one
+        looping = np.flatnonzero(~shapely.is_simple(edge_geoms) | shapely.is_closed(edge_geoms))
+        simple = np.setdiff1d(np.arange(len(edge_geoms)), looping)
+        edge_idx, pieces = self.shaded_pieces(edge_geoms[simple])
+        edge_idx = simple[edge_idx]
+        starts = shapely.line_locate_point(edge_geoms[edge_idx], shapely.get_point(pieces, 0))
+        lengths = shapely.length(pieces)
+        if len(looping):
+            segments, segment_edge, segment_start = self._segments(edge_geoms[looping])
+            segment_idx, segment_pieces = self.shaded_pieces(segments)
+            segment_lines = segments[segment_idx]
+            ends_along = [shapely.line_locate_point(segment_lines, shapely.get_point(segment_pieces, i))
+                          for i in (0, -1)]
+            edge_idx = np.concatenate([edge_idx, looping[segment_edge[segment_idx]]])
+            starts = np.concatenate([starts, segment_start[segment_idx] + np.minimum(*ends_along)])
+            lengths = np.concatenate([lengths, shapely.length(segment_pieces)])
+        if len(edge_idx) == 0:
+            return np.array([], dtype=np.int64), np.array([]), np.array([])
+        ends = np.minimum(starts + lengths, edge_lengths[edge_idx])
+
+        # Shift each edge onto its own stretch of one axis so one running maximum merges all edges at once
+        shift = np.concatenate([[0.0], np.cumsum(edge_lengths + 1.0)[:-1]])[edge_idx]
+        order = np.argsort(starts + shift, kind='stable')
+        starts, ends, edge_idx, shift = starts[order], ends[order], edge_idx[order], shift[order]
+        covered_until = np.maximum.accumulate(ends + shift)
+        # A piece opens a new interval when it starts after everything before it on the axis has ended
+        opens = np.ones(len(starts), dtype=bool)
+        opens[1:] = starts[1:] + shift[1:] > covered_until[:-1]
+        first = np.flatnonzero(opens)
+        last = np.concatenate([first[1:], [len(starts)]]) - 1
+        return edge_idx[first], starts[first], covered_until[last] - shift[first]
+
+    def shaded_lengths(self, edge_geoms):
+        """
+        Length of every edge that lies in shadow, in the units of the edge CRS.
+        """
+        edge_geoms = np.asarray(edge_geoms, dtype=object)
+        edge_idx, starts, ends = self.shaded_intervals(edge_geoms)
+        return np.minimum(np.bincount(edge_idx, weights=ends - starts, minlength=len(edge_geoms)),
+                          shapely.length(edge_geoms))
+
+    def apply_to_graph(self, G):
+        """
+        Compute 'shadow_coverage' (percent of the edge length in shadow) and 'shaded_length' for all edges
+        of G in one query and return them as a table (u, v, key, shaded_length, total_length, fraction).
+        """
+        edge_keys, edge_geoms = self.edge_arrays(G)
+        return self.write_coverage(G, edge_keys, edge_geoms, self.shaded_lengths(edge_geoms))
+
+    @staticmethod
+    def write_coverage(G, edge_keys, edge_geoms, shaded):
+        """
+        Write the shaded lengths of the edges (in edge_arrays order) onto G and return the coverage table.
+        """
+        total = shapely.length(edge_geoms)
+        fraction = np.divide(shaded, total, out=np.zeros_like(total), where=total > 0)
+        for (u, v, key), shaded_length, value in zip(edge_keys, shaded, fraction):
+            G[u][v][key]['shadow_coverage'] = float(value) * 100
+            G[u][v][key]['shaded_length'] = float(shaded_length)
+
+        table = pd.DataFrame(edge_keys, columns=['u', 'v', 'key'])
+        table['shaded_length'] = shaded
+        table['total_length'] = total
+        table['fraction'] = fraction
+        return table
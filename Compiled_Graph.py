@@ -0,0 +1,184 @@
+import numpy as np
+import scipy.sparse as sp
+import shapely
+from scipy.sparse.csgraph import dijkstra
+from Class_Shadow import Class_Shadow, ShadowCoverage, DELTAS
+
+
+class CompiledGraph:
+    """
+    Array form of Open_Street_Map.G for routing without networkx.
+
+    Nodes are numbered 0..n-1 in sorted node id order and edges are kept in the sorted (u, v, key) order
+    of ShadowCoverage.edge_arrays, which is also the row order of ShadeTimetable. Because the edges are
+    sorted by source node they already form a CSR adjacency: the edges leaving node i are
+    indptr[i]:indptr[i + 1], with their targets in indices.
+    """
+
+    def __init__(self, node_ids, x, y, edge_u, edge_v, edge_key, length, shaded_length):
+        self.node_ids = np.asarray(node_ids)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.edge_u = np.asarray(edge_u, dtype=np.int32)
+        self.edge_v = np.asarray(edge_v, dtype=np.int32)
+        self.edge_key = np.asarray(edge_key, dtype=np.int32)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.shaded_length = np.asarray(shaded_length, dtype=np.float64)
+        self.indptr = np.searchsorted(self.edge_u, np.arange(len(self.node_ids) + 1)).astype(np.int32)
+        self.indices = self.edge_v
+        self.costs = {'length': self.length}
+        self._matrices = {}
+        self._adjacency = {}
+
+    @classmethod
+    def from_graph(cls, G, cost_names=()):
+        """
+        Compile G. 'shaded_length' is read from the edges (or derived from 'shadow_coverage'), lengths are
+        the edge geometry lengths, and existing cost columns listed in cost_names are copied.
+        """
+        node_ids = np.array(sorted(G.nodes))
+        node_index = {node: i for i, node in enumerate(node_ids.tolist())}
+        x = np.array([G.nodes[node]['x'] for node in node_ids.tolist()])
+        y = np.array([G.nodes[node]['y'] for node in node_ids.tolist()])
+
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        edges = [G[u][v][key] for u, v, key in edge_keys]
+        length = shapely.length(edge_geoms)
+        coverage = np.array([edge.get('shadow_coverage', 0) for edge in edges], dtype=np.float64)
+        shaded_length = np.array([edge.get('shaded_length', np.nan) for edge in edges], dtype=np.float64)
+        shaded_length = np.where(np.isnan(shaded_length), coverage * length / 100, shaded_length)
+
+        compiled = cls(node_ids, x, y,
+                       [node_index[u] for u, _, _ in edge_keys],
+                       [node_index[v] for _, v, _ in edge_keys],
+                       [key for _, _, key in edge_keys],
+                       length, shaded_length)
+        for name in cost_names:
+            compiled.costs[name] = np.array([edge[name] for edge in edges], dtype=np.float64)
+        return compiled
+
+    @property
+    def edge_keys(self):
+        """(u, v, key) node ids of every edge, in the order of the cost arrays"""
+        node_ids = self.node_ids.tolist()
+        return [(node_ids[u], node_ids[v], key)
+                for u, v, key in zip(self.edge_u.tolist(), self.edge_v.tolist(), self.edge_key.tolist())]
+
+    def node_index(self, node_ids):
+        """Positions of node ids in the compiled graph"""
+        node_ids = np.asarray(node_ids)
+        positions = np.searchsorted(self.node_ids, node_ids)
+        positions = np.minimum(positions, len(self.node_ids) - 1)
+        if not np.all(self.node_ids[positions] == node_ids):
+            raise KeyError("Node ids are not in the compiled graph.")
+        return positions
+
+    def add_shade_costs(self, delta=DELTAS):
+        """
+        Add the cost_i columns of make_new_weights as one array expression per delta.
+        """
+        self.costs.update(Class_Shadow.edge_costs(self.length, self.shaded_length, delta))
+        return self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop the cached matrices and adjacency lists; call it after changing cost arrays in place.
+        """
+        self._matrices.clear()
+        self._adjacency.clear()
+        return self
+
+    def add_time_slot_costs(self, timetable, column, delta=DELTAS):
+        """
+        Add cost_i columns for one ShadeTimetable column, named 'cost_i@column', from the shaded fractions
+        of that time slot instead of the current 'shaded_length'. Timetable rows are matched to the edges
+        by their (u, v, key).
+        """
+        edge_keys = self.edge_keys
+        if timetable.edge_keys == edge_keys:
+            fractions = timetable.fractions[:, column]
+        else:
+            try:
+                fractions = timetable.fractions[timetable.edge_rows(edge_keys), column]
+            except KeyError:
+                raise ValueError("The shade timetable was built for a different graph.") from None
+        shaded_length = self.length * (np.asarray(fractions, dtype=np.float64) / timetable.scale)
+        costs = Class_Shadow.edge_costs(self.length, shaded_length, delta)
+        self.costs.update({f"{name}@{column}": values for name, values in costs.items()})
+        return self
+
+    def matrix(self, weight='length'):
+        """
+        CSR matrix of a cost column. Parallel edges are collapsed to the cheapest one; the edge id kept for
+        every (u, v) pair is returned alongside to map routes back to edges.
+        """
+        if weight not in self._matrices:
+            cost = self.costs[weight]
+            # Sort by (u, v, cost) and keep the first, i.e. cheapest, edge of every (u, v) run
+            order = np.lexsort((cost, self.edge_v, self.edge_u))
+            pair_key = self.edge_u[order].astype(np.int64) * len(self.node_ids) + self.edge_v[order]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = np.diff(pair_key) != 0
+            pair_edge, pair_key = order[first], pair_key[first]
+            indptr = np.searchsorted(self.edge_u[pair_edge], np.arange(len(self.node_ids) + 1))
+            matrix = sp.csr_matrix((cost[pair_edge], self.edge_v[pair_edge], indptr),
+                                   shape=(len(self.node_ids), len(self.node_ids)))
+            self._matrices[weight] = (matrix, pair_edge, pair_key)
+        return self._matrices[weight]
+
+    def pair_edges(self, weight, route):
+        """Edge ids used by a route (node positions) under a cost column"""
+        _, pair_edge, pair_key = self.matrix(weight)
+        route = np.asarray(route, dtype=np.int64)
+        if len(route) < 2:
+            return np.array([], dtype=np.int64)
+        return pair_edge[np.searchsorted(pair_key, route[:-1] * len(self.node_ids) + route[1:])]
+
+    def adjacency(self, weight='length', reverse=False):
+        """
+        Python list form (indptr, targets, costs) of the collapsed CSR matrix (transposed if reverse), for
+        the heapq searches in Algorithmica.
+        """
+        cache_key = (weight, reverse)
+        if cache_key not in self._adjacency:
+            matrix = self.matrix(weight)[0]
+            if reverse:
+                matrix = matrix.T.tocsr()
+            self._adjacency[cache_key] = (matrix.indptr.tolist(), matrix.indices.tolist(), matrix.data.tolist())
+        return self._adjacency[cache_key]
+
+    def min_cost_per_meter(self, weight='length'):
+        """
+        Lowest cost / geometry length over all edges. Every edge is at least this times the straight line
+        between its nodes, so the scaled Euclidean distance is an admissible and consistent heuristic.
+        """
+        cost = self.costs[weight]
+        positive = self.length > 0
+        if not positive.any():
+            return 0.0
+        return max(0.0, float(np.min(cost[positive] / self.length[positive])))
+
+    @staticmethod
+    def route_from_predecessors(predecessors, orig, dest):
+        """Node positions from orig to dest, empty when dest is unreachable"""
+        if orig != dest and predecessors[dest] < 0:
+            return []
+        route = [dest]
+        while route[-1] != orig:
+            route.append(predecessors[route[-1]])
+        route.reverse()
+        return route
+
+    def shortest_path(self, orig_node, dest_node, weight='length'):
+        """
+        Single pair shortest path with scipy.sparse.csgraph.dijkstra.
+
+        Returns (route node ids, cost, length, shaded_length); the route is empty if there is no path.
+        """
+        orig, dest = self.node_index([orig_node, dest_node])
+        matrix = self.matrix(weight)[0]
+        distances, predecessors = dijkstra(matrix, indices=orig, return_predecessors=True)
+        route = self.route_from_predecessors(predecessors, orig, dest)
+        edges = self.pair_edges(weight, route)
+        return (self.node_ids[route].tolist(), float(distances[dest]),
+                float(self.length[edges].sum()), float(self.shaded_length[edges].sum()))
@@ -0,0 +1,233 @@
+import heapq
+import math
+from bisect import bisect_left
+import numpy as np
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over one cost column of a CompiledGraph (one sun position / time slot).
+
+    Preprocessing contracts the nodes one by one, cheapest first by edge difference, and adds a shortcut
+    u -> w through a contracted node v whenever no witness path without v is as cheap. Queries are then a
+    bidirectional Dijkstra that only climbs to higher ranked nodes, which settles a few dozen nodes
+    instead of a large part of the graph.
+
+    The hierarchy is kept as two CSR arrays: 'up' edges leaving every node towards higher ranked nodes
+    (forward search) and 'down' edges entering every node from higher ranked nodes (backward search),
+    each with its cost and the contracted middle node of a shortcut (-1 for an original edge).
+    """
+
+    def __init__(self, node_ids, rank, up, down, weight, time_slot=None):
+        self.node_ids = np.asarray(node_ids)
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.weight = weight
+        self.time_slot = time_slot
+        # (indptr, neighbors, costs, middles) as numpy arrays, plus list copies for the query loop
+        self.up = tuple(np.asarray(array) for array in up)
+        self.down = tuple(np.asarray(array) for array in down)
+        self._up = tuple(array.tolist() for array in self.up)
+        self._down = tuple(array.tolist() for array in self.down)
+
+    @classmethod
+    def build(cls, compiled, weight='length', time_slot=None, witness_settle_limit=60):
+        """
+        Contract a CompiledGraph for one cost column. time_slot is a label saved with the hierarchy
+        (e.g. the timetable bin the cost column was made for).
+        """
+        matrix = compiled.matrix(weight)[0]
+        n = len(compiled.node_ids)
+        out_edges = [dict() for _ in range(n)]
+        in_edges = [dict() for _ in range(n)]
+        # Every edge maps to (cost, middle node), middle -1 for original edges
+        for u in range(n):
+            for i in range(matrix.indptr[u], matrix.indptr[u + 1]):
+                v = int(matrix.indices[i])
+                if v != u:
+                    out_edges[u][v] = (float(matrix.data[i]), -1)
+                    in_edges[v][u] = (float(matrix.data[i]), -1)
+
+        contracted = [False] * n
+        deleted_neighbors = [0] * n
+
+        def witness_distances(source, excluded, max_cost):
+            """Dijkstra from source that skips excluded and contracted nodes, limited in cost and size"""
+            distances = {source: 0.0}
+            heap = [(0.0, source)]
+            settled = 0
+            while heap and settled < witness_settle_limit:
+                cost, node = heapq.heappop(heap)
+                if cost > distances.get(node, math.inf):
+                    continue
+                if cost > max_cost:
+                    break
+                settled += 1
+                for neighbor, (edge_cost, _) in out_edges[node].items():
+                    if neighbor == excluded or contracted[neighbor]:
+                        continue
+                    new_cost = cost + edge_cost
+                    if new_cost < distances.get(neighbor, math.inf):
+                        distances[neighbor] = new_cost
+                        heapq.heappush(heap, (new_cost, neighbor))
+            return distances
+
+        def shortcuts_for(node):
+            shortcuts = []
+            targets = [(w, cost) for w, (cost, _) in out_edges[node].items() if not contracted[w]]
+            for u, (in_cost, _) in in_edges[node].items():
+                if contracted[u] or not targets:
+                    continue
+                max_cost = in_cost + max(cost for _, cost in targets)
+                distances = witness_distances(u, node, max_cost)
+                for w, out_cost in targets:
+                    if w == u:
+                        continue
+                    via = in_cost + out_cost
+                    if distances.get(w, math.inf) > via:
+                        shortcuts.append((u, w, via))
+            return shortcuts
+
+        def priority(node):
+            degree = sum(not contracted[w] for w in out_edges[node]) + sum(not contracted[u] for u in in_edges[node])
+            return len(shortcuts_for(node)) - degree + deleted_neighbors[node]
+
+        heap = [(priority(node), node) for node in range(n)]
+        heapq.heapify(heap)
+        rank = np.zeros(n, dtype=np.int32)
+        next_rank = 0
+        while heap:
+            _, node = heapq.heappop(heap)
+            if contracted[node]:
+                continue
+            # Lazy update: contract only if the node is still the cheapest
+            current = priority(node)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, node))
+                continue
+
+            for u, w, cost in shortcuts_for(node):
+                if cost < out_edges[u].get(w, (math.inf, -1))[0]:
+                    out_edges[u][w] = (cost, node)
+                    in_edges[w][u] = (cost, node)
+            contracted[node] = True
+            rank[node] = next_rank
+            next_rank += 1
+            for neighbor in list(out_edges[node]) + list(in_edges[node]):
+                deleted_neighbors[neighbor] += 1
+
+        up = cls._pack(n, [[(w, cost, middle) for w, (cost, middle) in out_edges[u].items() if rank[w] > rank[u]]
+                           for u in range(n)])
+        down = cls._pack(n, [[(u, cost, middle) for u, (cost, middle) in in_edges[w].items() if rank[u] > rank[w]]
+                             for w in range(n)])
+        return cls(compiled.node_ids, rank, up, down, weight, time_slot)
+
+    @staticmethod
+    def _pack(n, rows):
+        """CSR arrays of per node edge lists, neighbors sorted within each row for bisect lookups"""
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        neighbors, costs, middles = [], [], []
+        for node, row in enumerate(rows):
+            row.sort()
+            indptr[node + 1] = indptr[node] + len(row)
+            for neighbor, cost, middle in row:
+                neighbors.append(neighbor)
+                costs.append(cost)
+                middles.append(middle)
+        return (indptr, np.array(neighbors, dtype=np.int32), np.array(costs, dtype=np.float64),
+                np.array(middles, dtype=np.int32))
+
+    def save(self, path):
+        np.savez(path, node_ids=self.node_ids, rank=self.rank,
+                 up_indptr=self.up[0], up_neighbors=self.up[1], up_costs=self.up[2], up_middles=self.up[3],
+                 down_indptr=self.down[0], down_neighbors=self.down[1], down_costs=self.down[2],
+                 down_middles=self.down[3], weight=np.array(self.weight),
+                 time_slot=np.array('' if self.time_slot is None else str(self.time_slot)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            up = (data['up_indptr'], data['up_neighbors'], data['up_costs'], data['up_middles'])
+            down = (data['down_indptr'], data['down_neighbors'], data['down_costs'], data['down_middles'])
+            time_slot = str(data['time_slot']) or None
+            return cls(data['node_ids'], data['rank'], up, down, str(data['weight']), time_slot)
+
+    def _edge_middle(self, a, b):
+        """Middle node of the hierarchy edge a -> b (-1 for an original edge)"""
+        if self.rank[a] < self.rank[b]:
+            indptr, neighbors, _, middles = self._up
+            row, other = a, b
+        else:
+            indptr, neighbors, _, middles = self._down
+            row, other = b, a
+        position = bisect_left(neighbors, other, indptr[row], indptr[row + 1])
+        return middles[position]
+
+    def _unpack(self, a, b, route):
+        """Append the original nodes of the hierarchy edge a -> b (without a) to route"""
+        stack = [(a, b)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._edge_middle(a, b)
+            if middle < 0:
+                route.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    def query(self, orig_node, dest_node):
+        """
+        Bidirectional upward search. Returns (route node ids, cost); the route is empty if there is no path.
+        """
+        orig, dest = np.minimum(np.searchsorted(self.node_ids, [orig_node, dest_node]), len(self.node_ids) - 1).tolist()
+        if self.node_ids[orig] != orig_node or self.node_ids[dest] != dest_node:
+            raise KeyError("Node ids are not in the contraction hierarchy.")
+
+        graphs = [self._up, self._down]
+        best_cost = [{orig: 0.0}, {dest: 0.0}]
+        parent = [{orig: -1}, {dest: -1}]
+        heaps = [[(0.0, orig)], [(0.0, dest)]]
+        best_total = 0.0 if orig == dest else math.inf
+        meeting = orig if orig == dest else None
+
+        while heaps[0] or heaps[1]:
+            # Each direction stops on its own once its smallest key cannot improve the best meeting cost
+            for side in (0, 1):
+                if heaps[side] and heaps[side][0][0] >= best_total:
+                    heaps[side] = []
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            if not heaps[side]:
+                break
+            cost, node = heapq.heappop(heaps[side])
+            if cost > best_cost[side][node]:
+                continue
+            other = best_cost[1 - side].get(node)
+            if other is not None and cost + other < best_total:
+                best_total = cost + other
+                meeting = node
+
+            indptr, neighbors, costs, _ = graphs[side]
+            for i in range(indptr[node], indptr[node + 1]):
+                neighbor = neighbors[i]
+                new_cost = cost + costs[i]
+                if new_cost < best_cost[side].get(neighbor, math.inf):
+                    best_cost[side][neighbor] = new_cost
+                    parent[side][neighbor] = node
+                    heapq.heappush(heaps[side], (new_cost, neighbor))
+
+        if meeting is None:
+            return [], math.inf
+
+        # Upward half from orig to the meeting node, then the downward half to dest, unpacking shortcuts
+        up_path = [meeting]
+        while parent[0][up_path[-1]] != -1:
+            up_path.append(parent[0][up_path[-1]])
+        up_path.reverse()
+        down_path = [meeting]
+        while parent[1][down_path[-1]] != -1:
+            down_path.append(parent[1][down_path[-1]])
+        hierarchy_path = up_path + down_path[1:]
+
+        route = [hierarchy_path[0]]
+        for a, b in zip(hierarchy_path[:-1], hierarchy_path[1:]):
+            self._unpack(a, b, route)
+        return self.node_ids[route].tolist(), best_total
@@ -0,0 +1,186 @@
+import numbers
+import numpy as np
+import pandas as pd
+import networkx as nx
+import shapely
+from shapely.geometry import MultiLineString
+from shapely.ops import linemerge
+from Compiled_Graph import CompiledGraph
+
+
+class GraphStore:
+    """
+    Compact array form of an osmnx MultiDiGraph, for keeping large cities in memory and shipping them
+    to worker processes.
+
+    Nodes are kept in sorted node id order and edges in the sorted (u, v, key) order of
+    ShadowCoverage.edge_arrays. Edge endpoints are node positions (int32), and all edge geometries share
+    one flat (n, 2) coordinate buffer: edge i is coords[geometry_offsets[i]:geometry_offsets[i + 1]].
+    Every other node or edge attribute is one column: a typed NumPy array for numbers (float columns use
+    NaN for a missing value, integer columns with missing values are pandas nullable Int64) and a pandas
+    Categorical for everything else (strings, osmid lists), so the store pickles as a handful of buffers
+    instead of one dict and one LineString per edge.
+    """
+
+    def __init__(self, node_ids, x, y, edge_u, edge_v, edge_key, coords, geometry_offsets, has_geometry=None,
+                 node_columns=None, edge_columns=None, graph_attrs=None):
+        self.node_ids = np.asarray(node_ids)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.edge_u = np.asarray(edge_u, dtype=np.int32)
+        self.edge_v = np.asarray(edge_v, dtype=np.int32)
+        self.edge_key = np.asarray(edge_key, dtype=np.int32)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.geometry_offsets = np.asarray(geometry_offsets, dtype=np.int64)
+        # Edges that had no 'geometry' attribute get the straight line between their nodes in coords
+        self.has_geometry = (np.ones(len(self.edge_u), dtype=bool) if has_geometry is None
+                             else np.asarray(has_geometry, dtype=bool))
+        self.node_columns = node_columns or {}
+        self.edge_columns = edge_columns or {}
+        self.graph_attrs = graph_attrs or {}
+
+    @staticmethod
+    def _column(values):
+        """Typed column of attribute values, None meaning missing"""
+        present = [value for value in values if value is not None]
+        if present and len(present) == len(values) and all(isinstance(value, (bool, np.bool_)) for value in present):
+            return np.array(values, dtype=bool)
+        numeric = [value for value in present
+                   if isinstance(value, numbers.Number) and not isinstance(value, (bool, np.bool_))]
+        if present and len(numeric) == len(present):
+            if all(isinstance(value, numbers.Integral) for value in present):
+                # Nullable integers keep their type where the attribute is missing on some rows
+                if len(present) == len(values):
+                    return np.array(values, dtype=np.int64)
+                return pd.array(values, dtype='Int64')
+            if not any(isinstance(value, numbers.Integral) for value in present):
+                return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            # Mixed ints and floats: kept as the original objects
+            return np.array(values, dtype=object)
+        # Lists (e.g. merged osmid or highway values) become tuples so they can be categories
+        return pd.Categorical([tuple(value) if isinstance(value, list) else value for value in values])
+
+    @staticmethod
+    def _values(column):
+        """Python values of a column, None where missing"""
+        if isinstance(column, pd.Categorical):
+            values = np.asarray(column, dtype=object).tolist()
+            return [None if value is None or value != value else list(value) if isinstance(value, tuple) else value
+                    for value in values]
+        if isinstance(column, pd.api.extensions.ExtensionArray):
+            return column.to_numpy(dtype=object, na_value=None).tolist()
+        values = column.tolist()
+        if column.dtype.kind == 'f':
+            return [None if value != value else value for value in values]
+        return values
+
+    @classmethod
+    def from_graph(cls, G):
+        node_ids = np.array(sorted(G.nodes))
+        node_index = {node: i for i, node in enumerate(node_ids.tolist())}
+        nodes = [G.nodes[node] for node in node_ids.tolist()]
+        x = np.array([data['x'] for data in nodes], dtype=np.float64)
+        y = np.array([data['y'] for data in nodes], dtype=np.float64)
+        node_names = sorted({name for data in nodes for name in data} - {'x', 'y'})
+        node_columns = {name: cls._column([data.get(name) for data in nodes]) for name in node_names}
+
+        edge_keys = sorted(G.edges(keys=True))
+        edges = [G[u][v][key] for u, v, key in edge_keys]
+        edge_u = np.array([node_index[u] for u, _, _ in edge_keys], dtype=np.int32)
+        edge_v = np.array([node_index[v] for _, v, _ in edge_keys], dtype=np.int32)
+        edge_names = sorted({name for data in edges for name in data} - {'geometry'})
+        edge_columns = {name: cls._column([data.get(name) for data in edges]) for name in edge_names}
+
+        # Geometries as in ShadowCoverage.edge_arrays: straight lines when missing, MultiLineStrings merged
+        geometries = np.empty(len(edges), dtype=object)
+        has_geometry = np.zeros(len(edges), dtype=bool)
+        for i, data in enumerate(edges):
+            path = data.get('geometry')
+            if path is not None:
+                has_geometry[i] = True
+                geometries[i] = linemerge(path) if isinstance(path, MultiLineString) else path
+        straight = np.flatnonzero(~has_geometry)
+        if len(straight):
+            ends = np.stack([np.column_stack([x[edge_u[straight]], y[edge_u[straight]]]),
+                             np.column_stack([x[edge_v[straight]], y[edge_v[straight]]])], axis=1)
+            geometries[straight] = shapely.linestrings(ends)
+        coords, coord_edge = shapely.get_coordinates(geometries, return_index=True)
+        geometry_offsets = np.searchsorted(coord_edge, np.arange(len(edges) + 1))
+
+        return cls(node_ids, x, y, edge_u, edge_v, [key for _, _, key in edge_keys], coords, geometry_offsets,
+                   has_geometry, node_columns, edge_columns, dict(G.graph))
+
+    def to_graph(self):
+        """The osmnx MultiDiGraph this store was built from (same ids, attributes and geometries)"""
+        G = nx.MultiDiGraph(**self.graph_attrs)
+        node_values = {name: self._values(column) for name, column in self.node_columns.items()}
+        for i, node in enumerate(self.node_ids.tolist()):
+            data = {name: values[i] for name, values in node_values.items() if values[i] is not None}
+            G.add_node(node, x=float(self.x[i]), y=float(self.y[i]), **data)
+
+        edge_values = {name: self._values(column) for name, column in self.edge_columns.items()}
+        geometries = self.geometries().tolist()
+        node_ids = self.node_ids.tolist()
+        edges = []
+        for i, (u, v, key) in enumerate(zip(self.edge_u.tolist(), self.edge_v.tolist(), self.edge_key.tolist())):
+            data = {name: values[i] for name, values in edge_values.items() if values[i] is not None}
+            if self.has_geometry[i]:
+                data['geometry'] = geometries[i]
+            edges.append((node_ids[u], node_ids[v], key, data))
+        G.add_edges_from(edges)
+        return G
+
+    @property
+    def edge_keys(self):
+        """(u, v, key) node ids of every edge, as ShadowCoverage.edge_arrays returns them"""
+        node_ids = self.node_ids.tolist()
+        return [(node_ids[u], node_ids[v], key)
+                for u, v, key in zip(self.edge_u.tolist(), self.edge_v.tolist(), self.edge_key.tolist())]
+
+    def geometries(self, edges=None):
+        """LineStrings of all edges (or of the edge rows given), built from the coordinate buffer"""
+        edges = np.arange(len(self.edge_u)) if edges is None else np.asarray(edges, dtype=np.int64)
+        counts = self.geometry_offsets[edges + 1] - self.geometry_offsets[edges]
+        rows = np.repeat(self.geometry_offsets[edges], counts) + np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        return shapely.linestrings(self.coords[rows], indices=np.repeat(np.arange(len(edges)), counts))
+
+    def edge_lengths(self):
+        """Geometry length of every edge, straight from the coordinate buffer"""
+        segment = np.hypot(*np.diff(self.coords, axis=0).T)
+        # Drop the jumps from the last vertex of an edge to the first vertex of the next one
+        segment[self.geometry_offsets[1:-1] - 1] = 0.0
+        totals = np.concatenate([[0.0], np.cumsum(segment)])
+        ends = np.maximum(self.geometry_offsets[1:] - 1, self.geometry_offsets[:-1])
+        return totals[ends] - totals[self.geometry_offsets[:-1]]
+
+    def column(self, name):
+        """Edge column as a float array, e.g. a cost column for routing"""
+        column = self.edge_columns[name]
+        if isinstance(column, pd.api.extensions.ExtensionArray) and not isinstance(column, pd.Categorical):
+            return column.to_numpy(dtype=np.float64, na_value=np.nan)
+        return np.asarray(column, dtype=np.float64)
+
+    def compiled(self, cost_names=()):
+        """CompiledGraph of the store, the same as CompiledGraph.from_graph(self.to_graph(), cost_names)"""
+        length = self.edge_lengths()
+        shaded_length = self.column('shaded_length') if 'shaded_length' in self.edge_columns else np.full(len(length), np.nan)
+        coverage = self.column('shadow_coverage') if 'shadow_coverage' in self.edge_columns else np.zeros(len(length))
+        shaded_length = np.where(np.isnan(shaded_length), np.nan_to_num(coverage) * length / 100, shaded_length)
+        compiled = CompiledGraph(self.node_ids, self.x, self.y, self.edge_u, self.edge_v, self.edge_key, length,
+                                 shaded_length)
+        for name in cost_names:
+            compiled.costs[name] = self.column(name)
+        return compiled
+
+    def nbytes(self):
+        """Memory held by the arrays of the store"""
+        arrays = [self.node_ids, self.x, self.y, self.edge_u, self.edge_v, self.edge_key, self.coords,
+                  self.geometry_offsets, self.has_geometry]
+        total = sum(array.nbytes for array in arrays)
+        for column in list(self.node_columns.values()) + list(self.edge_columns.values()):
+            if isinstance(column, pd.Categorical):
+                total += column.codes.nbytes + int(pd.Series(column.categories).memory_usage(deep=True))
+            else:
+                total += column.nbytes
+        return total
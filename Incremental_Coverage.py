@@ -0,0 +1,172 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage, DELTAS
+import Profiling
+
+
+class IncrementalCoverage:
+    """
+    Shadows and edge coverage kept up to date under building changes.
+
+    The shadow of every building is stored, and a uniform grid maps every cell to the buildings whose
+    shadow bounds overlap it. When buildings are added, removed, or get a new height or footprint, only
+    their shadows are regenerated; the edges touched by the old or new shadows are found through an
+    STRtree of the (fixed) edges, their shaded length is recomputed against the shadows in their grid
+    cells, and 'shadow_coverage', 'shaded_length' and the cost_i attributes are rewritten for those
+    edges only. The work is proportional to the change, not to the city.
+
+    A new sun position changes every shadow, so set_sun recomputes everything.
+    """
+
+    def __init__(self, G, buildings, azimuth, altitude, cell_size=50.0, tile_size=100.0, delta=DELTAS,
+                 compiled=None):
+        """
+        buildings: GeoDataFrame in the CRS of G with a 'height' column; its index labels identify the
+        buildings in later updates. compiled: optional CompiledGraph of G whose shaded lengths and cost
+        columns are kept in sync as well.
+        """
+        self.G = G
+        self.cell_size = cell_size
+        self.tile_size = tile_size
+        self.delta = delta
+        self.compiled = compiled
+        self.edge_keys, self.edge_geoms = ShadowCoverage.edge_arrays(G)
+        self.edge_tree = shapely.STRtree(self.edge_geoms)
+        self.shaded = np.zeros(len(self.edge_keys))
+
+        self.position = {}
+        self.footprints = []
+        self.heights = []
+        self.shadows = []
+        self.cells = []
+        self.grid = {}
+        for label, footprint, height in zip(buildings.index, buildings.geometry, buildings['height'].fillna(0)):
+            self.position[label] = len(self.footprints)
+            self.footprints.append(footprint)
+            self.heights.append(float(height))
+            self.shadows.append(None)
+            self.cells.append(())
+        self.set_sun(azimuth, altitude)
+
+    def _cells_of(self, bounds):
+        x0, y0, x1, y1 = (np.floor(np.asarray(bounds) / self.cell_size)).astype(np.int64).tolist()
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+
+    def _set_shadow(self, building, shadow):
+        """Store the shadow of a building and move it to the grid cells of its new bounds"""
+        for cell in self.cells[building]:
+            members = self.grid[cell]
+            members.discard(building)
+            if not members:
+                del self.grid[cell]
+        self.shadows[building] = shadow
+        if shadow is None or shadow.is_empty:
+            self.cells[building] = ()
+            return
+        self.cells[building] = self._cells_of(shadow.bounds)
+        for cell in self.cells[building]:
+            self.grid.setdefault(cell, set()).add(building)
+
+    def _generate(self, buildings):
+        """New shadows of building positions at the current sun position"""
+        footprints = [self.footprints[building] for building in buildings]
+        heights = [self.heights[building] if footprints[i] is not None else 0.0 for i, building in enumerate(buildings)]
+        subset = gpd.GeoDataFrame({'height': heights}, geometry=footprints)
+        return Class_Shadow.generate_shadows(subset, self.azimuth, self.altitude).tolist()
+
+    def set_sun(self, azimuth, altitude):
+        """New sun position: every shadow and every edge is recomputed"""
+        self.azimuth = Class_Shadow._scalar(azimuth)
+        self.altitude = Class_Shadow._scalar(altitude)
+        self.grid = {}
+        self.cells = [() for _ in self.footprints]
+        buildings = list(range(len(self.footprints)))
+        for building, shadow in zip(buildings, self._generate(buildings)):
+            self._set_shadow(building, shadow)
+        return self._recompute_edges(np.arange(len(self.edge_keys)))
+
+    def update(self, buildings):
+        """
+        Add the buildings of a GeoDataFrame (geometry and 'height') whose labels are new, and replace
+        the footprint and height of those already known. Returns the rows of the updated edges.
+        """
+        changed = []
+        for label, footprint, height in zip(buildings.index, buildings.geometry, buildings['height'].fillna(0)):
+            if label not in self.position:
+                self.position[label] = len(self.footprints)
+                self.footprints.append(None)
+                self.heights.append(0.0)
+                self.shadows.append(None)
+                self.cells.append(())
+            building = self.position[label]
+            self.footprints[building] = footprint
+            self.heights[building] = float(height)
+            changed.append(building)
+        return self._rebuild(changed)
+
+    def set_heights(self, heights):
+        """Corrected heights, {building label: height}. Returns the rows of the updated edges."""
+        changed = []
+        for label, height in heights.items():
+            building = self.position[label]
+            self.heights[building] = float(height)
+            changed.append(building)
+        return self._rebuild(changed)
+
+    def remove(self, labels):
+        """Remove buildings by label. Returns the rows of the updated edges."""
+        changed = []
+        for label in labels:
+            building = self.position.pop(label)
+            self.footprints[building] = None
+            self.heights[building] = 0.0
+            changed.append(building)
+        return self._rebuild(changed)
+
+    def _rebuild(self, changed):
+        """New shadows of the changed buildings and coverage of the edges under their old or new shadows"""
+        with Profiling.stage('incremental_coverage', items=len(changed)):
+            old = [self.shadows[building] for building in changed]
+            new = self._generate(changed) if changed else []
+            for building, shadow in zip(changed, new):
+                self._set_shadow(building, shadow)
+            touched = [shadow for shadow in old + new if shadow is not None]
+            if not touched:
+                return np.array([], dtype=np.int64)
+            rows = np.unique(self.edge_tree.query(np.array(touched, dtype=object), predicate='intersects')[1])
+            return self._recompute_edges(rows)
+
+    def _recompute_edges(self, rows):
+        """Shaded length of the edge rows against the shadows of their grid cells, written on G"""
+        if len(rows) == 0:
+            return rows
+        edge_geoms = self.edge_geoms[rows]
+        buildings = set()
+        for bounds in shapely.bounds(edge_geoms):
+            for cell in self._cells_of(bounds):
+                buildings.update(self.grid.get(cell, ()))
+        shadows = [self.shadows[building] for building in buildings]
+        self.shaded[rows] = ShadowCoverage(shadows, tile_size=self.tile_size).shaded_lengths(edge_geoms)
+        self._write(rows)
+        return rows
+
+    def _write(self, rows):
+        total = shapely.length(self.edge_geoms[rows])
+        shaded = self.shaded[rows]
+        fraction = np.divide(shaded, total, out=np.zeros_like(total), where=total > 0)
+        costs = Class_Shadow.edge_costs(total, shaded, self.delta)
+        for i, row in enumerate(rows.tolist()):
+            u, v, key = self.edge_keys[row]
+            edge = self.G[u][v][key]
+            edge['shadow_coverage'] = float(fraction[i]) * 100
+            edge['shaded_length'] = float(shaded[i])
+            for name, values in costs.items():
+                edge[name] = float(values[i])
+
+        if self.compiled is not None:
+            self.compiled.shaded_length[rows] = shaded
+            for name, values in costs.items():
+                if name in self.compiled.costs:
+                    self.compiled.costs[name][rows] = values
+            self.compiled.invalidate()
@@ -1,30 +1,177 @@
-
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import LineString, Point
 import osmnx as ox
 import random
+from Snap_Index import SnapIndex
+from Graph_Store import GraphStore
+from Tiled_Coverage import TiledCoverage
 import folium
 import matplotlib.pyplot as plt
+import Profiling
+
+logger = logging.getLogger(__name__)
+
+PLACE_NAME = "Ben Gurion University, Beer Sheva, Israel"
+CUSTOM_FILTER = '["highway"~"footway|path|pedestrian|sidewalk|cycleway|living_street|service|unclassified|residential|tertiary|road|steps"]'
+CRS = 'EPSG:32636'
+# Height of one floor, used when a building has 'building:levels' but no 'height'
+FLOOR_HEIGHT = 2.7
+FOOT = 0.3048
+INCH = 0.0254
+# First number of an OSM height value with its optional unit: '12', '12.5 m', '12,5', '40 ft', '40\'6"', '12;15'
+HEIGHT_PATTERN = (r'^\s*(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>m|meters?|metres?|ft|feet|foot|\')?'
+                  r'\s*(?:(?P<inches>\d+(?:\.\d+)?)\s*(?:"|in\b|inch|inches))?')
 
 
 class Open_Street_Map:
-    def __init__(self):
-        place_name = "Ben Gurion University, Beer Sheva, Israel"
-        custom_filter = '["highway"~"footway|path|pedestrian|sidewalk|cycleway|living_street|service|unclassified|residential|tertiary|road|steps"]'
-        self.crs = 'EPSG:32636'
-        ox.settings.use_cache = False
-        #G = pl.G
-        G = ox.graph_from_place(place_name, network_type="walk", custom_filter=custom_filter, retain_all=True)
-        G = ox.project_graph(G, to_crs=self.crs)
-        self.G = G
-        self.Buildings = ox.features_from_place(place_name, tags={"building": True})
-        self.calculate_high()
-        self.handel_bad_path()
+    def __init__(self, place_name=PLACE_NAME, custom_filter=CUSTOM_FILTER, crs=CRS, cache_dir=None, osm_file=None):
+        """
+        Load the walk graph and the buildings of place_name.
+
+        cache_dir: folder for prepared snapshots (projected graph as GraphML, buildings with heights as
+            GeoParquet) keyed by place, filter, CRS and source file. A matching snapshot is loaded
+            directly, otherwise the data is prepared once and saved there.
+        osm_file: local .osm/.xml extract used instead of downloading.
+        """
+        self.crs = crs
+        snapshot_dir = None
+        if cache_dir is not None:
+            snapshot_dir = os.path.join(cache_dir, self.snapshot_key(place_name, custom_filter, crs, osm_file))
+
+        with Profiling.stage('load') as record:
+            if snapshot_dir is not None and self.has_snapshot(snapshot_dir):
+                self.G, self.Buildings = self.load_snapshot(snapshot_dir)
+            else:
+                if osm_file is not None:
+                    G, self.Buildings = self.load_osm_file(osm_file, custom_filter)
+                else:
+                    G, self.Buildings = self.download(place_name, custom_filter, cache_dir)
+                self.G = ox.project_graph(G, to_crs=self.crs)
+                self.calculate_high()
+                self.handel_bad_path()
+                if snapshot_dir is not None:
+                    self.save_snapshot(snapshot_dir)
+            record['items'] = len(self.Buildings)
+
+        self._init_derived()
+
+    @classmethod
+    def from_data(cls, G, buildings, crs=CRS):
+        """
+        Wrap an already prepared projected graph and buildings (e.g. a SyntheticCity) without any download.
+        """
+        osm_object = cls.__new__(cls)
+        osm_object.crs = crs
+        osm_object.G = G
+        osm_object.Buildings = buildings
+        osm_object._init_derived()
+        return osm_object
+
+    def _init_derived(self):
         self.buildings_with_only_shadows = None
+        self._snap_index = None
+        self._snap_source = None
         self.combined_bounds = self.combine()
         self.buildings_gdf = self.convert_geodata()
 
+    @staticmethod
+    def snapshot_key(place_name, custom_filter, crs, osm_file=None):
+        """
+        Folder name of the snapshot for a place, filter and CRS (and the size/mtime of a local extract).
+        """
+        source = None
+        if osm_file is not None:
+            stat = os.stat(osm_file)
+            source = [os.path.abspath(osm_file), stat.st_size, stat.st_mtime_ns]
+        # 'buildings-v2': columnar building table of prepare_buildings
+        key = json.dumps([place_name, custom_filter, str(crs), source, 'buildings-v2'])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def has_snapshot(snapshot_dir):
+        return (os.path.exists(os.path.join(snapshot_dir, 'graph.graphml'))
+                and os.path.exists(os.path.join(snapshot_dir, 'buildings.parquet')))
+
+    @staticmethod
+    def load_snapshot(snapshot_dir):
+        """
+        Load a prepared (projected, heights computed, geometries patched) graph and buildings.
+        """
+        G = ox.load_graphml(os.path.join(snapshot_dir, 'graph.graphml'))
+        buildings = Open_Street_Map.read_buildings(os.path.join(snapshot_dir, 'buildings.parquet'))
+        return G, buildings
+
+    def save_snapshot(self, snapshot_dir):
+        """
+        Save the prepared graph and buildings. Files are written under a temporary name and renamed,
+        so a worker starting at the same time never reads a half written snapshot.
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        graph_path = os.path.join(snapshot_dir, 'graph.graphml')
+        buildings_path = os.path.join(snapshot_dir, 'buildings.parquet')
+        ox.save_graphml(self.G, graph_path + '.tmp')
+        self.write_buildings(self.Buildings, buildings_path + '.tmp')
+        os.replace(buildings_path + '.tmp', buildings_path)
+        os.replace(graph_path + '.tmp', graph_path)
+
+    @staticmethod
+    def download(place_name, custom_filter=CUSTOM_FILTER, cache_dir=None):
+        """
+        Download the (unprojected) walk graph and the buildings of place_name with osmnx.
+
+        With cache_dir, osmnx's HTTP cache is kept next to the snapshots for these requests only; the
+        global osmnx settings are restored afterwards.
+        """
+        use_cache, cache_folder = ox.settings.use_cache, ox.settings.cache_folder
+        ox.settings.use_cache = cache_dir is not None
+        if cache_dir is not None:
+            ox.settings.cache_folder = os.path.join(cache_dir, 'http')
+        try:
+            G = ox.graph_from_place(place_name, network_type="walk", custom_filter=custom_filter, retain_all=True)
+            buildings = ox.features_from_place(place_name, tags={"building": True})
+        finally:
+            ox.settings.use_cache, ox.settings.cache_folder = use_cache, cache_folder
+        return G, buildings
+
+    @staticmethod
+    def load_osm_file(osm_file, custom_filter=CUSTOM_FILTER):
+        """
+        Build the (unprojected) walk graph and the buildings from a local .osm/.xml extract.
+        """
+        if osm_file.endswith('.pbf'):
+            raise ValueError("Only .osm/.xml extracts are supported; convert the .pbf extract first, e.g. "
+                             "osmium cat extract.osm.pbf -o extract.osm")
+        G = ox.graph_from_xml(osm_file, bidirectional=True, simplify=False, retain_all=True)
+        buildings = ox.features_from_xml(osm_file, tags={"building": True})
+        # Filter before simplifying so ways of excluded highway types are not merged into kept edges
+        return ox.simplify_graph(Open_Street_Map.filter_highways(G, custom_filter)), buildings
+
+    @staticmethod
+    def filter_highways(G, custom_filter):
+        """
+        Apply the '"highway"~"..."' part of an Overpass custom filter to a graph read from a file.
+        """
+        match = re.search(r'"highway"~"([^"]+)"', custom_filter)
+        if match is None:
+            return G
+        pattern = re.compile(match.group(1))
+
+        def matches(highway):
+            values = highway if isinstance(highway, list) else [highway]
+            return any(value is not None and pattern.search(str(value)) for value in values)
+
+        G.remove_edges_from([(u, v, key) for u, v, key, highway in G.edges(keys=True, data='highway')
+                             if not matches(highway)])
+        G.remove_nodes_from([node for node in list(G.nodes) if G.degree(node) == 0])
+        return G
+
     def combine(self):
         # Ensure buildings are reprojected to match the graph CRS
         buildings_projected = self.Buildings.to_crs(self.crs)
@@ -51,23 +198,61 @@ class Open_Street_Map:
         return combined_bounds
 
     def calculate_high(self):
-        # Set 'levels' to numeric if it exists, otherwise set to None
-        floor_high = 2.7
-        if 'building:levels' in self.Buildings.columns:
-            self.Buildings['levels'] = pd.to_numeric(self.Buildings['building:levels'], errors='coerce')
-        else:
-            self.Buildings['levels'] = None
-        print(self.Buildings['building:levels'])
-        print(f"height : {self.Buildings['height']}")
-
-        # If building has levels, calculate height as levels * 2.7
-        self.Buildings['height'] = self.Buildings.apply(
-            lambda row: row['levels'] * floor_high if pd.notna(row['levels']) else row['height'], axis=1
-        )
-        print(f"height : {self.Buildings['height']}")
+        """
+        Replace the raw OSM features by the compact building table of prepare_buildings.
+        """
+        with Profiling.stage('heights', items=len(self.Buildings)):
+            self.Buildings = self.prepare_buildings(self.Buildings, self.crs)
+            logger.debug("height : %s", self.Buildings['height'])
 
-        # Set height to 0 if it is still missing
-        self.Buildings['height'].fillna(0, inplace=True)
+    @staticmethod
+    def parse_heights(values):
+        """
+        Meters from OSM height strings, vectorized: the first number, converted from feet (and inches)
+        when tagged so. Missing or unreadable values give NaN.
+        """
+        # Tag values repeat a lot, so only the distinct ones are parsed
+        codes, distinct = pd.factorize(pd.Series(values, dtype=object))
+        parts = pd.Series(distinct, dtype='string').str.extract(HEIGHT_PATTERN, flags=re.IGNORECASE)
+        value = pd.to_numeric(parts['value'].str.replace(',', '.'), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        feet = parts['unit'].str.lower().isin(['ft', 'feet', 'foot', "'"]).to_numpy(dtype=bool, na_value=False)
+        inches = pd.to_numeric(parts['inches'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        meters = np.append(np.where(feet, value * FOOT + inches * INCH, value), np.nan)
+        # Missing values have code -1, which picks the NaN appended last
+        return meters[codes]
+
+    @staticmethod
+    def prepare_buildings(features, crs=CRS):
+        """
+        Columnar building table of the pipeline from OSM building features.
+
+        Keeps the polygonal features only, in crs, with three columns: 'height' (float32 meters: the
+        parsed 'height' tag, else 'building:levels' * FLOOR_HEIGHT, else 0), 'levels' (float32) and
+        'addr:housenumber' (string). The osmnx (element, id) index is kept.
+        """
+        features = features[features.geom_type.isin(['Polygon', 'MultiPolygon'])]
+        missing = np.full(len(features), np.nan)
+        height = Open_Street_Map.parse_heights(features['height']) if 'height' in features.columns else missing
+        levels = (Open_Street_Map.parse_heights(features['building:levels'])
+                  if 'building:levels' in features.columns else missing)
+        height = np.where(np.isnan(height), levels * FLOOR_HEIGHT, height)
+        housenumber = features['addr:housenumber'] if 'addr:housenumber' in features.columns else pd.Series(None, index=features.index)
+
+        buildings = gpd.GeoDataFrame({
+            'height': np.nan_to_num(height, nan=0.0).astype(np.float32),
+            'levels': levels.astype(np.float32),
+            'addr:housenumber': housenumber.astype('string').to_numpy(),
+        }, geometry=features.geometry.to_numpy(), index=features.index, crs=features.crs)
+        return buildings.to_crs(crs) if buildings.crs is not None else buildings.set_crs(crs)
+
+    @staticmethod
+    def write_buildings(buildings, path):
+        """GeoParquet copy of a prepare_buildings table (dtypes and index are kept)"""
+        buildings.to_parquet(path)
+
+    @staticmethod
+    def read_buildings(path):
+        return gpd.read_parquet(path)
 
     def handel_bad_path(self):
         """
@@ -96,8 +281,40 @@ class Open_Street_Map:
         # Replace NaN values in height with 0
         self.Buildings['height'] = self.Buildings['height'].fillna(0)
 
+    def snap_index(self):
+        """
+        Node and edge snapping index of G, built on first use. It is rebuilt when G was replaced or gained
+        or lost nodes or edges; call invalidate_snap_index() after moving nodes or edge geometries in place.
+        """
+        source = (self.G, self.G.number_of_nodes(), self.G.number_of_edges())
+        if self._snap_index is None or self._snap_source[0] is not source[0] or self._snap_source[1:] != source[1:]:
+            self._snap_index = SnapIndex(self.G)
+            self._snap_source = source
+        return self._snap_index
+
+    def invalidate_snap_index(self):
+        """Drop the snapping index so the next snap_index() call rebuilds it from the current G"""
+        self._snap_index = None
+        self._snap_source = None
+
+    def graph_store(self):
+        """
+        G as a compact GraphStore (typed arrays and one coordinate buffer), e.g. to hand to worker
+        processes; GraphStore.to_graph() gives the MultiDiGraph back.
+        """
+        return GraphStore.from_graph(self.G)
+
+    def tiled_coverage(self, azimuth, altitude, tile_size=1000.0, processes=None):
+        """
+        Shadows and edge coverage of the whole area with TiledCoverage, tiles over combined_bounds.
+        Writes 'shadow_coverage' and 'shaded_length' on G and returns (coverage table, shadows).
+        """
+        buildings = self.Buildings.to_crs(self.crs)
+        return TiledCoverage(tile_size, processes).run(self.G, buildings, azimuth, altitude,
+                                                       bounds=self.combined_bounds)
+
     def get_nearest_node(self, x, y):
-         return ox.distance.nearest_nodes(self.G, X=x, Y=y)
+         return self.snap_index().nearest_nodes(x, y)
 
     def graph_to_gdfs(self):
         nodes_gdf, edges_gdf = ox.graph_to_gdfs(self.G, nodes=True, edges=True)
@@ -151,9 +368,8 @@ class Open_Street_Map:
         if not (bounds[0] <= dest_x <= bounds[2] and bounds[1] <= dest_y <= bounds[3]):
             raise ValueError(f"Destination point ({dest_x}, {dest_y}) is outside the graph bounds.")
 
-        # Find nearest nodes
-        orig_node = self.get_nearest_node(x=origin_x, y=origin_y)
-        dest_node = self.get_nearest_node(x=dest_x, y=dest_y)
+        # Find nearest nodes with one query
+        orig_node, dest_node = self.get_nearest_node(x=[origin_x, dest_x], y=[origin_y, dest_y]).tolist()
 
         return orig_node, dest_node
 
@@ -164,8 +380,7 @@ class Open_Street_Map:
         # Get the graph bounds
 
         graph_bounds = self.combined_bounds  # minx, miny, maxx, maxy
-        print("-----------------graph_bounds----------------------------")
-        print(graph_bounds)
+        logger.debug("graph_bounds: %s", graph_bounds)
         while True:
             # Generate random coordinates within the bounds
             x = random.uniform(graph_bounds[0], graph_bounds[2])  # Between minx and maxx
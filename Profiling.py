@@ -0,0 +1,139 @@
+import functools
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Profiler collecting the stages of the pipeline, None when profiling is off
+_active_profiler = None
+# Callback(name, seconds) of the functions decorated with traced, None when tracing is off
+_trace_hook = None
+
+
+class Profiler:
+    """
+    Collects wall time, item count and peak traced memory of every pipeline stage.
+
+    The library code marks its stages (load, heights, shadows, coverage, weights, routing) with
+    Profiling.stage; they are only recorded while a profiler is active:
+
+        with Profiler() as profiler:
+            ...
+        profiler.save('profile.json')
+
+    memory=True traces allocations with tracemalloc, which slows python heavy stages down noticeably.
+    Nested stages are recorded too, with their depth, and count in the peak memory of the outer stage.
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stages = []
+        self._open = []
+        self._started_tracing = False
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = activate(self)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        activate(self._previous)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name, items=None):
+        """
+        Record one stage. Yields the record, so the item count can also be set inside the block.
+        """
+        record = {'stage': name, 'items': items, 'seconds': None, 'peak_bytes': None, 'depth': len(self._open)}
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                # The peak is reset below, so hand the peak reached so far to the enclosing stage first
+                parent = self._open[-1]
+                parent['peak_bytes'] = max(parent['peak_bytes'], peak - parent['_start_bytes'])
+            record['_start_bytes'] = current
+            record['peak_bytes'] = 0
+            tracemalloc.reset_peak()
+        self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self._open.pop()
+            if memory:
+                start_bytes = record.pop('_start_bytes')
+                record['peak_bytes'] = max(record['peak_bytes'], tracemalloc.get_traced_memory()[1] - start_bytes)
+                if self._open:
+                    parent = self._open[-1]
+                    parent['peak_bytes'] = max(parent['peak_bytes'],
+                                               record['peak_bytes'] + start_bytes - parent['_start_bytes'])
+            self.stages.append(record)
+
+    def report(self):
+        """Stages in completion order plus the totals per stage name"""
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'items': 0, 'peak_bytes': None})
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['items'] += record['items'] or 0
+            if record['peak_bytes'] is not None:
+                total['peak_bytes'] = max(total['peak_bytes'] or 0, record['peak_bytes'])
+        return {'stages': self.stages, 'totals': totals}
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+def activate(profiler):
+    """Make profiler the one that records stages (None turns recording off). Returns the previous one."""
+    global _active_profiler
+    previous, _active_profiler = _active_profiler, profiler
+    return previous
+
+
+@contextmanager
+def stage(name, items=None):
+    """
+    Mark a pipeline stage. Recorded by the active Profiler, if any; otherwise only yields a throwaway record.
+    """
+    if _active_profiler is None:
+        yield {'stage': name, 'items': items}
+    else:
+        with _active_profiler.stage(name, items) as record:
+            yield record
+
+
+def set_trace_hook(hook):
+    """
+    Call hook(function name, seconds) after every call of a function decorated with traced. None turns
+    tracing off. Returns the previous hook.
+    """
+    global _trace_hook
+    previous, _trace_hook = _trace_hook, hook
+    return previous
+
+
+def traced(function):
+    """Per call tracing of a (per item) function; costs one global lookup while no hook is set"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _trace_hook is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _trace_hook(name, time.perf_counter() - start)
+    return wrapper
@@ -0,0 +1,140 @@
+import math
+import numpy as np
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+
+
+class RasterCoverage:
+    """
+    Fast approximate coverage: shadows rasterized into a boolean grid, edges sampled at fixed spacing.
+
+    The grid covers the edges with square cells of side resolution; a cell is shaded when its center lies
+    in a shadow. Every edge is cut into pieces of at most spacing meters and each piece counts as shaded
+    when the cell under its middle is. The shadows are scan converted into runs of shaded cells per row, so
+    the coverage of all edges for one time step is one sorted lookup of the sample cells in those runs
+    (rasterize builds the full grid only when it is wanted, e.g. for display), and a time sweep is the
+    same reduction over a stack of sample flags.
+
+    Error bound against the exact ShadowCoverage / analyze_coverage result: a piece can only be counted
+    wrongly if a shadow boundary passes within half a piece (s / 2) plus half a cell diagonal (r / sqrt(2))
+    of its middle. For an edge that crosses shadow boundaries k times at an angle of at least theta, the
+    shaded length is therefore off by at most k * (s + r * sqrt(2) / sin(theta)) meters, i.e.
+    k * (s + 2 r) for crossings steeper than 45 degrees (s = spacing, r = resolution). Edges that run
+    along a shadow boundary closer than r / sqrt(2) have no useful bound.
+    """
+
+    def __init__(self, edge_geoms, resolution=1.0, spacing=2.0, edge_keys=None):
+        self.edge_keys = edge_keys
+        self.edge_geoms = np.asarray(edge_geoms, dtype=object)
+        self.resolution = resolution
+        self.spacing = spacing
+        self.lengths = shapely.length(self.edge_geoms)
+
+        xmin, ymin, xmax, ymax = shapely.total_bounds(self.edge_geoms)
+        self.x0, self.y0 = xmin, ymin
+        self.width = int(math.floor((xmax - xmin) / resolution)) + 1
+        self.height = int(math.floor((ymax - ymin) / resolution)) + 1
+
+        # Middle points of the pieces of every edge, stored edge after edge
+        self.counts = np.maximum(1, np.ceil(self.lengths / spacing)).astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        sample_edge = np.repeat(np.arange(len(self.edge_geoms)), self.counts)
+        piece = np.arange(len(sample_edge)) - np.repeat(self.offsets, self.counts)
+        distance = (piece + 0.5) * (self.lengths / self.counts)[sample_edge]
+        x, y = shapely.get_coordinates(shapely.line_interpolate_point(self.edge_geoms[sample_edge], distance)).T
+        column = np.clip(((x - self.x0) // resolution).astype(np.int64), 0, self.width - 1)
+        row = np.clip(((y - self.y0) // resolution).astype(np.int64), 0, self.height - 1)
+        self.cells = row * self.width + column
+
+    @classmethod
+    def from_graph(cls, G, resolution=1.0, spacing=2.0):
+        """Raster over the edges of G, in the edge_arrays order"""
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        return cls(edge_geoms, resolution, spacing, edge_keys)
+
+    def spans(self, shadows):
+        """
+        Runs of shaded cells, (row, first column, stop column), from a scanline fill of all polygons at once.
+
+        Every ring segment is intersected with the rows of cell centers it spans, the crossings of each
+        polygon and row are sorted, and consecutive crossing pairs (even-odd rule, so holes stay open)
+        bound the cells whose centers are inside.
+        """
+        geoms = np.asarray(shadows, dtype=object)
+        geoms = geoms[~shapely.is_missing(geoms)]
+        parts = shapely.get_parts(geoms[~shapely.is_empty(geoms)])
+        rings, ring_part = shapely.get_rings(parts, return_index=True)
+        coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+
+        # Ring segments and the rows whose center line they cross, counted half open so vertices count once
+        segment = np.flatnonzero(ring_idx[1:] == ring_idx[:-1])
+        xa, ya = coords[segment, 0], coords[segment, 1]
+        xb, yb = coords[segment + 1, 0], coords[segment + 1, 1]
+        first = np.ceil((np.minimum(ya, yb) - self.y0) / self.resolution - 0.5).astype(np.int64)
+        stop = np.ceil((np.maximum(ya, yb) - self.y0) / self.resolution - 0.5).astype(np.int64)
+        first, stop = np.maximum(first, 0), np.minimum(stop, self.height)
+        count = np.maximum(stop - first, 0)
+        crossing_segment = np.repeat(np.arange(len(segment)), count)
+        row = first[crossing_segment] + np.arange(len(crossing_segment)) - np.repeat(np.cumsum(count) - count, count)
+        center_y = self.y0 + (row + 0.5) * self.resolution
+        xa, ya, xb, yb = xa[crossing_segment], ya[crossing_segment], xb[crossing_segment], yb[crossing_segment]
+        x = xa + (center_y - ya) * (xb - xa) / (yb - ya)
+
+        # Every polygon crosses a row an even number of times: pair them up in x order
+        polygon = ring_part[ring_idx[segment]][crossing_segment]
+        order = np.lexsort((x, row, polygon))
+        x, row = x[order], row[order]
+        start_column = np.clip(np.ceil((x[0::2] - self.x0) / self.resolution - 0.5), 0, self.width).astype(np.int64)
+        stop_column = np.clip(np.ceil((x[1::2] - self.x0) / self.resolution - 0.5), 0, self.width).astype(np.int64)
+        span = stop_column > start_column
+        return row[0::2][span], start_column[span], stop_column[span]
+
+    def rasterize(self, shadows):
+        """Boolean (height, width) grid, True where the cell center is inside a shadow"""
+        row, start_column, stop_column = self.spans(shadows)
+        changes = (np.bincount(row * (self.width + 1) + start_column, minlength=self.height * (self.width + 1))
+                   - np.bincount(row * (self.width + 1) + stop_column, minlength=self.height * (self.width + 1)))
+        return np.cumsum(changes.reshape(self.height, self.width + 1), axis=1)[:, :self.width] > 0
+
+    def sample(self, shadows):
+        """
+        Shaded flag of every edge sample, without building the grid: a sample cell is shaded when more
+        runs of its row start at or before it than stop at or before it.
+        """
+        row, start_column, stop_column = self.spans(shadows)
+        starts = np.sort(row * (self.width + 1) + start_column)
+        stops = np.sort(row * (self.width + 1) + stop_column)
+        keys = self.cells // self.width * (self.width + 1) + self.cells % self.width
+        return np.searchsorted(starts, keys, side='right') > np.searchsorted(stops, keys, side='right')
+
+    def fractions(self, samples):
+        """
+        Shaded fraction of every edge from the sample flags of one step (-> edges) or of several steps
+        (steps x samples -> edges x steps). Flags of a grid from rasterize are grid.ravel()[self.cells].
+        """
+        samples = np.asarray(samples)
+        stacked = samples.reshape(-1, len(self.cells))
+        sums = np.add.reduceat(stacked.astype(np.float64), self.offsets, axis=1)
+        fractions = (sums / self.counts).T
+        return fractions[:, 0] if samples.ndim == 1 else fractions
+
+    def shaded_lengths(self, shadows):
+        return self.fractions(self.sample(shadows)) * self.lengths
+
+    def apply_to_graph(self, G, shadows):
+        """Same attributes and table as ShadowCoverage.apply_to_graph, from the raster estimate"""
+        if self.edge_keys is None:
+            raise ValueError("Build the raster with RasterCoverage.from_graph to write on a graph.")
+        return ShadowCoverage.write_coverage(G, self.edge_keys, self.edge_geoms, self.shaded_lengths(shadows))
+
+    def sweep(self, buildings, azimuths, altitudes):
+        """
+        Shaded fraction of every edge at every sun position (edges x steps). Positions with the sun below
+        the horizon count as fully shaded.
+        """
+        azimuths = np.atleast_1d(np.asarray(azimuths, dtype=np.float64))
+        altitudes = np.atleast_1d(np.asarray(altitudes, dtype=np.float64))
+        samples = np.ones((len(azimuths), len(self.cells)), dtype=bool)
+        for step in np.flatnonzero(altitudes > 0).tolist():
+            samples[step] = self.sample(Class_Shadow.generate_shadows(buildings, azimuths[step], altitudes[step]))
+        return self.fractions(samples)
@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from Open_Street_Map import Open_Street_Map
+from Class_Shadow import Class_Shadow
+from SunLocation import SunLocation
+from Algorithmica import Algorithmic
+from Batch_Routing import init_route_worker, origin_tasks, route_origin_chunk
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingService:
+    """
+    Long running local HTTP/JSON routing service with a warm in-memory graph.
+
+    The graph, shadows, coverage and cost columns are prepared once at startup. Route requests that
+    arrive within batch_window seconds of each other are snapped together and grouped by cost and
+    origin, and the searches run in a process pool whose workers hold their own copy of the compiled
+    graph, so the event loop only parses requests and writes responses.
+
+    Endpoints:
+        GET  /health
+        POST /route  {"origin": [x, y], "destination": [x, y], "cost": "cost_2"}
+                     (or "origin_node" / "destination_node" ids; coordinates are in the graph CRS)
+    """
+
+    def __init__(self, osm_object, when=None, workers=None, batch_window=0.005, max_batch=256):
+        self.osm_object = osm_object
+        self.when = when
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.compiled = None
+        self.executor = None
+        self.queue = None
+        # Batches in flight: the event loop only keeps weak references to tasks
+        self._tasks = set()
+
+    def prepare(self):
+        """Shadows, coverage and costs for the sun position at self.when (the SunLocation default if None)"""
+        sun = SunLocation()
+        when = sun.location.time if self.when is None else pd.Timestamp(self.when)
+        if when.tz is None:
+            when = when.tz_localize(sun.location.time_zone)
+        solar_position = sun.location.location_obj.get_solarposition(when)
+
+        G = self.osm_object.G
+        buildings = self.osm_object.Buildings.to_crs(G.graph['crs'])
+        shadows = Class_Shadow.generate_shadows(buildings, solar_position['azimuth'],
+                                                solar_position['apparent_elevation'])
+        Class_Shadow.compute_coverage(G, gpd.GeoDataFrame(geometry=shadows, crs=buildings.crs))
+        self.compiled = Algorithmic(self.osm_object).compiled_graph(refresh=True)
+        self.osm_object.snap_index()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_route_worker,
+                                            initargs=(self.compiled,))
+        # Start the workers now, before the event loop and its threads exist, so no fork happens mid-request
+        self.executor.submit(int).result()
+
+    async def route(self, request):
+        """Queue one route request for the next micro-batch and wait for its answer"""
+        for name in ('origin', 'destination'):
+            if f'{name}_node' in request:
+                self.compiled.node_index([request[f'{name}_node']])
+            elif len(request.get(name, ())) != 2:
+                raise ValueError(f"'{name}' must be [x, y] or '{name}_node' a node id.")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def batcher(self):
+        """Collect the requests arriving together and answer them as one batch"""
+        while True:
+            batch = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self.run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def snap(self, requests):
+        """Node positions of the origins and destinations of a batch, with one snapping query for all points"""
+        ends = [None] * (2 * len(requests))
+        xs, ys, slots = [], [], []
+        for i, request in enumerate(requests):
+            for j, name in enumerate(('origin', 'destination')):
+                if f'{name}_node' in request:
+                    ends[2 * i + j] = request[f'{name}_node']
+                else:
+                    xs.append(float(request[name][0]))
+                    ys.append(float(request[name][1]))
+                    slots.append(2 * i + j)
+        if slots:
+            for slot, node in zip(slots, self.osm_object.get_nearest_node(xs, ys).tolist()):
+                ends[slot] = node
+        positions = self.compiled.node_index(np.array(ends)).reshape(-1, 2)
+        return positions[:, 0], positions[:, 1]
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        by_cost = {}
+        for request, future in batch:
+            cost = request.get('cost', 'length')
+            if cost not in self.compiled.costs:
+                if not future.done():
+                    future.set_exception(ValueError(f"Unknown cost '{cost}'."))
+                continue
+            by_cost.setdefault(cost, []).append((request, future))
+
+        for cost, items in by_cost.items():
+            try:
+                origins, destinations = self.snap([request for request, _ in items])
+                tasks = origin_tasks(cost, origins, destinations)
+                outputs = await asyncio.gather(*[loop.run_in_executor(self.executor, route_origin_chunk, task)
+                                                 for task in tasks])
+            except Exception as error:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for _, od_rows, costs, lengths, shaded, routes in outputs:
+                for row, cost_value, length, shaded_length, route in zip(od_rows, costs, lengths, shaded, routes):
+                    future = items[row][1]
+                    # The request may have been cancelled while the batch ran (timeout, client gone)
+                    if future.done():
+                        continue
+                    try:
+                        future.set_result({
+                            'route': self.compiled.node_ids[route].tolist(),
+                            'cost': float(cost_value) if np.isfinite(cost_value) else None,
+                            'length': float(length),
+                            'shaded_length': float(shaded_length),
+                            'origin_node': self.compiled.node_ids[origins[row]].item(),
+                            'destination_node': self.compiled.node_ids[destinations[row]].item(),
+                        })
+                    except Exception as error:
+                        future.set_exception(error)
+
+    async def respond(self, reader):
+        """(status, payload) of one HTTP request, None when the client went away before sending it all"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        except ValueError:
+            return 400, {'error': 'Malformed request.'}
+
+        try:
+            if len(request_line) < 2:
+                return 400, {'error': 'Malformed request.'}
+            if request_line[0] == 'GET' and request_line[1] == '/health':
+                return 200, {'status': 'ok', 'nodes': len(self.compiled.node_ids), 'edges': len(self.compiled.length)}
+            if request_line[0] == 'POST' and request_line[1] == '/route':
+                try:
+                    request = json.loads(body or b'{}')
+                    if not isinstance(request, dict):
+                        return 400, {'error': 'The request body must be a JSON object.'}
+                    return 200, await self.route(request)
+                except (ValueError, KeyError, TypeError) as error:
+                    return 400, {'error': str(error)}
+            return 404, {'error': 'Not found.'}
+        except asyncio.CancelledError as error:
+            # The handler itself being cancelled (server shutdown) must propagate; a cancelled batch is a 500
+            if asyncio.current_task().cancelling():
+                raise
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+        except Exception as error:
+            return 500, {'error': f"{type(error).__name__}: {error}"}
+
+    async def handle(self, reader, writer):
+        try:
+            response = await self.respond(reader)
+            if response is None:
+                return
+            status, payload = response
+            data = json.dumps(payload).encode('utf-8')
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("Routing service listening on http://%s:%s", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            # Let the batches in flight answer their requests before the pool goes away
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self.executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shade-aware walking route service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-dir', default=None, help="snapshot folder of Open_Street_Map")
+    parser.add_argument('--osm-file', default=None, help="local .osm extract instead of downloading")
+    parser.add_argument('--time', default=None, help="time of the sun position, e.g. '2024-12-09 14:00'")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-window-ms', type=float, default=5.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    service = RoutingService(Open_Street_Map(cache_dir=args.cache_dir, osm_file=args.osm_file), when=args.time,
+                             workers=args.workers, batch_window=args.batch_window_ms / 1000)
+    service.prepare()
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import json
+import numpy as np
+import pandas as pd
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from SunLocation import SolarTable
+from Raster_Coverage import RasterCoverage
+
+
+class ShadeTimetable:
+    """
+    Precomputed edges x time bins matrix of shaded fractions, stored as a .npy file plus a .json sidecar.
+
+    Rows follow the stable edge order of ShadowCoverage.edge_arrays (edges sorted by (u, v, key)), columns
+    are fixed width time bins over the daylight hours of one or more representative days. Routing workers
+    open the file with mmap_mode='r', so every process shares one copy through the page cache.
+    """
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(path + '.json') as file:
+            meta = json.load(file)
+        self.path = path
+        self.fractions = np.load(path + '.npy', mmap_mode=mmap_mode)
+        self.edge_keys = [tuple(key) for key in meta['edges']]
+        self.edge_index = {key: row for row, key in enumerate(self.edge_keys)}
+        self.days = pd.DatetimeIndex(meta['days'])
+        self.time_zone = meta['time_zone']
+        self.bin_minutes = meta['bin_minutes']
+        self.start_minute = meta['start_minute']
+        self.bins_per_day = meta['bins_per_day']
+        self.scale = meta['scale']
+
+    @staticmethod
+    def build(path, G, buildings, location, days, bin_minutes=15, start_hour=5, end_hour=20,
+              dtype='uint8', tile_size=100.0, resolution=None, spacing=2.0, cache=None):
+        """
+        Run the shadow and coverage stages for every time bin and write the timetable to path.
+
+        location: SunLocation.Location of the area. days: representative dates (e.g. one per month).
+        The sun position of each bin is taken at its middle; bins with the sun below the horizon are
+        stored as fully shaded. dtype 'uint8' stores fractions as 0..255, 'float16' stores them as is.
+        resolution: cell size of the approximate RasterCoverage mode (with edge samples every spacing
+        meters) instead of exact polygon coverage, see RasterCoverage for its error bound.
+        cache: a ShadowCache shared by repeated builds, flushed to its store at the end.
+        """
+        graph_crs = G.graph.get('crs', None)
+        if graph_crs is None:
+            raise ValueError("Graph G does not have a defined CRS. Please make sure it has a valid CRS.")
+        if buildings.crs != graph_crs:
+            buildings = buildings.to_crs(graph_crs)
+        scale = 255 if np.dtype(dtype) == np.uint8 else 1
+
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        total = shapely.length(edge_geoms)
+        raster = RasterCoverage(edge_geoms, resolution, spacing) if resolution is not None else None
+
+        days = pd.DatetimeIndex(pd.to_datetime(list(days))).normalize()
+        bins_per_day = int((end_hour - start_hour) * 60 // bin_minutes)
+        offsets = pd.to_timedelta(start_hour * 60 + (np.arange(bins_per_day) + 0.5) * bin_minutes, unit='min')
+        midpoints = pd.DatetimeIndex([day + offset for day in days for offset in offsets]).tz_localize(location.time_zone)
+        solar = SolarTable.from_times(location, midpoints)
+
+        fractions = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=dtype,
+                                              shape=(len(edge_keys), len(midpoints)))
+        for column, (azimuth, altitude) in enumerate(zip(solar.azimuth, solar.altitude)):
+            if altitude <= 0:
+                fraction = np.ones(len(edge_keys))
+            else:
+                shadows = Class_Shadow.generate_shadows(buildings, float(azimuth), float(altitude), cache=cache)
+                if raster is not None:
+                    fraction = raster.fractions(raster.sample(shadows))
+                else:
+                    shaded = ShadowCoverage(shadows, tile_size=tile_size).shaded_lengths(edge_geoms)
+                    fraction = np.divide(shaded, total, out=np.zeros_like(total), where=total > 0)
+            fractions[:, column] = np.round(fraction * scale) if scale != 1 else fraction
+        fractions.flush()
+        del fractions
+        if cache is not None:
+            cache.flush()
+
+        meta = {
+            'edges': [list(key) for key in edge_keys],
+            'days': [day.strftime('%Y-%m-%d') for day in days],
+            'time_zone': location.time_zone,
+            'bin_minutes': bin_minutes,
+            'start_minute': start_hour * 60,
+            'bins_per_day': bins_per_day,
+            'scale': scale,
+        }
+        with open(path + '.json', 'w') as file:
+            json.dump(meta, file)
+        return ShadeTimetable(path)
+
+    def edge_rows(self, edge_keys):
+        """Rows of the given (u, v, key) edges"""
+        return np.array([self.edge_index[tuple(key)] for key in edge_keys], dtype=np.int64)
+
+    def bin_index(self, times):
+        """
+        Column of every timestamp: the representative day closest in day of year and the bin of its time
+        of day. Times outside the covered hours get -1.
+        """
+        times = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(times)))
+        times = times.tz_localize(self.time_zone) if times.tz is None else times.tz_convert(self.time_zone)
+
+        day_gap = np.abs(times.dayofyear.to_numpy()[:, None] - self.days.dayofyear.to_numpy()[None, :])
+        day = np.argmin(np.minimum(day_gap, 366 - day_gap), axis=1)
+
+        minute = times.hour.to_numpy() * 60 + times.minute.to_numpy() + times.second.to_numpy() / 60
+        time_bin = np.floor((minute - self.start_minute) / self.bin_minutes).astype(np.int64)
+        inside = (time_bin >= 0) & (time_bin < self.bins_per_day)
+        return np.where(inside, day * self.bins_per_day + time_bin, -1)
+
+    def departure_clock(self, departure):
+        """
+        (representative day, minute of day) of a departure, for column_at inside a search loop.
+        """
+        departure = pd.Timestamp(departure)
+        departure = departure.tz_localize(self.time_zone) if departure.tz is None else departure.tz_convert(self.time_zone)
+        day_gap = np.abs(departure.dayofyear - self.days.dayofyear.to_numpy())
+        day = int(np.argmin(np.minimum(day_gap, 366 - day_gap)))
+        return day, departure.hour * 60 + departure.minute + departure.second / 60
+
+    def column_at(self, day, minute):
+        """Column of a minute of day on a representative day, -1 outside the covered hours"""
+        time_bin = int((minute - self.start_minute) // self.bin_minutes)
+        if time_bin < 0 or time_bin >= self.bins_per_day:
+            return -1
+        return day * self.bins_per_day + time_bin
+
+    def shade_fraction(self, rows, times):
+        """
+        Shaded fraction (0..1) of edge rows at the given times (broadcast together).
+        Times outside the covered hours count as fully shaded.
+        """
+        rows, columns = np.broadcast_arrays(np.asarray(rows), self.bin_index(times))
+        fraction = np.ones(rows.shape)
+        inside = columns >= 0
+        fraction[inside] = self.fractions[rows[inside], columns[inside]].astype(np.float64) / self.scale
+        return fraction
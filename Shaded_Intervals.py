@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage, DELTAS
+
+
+class ShadedIntervals:
+    """
+    Where along every edge the shade lies, as ragged arrays instead of intersection geometries.
+
+    The shaded stretches of edge i are values[offsets[i]:offsets[i + 1]], one (start, end) row per
+    stretch, measured in meters along the edge geometry from its first vertex (u). Stretches of an edge
+    are sorted and disjoint. Edges are in the sorted (u, v, key) order of ShadowCoverage.edge_arrays, the
+    same rows as CompiledGraph and SnapIndex, so a snapped edge or a route's edges index it directly.
+
+    Shade inside any part of any edge is a lookup in the cumulative shaded length of all stretches laid
+    end to end, so route statistics are array slices and need no new geometry operations.
+    """
+
+    def __init__(self, edge_keys, lengths, values, offsets):
+        self.edge_keys = edge_keys
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float32).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        # Every edge on its own stretch of one axis, and the shade accumulated up to each stretch start
+        self._shift = np.concatenate([[0.0], np.cumsum(self.lengths + 1.0)[:-1]])
+        edge_of_value = np.repeat(np.arange(len(self.lengths)), np.diff(self.offsets))
+        self._starts = self.values[:, 0].astype(np.float64) + self._shift[edge_of_value]
+        self._ends = self.values[:, 1].astype(np.float64) + self._shift[edge_of_value]
+        self._before = np.concatenate([[0.0], np.cumsum(self._ends - self._starts)])
+
+    @classmethod
+    def from_coverage(cls, engine, G):
+        """Shaded stretches of all edges of G from a ShadowCoverage engine"""
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        edge_idx, starts, ends = engine.shaded_intervals(edge_geoms)
+        offsets = np.searchsorted(edge_idx, np.arange(len(edge_keys) + 1))
+        return cls(edge_keys, shapely.length(edge_geoms), np.column_stack([starts, ends]), offsets)
+
+    @classmethod
+    def from_graph(cls, G, shadows, tile_size=100.0):
+        """Shaded stretches of all edges of G under shadows in the CRS of G"""
+        return cls.from_coverage(ShadowCoverage(shadows, tile_size=tile_size), G)
+
+    def intervals(self, edge):
+        """(start, end) rows of one edge"""
+        return self.values[self.offsets[edge]:self.offsets[edge + 1]]
+
+    def shaded_lengths(self):
+        lengths = self.values[:, 1].astype(np.float64) - self.values[:, 0]
+        return np.bincount(np.repeat(np.arange(len(self.lengths)), np.diff(self.offsets)), weights=lengths,
+                           minlength=len(self.lengths))
+
+    def _shade_until(self, edge_idx, position):
+        """Shaded length of the edges from their start up to position meters"""
+        at = np.clip(position, 0.0, self.lengths[edge_idx]) + self._shift[edge_idx]
+        before = np.searchsorted(self._starts, at, side='right') - 1
+        inside = np.clip(at - self._starts[np.maximum(before, 0)], 0.0,
+                         (self._ends - self._starts)[np.maximum(before, 0)]) if len(self._starts) else 0.0
+        return np.where(before >= 0, self._before[np.maximum(before, 0)] + inside, 0.0)
+
+    def shaded_between(self, edge_idx, start, end):
+        """
+        Shaded length of the part of every edge between two offsets, in either order (a part walked from
+        end back to start has the same shade).
+        """
+        edge_idx = np.asarray(edge_idx, dtype=np.int64)
+        start, end = np.asarray(start, dtype=np.float64), np.asarray(end, dtype=np.float64)
+        return np.abs(self._shade_until(edge_idx, end) - self._shade_until(edge_idx, start))
+
+    def piece_costs(self, edge_idx, start, end, weight='length', full_costs=None, delta=DELTAS):
+        """
+        Cost of walking parts of edges under a cost column: 'length', 'cost_i' (sun + shade / delta[i - 1])
+        from the actual shade of the part, other columns as the share of the full edge cost in full_costs.
+        """
+        edge_idx = np.asarray(edge_idx, dtype=np.int64)
+        length = np.abs(np.asarray(end, dtype=np.float64) - np.asarray(start, dtype=np.float64))
+        if weight == 'length':
+            return length
+        name, _, number = weight.partition('_')
+        if name == 'cost' and number.isdigit() and 1 <= int(number) <= len(delta):
+            return Class_Shadow.edge_costs(length, self.shaded_between(edge_idx, start, end), delta)[weight]
+        share = np.divide(length, self.lengths[edge_idx], out=np.zeros_like(length), where=self.lengths[edge_idx] > 0)
+        return np.asarray(full_costs, dtype=np.float64)[edge_idx] * share
+
+    def totals(self, edge_idx, start=None, end=None):
+        """(meters walked, meters in shade) along consecutive edge parts; whole edges by default"""
+        edge_idx = np.asarray(edge_idx, dtype=np.int64)
+        start = np.zeros(len(edge_idx)) if start is None else start
+        end = self.lengths[edge_idx] if end is None else end
+        length = np.abs(np.asarray(end, dtype=np.float64) - np.asarray(start, dtype=np.float64)).sum()
+        return float(length), float(self.shaded_between(edge_idx, start, end).sum())
+
+    def profile(self, edge_idx, start=None, end=None):
+        """
+        Sun and shade along a walk over consecutive edge parts (whole edges by default). A part with end
+        before start is walked backwards along its edge.
+
+        Returns a table of alternating sun and shade segments (start, end, length, shaded) in meters from
+        the beginning of the walk; shade that continues over an edge boundary is one segment.
+        """
+        edge_idx = np.asarray(edge_idx, dtype=np.int64)
+        start = np.zeros(len(edge_idx)) if start is None else np.asarray(start, dtype=np.float64)
+        end = self.lengths[edge_idx] if end is None else np.asarray(end, dtype=np.float64)
+        low, high = np.minimum(start, end), np.maximum(start, end)
+        forward = end >= start
+        walked = np.concatenate([[0.0], np.cumsum(high - low)])
+
+        # Stretches of the walked edges, clipped to the walked parts and placed on the walk
+        counts = self.offsets[edge_idx + 1] - self.offsets[edge_idx]
+        part = np.repeat(np.arange(len(edge_idx)), counts)
+        row = np.repeat(self.offsets[edge_idx], counts) + np.arange(len(part)) - np.repeat(np.cumsum(counts) - counts, counts)
+        shade_start = np.clip(self.values[row, 0], low[part], high[part])
+        shade_end = np.clip(self.values[row, 1], low[part], high[part])
+        on_walk_start = np.where(forward[part], shade_start - low[part], high[part] - shade_end) + walked[part]
+        on_walk_end = on_walk_start + (shade_end - shade_start)
+        kept = on_walk_end > on_walk_start
+        on_walk_start, on_walk_end = on_walk_start[kept], on_walk_end[kept]
+        order = np.argsort(on_walk_start, kind='stable')
+        on_walk_start, on_walk_end = on_walk_start[order], on_walk_end[order]
+
+        # Merge shade that touches across part boundaries, then fill the gaps with sun
+        if len(on_walk_start):
+            covered_until = np.maximum.accumulate(on_walk_end)
+            opens = np.ones(len(on_walk_start), dtype=bool)
+            opens[1:] = on_walk_start[1:] > covered_until[:-1] + 1e-6
+            first = np.flatnonzero(opens)
+            last = np.concatenate([first[1:], [len(on_walk_start)]]) - 1
+            on_walk_start, on_walk_end = on_walk_start[first], covered_until[last]
+        bounds = np.concatenate([[0.0], np.column_stack([on_walk_start, on_walk_end]).ravel(), [walked[-1]]])
+        segments = pd.DataFrame({'start': bounds[:-1], 'end': bounds[1:]})
+        segments['shaded'] = np.arange(len(segments)) % 2 == 1
+        segments['length'] = segments['end'] - segments['start']
+        return segments[segments['length'] > 0].reset_index(drop=True)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from Class_Shadow import Class_Shadow
+
+
+class ShadowCache:
+    """
+    Cache of building shadows keyed by (building id, footprint hash, height, mode, quantized sun position).
+    The mode part includes the bounds of prism shadows, which change their clipping.
+
+    Sun positions are rounded to azimuth_step / altitude_step degrees and shadows are always generated at
+    the rounded position, so a cached shadow is the same whichever exact position filled it. Entries live
+    in an in-memory LRU of at most max_items shadows and, when path is given, in a folder of parquet files
+    (WKB geometries plus the key columns) that later runs read back one sun position at a time.
+
+    Keys of the loaded positions that are in the store are kept in an index, so a shadow evicted from
+    the LRU is read back rather than generated and written again. New shadows wait in pending until
+    flush(), which runs by itself once flush_every of them have piled up.
+    """
+
+    def __init__(self, max_items=200000, path=None, azimuth_step=0.5, altitude_step=0.25, flush_every=50000):
+        self.max_items = max_items
+        self.path = path
+        self.azimuth_step = azimuth_step
+        self.altitude_step = altitude_step
+        self.flush_every = flush_every
+        self.entries = OrderedDict()
+        self.pending = OrderedDict()
+        self.stored = set()
+        self.loaded_positions = set()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def quantize(self, azimuth, altitude):
+        azimuth = round(float(azimuth) / self.azimuth_step) * self.azimuth_step % 360
+        altitude = round(float(altitude) / self.altitude_step) * self.altitude_step
+        return round(azimuth, 6), round(altitude, 6)
+
+    @staticmethod
+    def building_keys(buildings_gdf):
+        """(building id, footprint WKB hash, height in cm) of every building"""
+        wkb = shapely.to_wkb(buildings_gdf.geometry.to_numpy())
+        hashes = [hashlib.blake2b(value, digest_size=8).hexdigest() if value is not None else ''
+                  for value in wkb.tolist()]
+        heights = np.round(pd.to_numeric(buildings_gdf['height'], errors='coerce').fillna(0).to_numpy() * 100)
+        return list(zip(map(str, buildings_gdf.index), hashes, heights.astype(np.int64).tolist()))
+
+    def _remember(self, key, shadow):
+        self.entries[key] = shadow
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+    def _read(self, mode, azimuth, altitude, buildings=None):
+        """Stored shadows of one sun position (of the given building ids only, when given) as {key: shadow}"""
+        filters = [('mode', '==', mode), ('azimuth', '==', azimuth), ('altitude', '==', altitude)]
+        if buildings is not None:
+            filters.append(('building', 'in', sorted(set(buildings))))
+        table = pd.read_parquet(self.path, filters=filters)
+        shadows = shapely.from_wkb(table['wkb'].to_numpy())
+        keys = zip(table['building'].tolist(), table['geometry_hash'].tolist(), table['height_cm'].tolist())
+        return {(building, geometry_hash, height, mode, azimuth, altitude): shadow
+                for (building, geometry_hash, height), shadow in zip(keys, shadows.tolist())}
+
+    def _load_position(self, mode, azimuth, altitude):
+        """Read the stored shadows of one sun position into memory and the index, once per position"""
+        position = (mode, azimuth, altitude)
+        if self.path is None or position in self.loaded_positions or not os.listdir(self.path):
+            return
+        self.loaded_positions.add(position)
+        for key, shadow in self._read(mode, azimuth, altitude).items():
+            self.stored.add(key)
+            self._remember(key, shadow)
+
+    def shadows(self, buildings_gdf, azimuth, altitude, mode='distorted', bounds=None):
+        """
+        Shadows of all buildings like Class_Shadow.generate_shadows, generating only the missing ones.
+        """
+        azimuth, altitude = self.quantize(Class_Shadow._scalar(azimuth), Class_Shadow._scalar(altitude))
+        mode_key = mode if bounds is None else f"{mode}:{','.join(repr(float(value)) for value in bounds)}"
+        self._load_position(mode_key, azimuth, altitude)
+        keys = [building_key + (mode_key, azimuth, altitude) for building_key in self.building_keys(buildings_gdf)]
+
+        result = np.full(len(keys), None, dtype=object)
+        missing = []
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                result[i] = self.entries[key]
+            elif key in self.pending:
+                result[i] = self.pending[key]
+                self._remember(key, result[i])
+            else:
+                missing.append(i)
+
+        # Shadows evicted from memory but in the store are read back instead of generated again
+        evicted = [i for i in missing if keys[i] in self.stored]
+        if evicted:
+            found = self._read(mode_key, azimuth, altitude, [keys[i][0] for i in evicted])
+            for i in evicted:
+                if keys[i] in found:
+                    result[i] = found[keys[i]]
+                    self._remember(keys[i], result[i])
+            missing = [i for i in missing if keys[i] not in found]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            generated = Class_Shadow.generate_shadows(buildings_gdf.iloc[missing], azimuth, altitude, mode=mode,
+                                                      bounds=bounds).to_numpy()
+            result[missing] = generated
+            for i, shadow in zip(missing, generated.tolist()):
+                self._remember(keys[i], shadow)
+                if self.path is not None:
+                    self.pending[keys[i]] = shadow
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+        return gpd.GeoSeries(result, index=buildings_gdf.index, crs=buildings_gdf.crs)
+
+    def flush(self):
+        """Write the shadows generated since the last flush as a new parquet file of the store"""
+        # Pending is keyed by the cache key, so a building is written once per position; skip what is stored
+        pending = [(key, shadow) for key, shadow in self.pending.items() if key not in self.stored]
+        if self.path is None or not pending:
+            self.pending.clear()
+            return
+        keys, shadows = zip(*pending)
+        table = pd.DataFrame(list(keys), columns=['building', 'geometry_hash', 'height_cm', 'mode', 'azimuth', 'altitude'])
+        table['wkb'] = shapely.to_wkb(np.array(shadows, dtype=object))
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        # Readers skip files starting with '_', so a half written part is never read
+        table.to_parquet(os.path.join(self.path, '_' + name), index=False)
+        os.replace(os.path.join(self.path, '_' + name), os.path.join(self.path, name))
+        self.stored.update(keys)
+        self.pending.clear()
@@ -0,0 +1,350 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Graph_Store import GraphStore
+import Profiling
+
+# Shared memory blocks created by a SharedExecutor of this process, and blocks a worker attached to
+_owned_blocks = {}
+_attached_blocks = {}
+
+
+def _gather(offsets, rows):
+    """Flat positions of the members of ragged rows, and the member count of every row"""
+    counts = offsets[rows + 1] - offsets[rows]
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(offsets[rows], counts) + np.arange(counts.sum()) - starts, counts
+
+
+def pack_polygons(geoms):
+    """
+    Polygon parts of every geometry as flat arrays: coords, ring_offsets (coords of every ring),
+    part_offsets (rings of every part, the exterior first) and geom_offsets (parts of every geometry).
+    Missing, empty and non polygonal geometries have no parts.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    parts, part_geom = shapely.get_parts(geoms, return_index=True)
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    parts, part_geom = parts[keep], part_geom[keep]
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    return {'coords': coords,
+            'ring_offsets': np.searchsorted(coord_ring, np.arange(len(rings) + 1)),
+            'part_offsets': np.searchsorted(ring_part, np.arange(len(parts) + 1)),
+            'geom_offsets': np.searchsorted(part_geom, np.arange(len(geoms) + 1))}
+
+
+def concat_packed(packs):
+    """One packed array of the geometries of several pack_polygons results, in order"""
+    coord_shift = np.cumsum([0] + [len(pack['coords']) for pack in packs])
+    ring_shift = np.cumsum([0] + [len(pack['ring_offsets']) - 1 for pack in packs])
+    part_shift = np.cumsum([0] + [len(pack['part_offsets']) - 1 for pack in packs])
+    return {'coords': np.concatenate([pack['coords'] for pack in packs]).reshape(-1, 2),
+            'ring_offsets': np.concatenate([[0]] + [pack['ring_offsets'][1:] + coord_shift[i]
+                                                    for i, pack in enumerate(packs)]),
+            'part_offsets': np.concatenate([[0]] + [pack['part_offsets'][1:] + ring_shift[i]
+                                                    for i, pack in enumerate(packs)]),
+            'geom_offsets': np.concatenate([[0]] + [pack['geom_offsets'][1:] + part_shift[i]
+                                                    for i, pack in enumerate(packs)])}
+
+
+def polygon_parts(packed, parts):
+    """Polygons of the given part rows of a packed array"""
+    if len(parts) == 0:
+        return np.array([], dtype=object)
+    rings, ring_counts = _gather(packed['part_offsets'], parts)
+    coords, coord_counts = _gather(packed['ring_offsets'], rings)
+    linearrings = shapely.linearrings(packed['coords'][coords], indices=np.repeat(np.arange(len(rings)), coord_counts))
+    return shapely.polygons(linearrings, indices=np.repeat(np.arange(len(parts)), ring_counts))
+
+
+def unpack_polygons(packed, start, stop):
+    """Geometries start..stop of a packed array: Polygons, MultiPolygons, None where there are no parts"""
+    part_counts = np.diff(packed['geom_offsets'][start:stop + 1])
+    parts = polygon_parts(packed, np.arange(packed['geom_offsets'][start], packed['geom_offsets'][stop]))
+    geoms = np.full(stop - start, None, dtype=object)
+    part_geom = np.repeat(np.arange(stop - start), part_counts)
+    single = part_counts[part_geom] == 1
+    geoms[part_geom[single]] = parts[single]
+    multi = np.flatnonzero(part_counts > 1)
+    if len(multi):
+        geoms[multi] = shapely.multipolygons(parts[~single], indices=np.repeat(np.arange(len(multi)), part_counts[multi]))
+    return geoms
+
+
+def _arrays(spec):
+    """NumPy views of the shared arrays of a task, attaching to the blocks this process does not own"""
+    arrays = {}
+    for key, (name, shape, dtype) in spec.items():
+        block = _owned_blocks.get(name) or _attached_blocks.get(name)
+        if block is None:
+            block = _attached_blocks[name] = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return arrays
+
+
+def _detach():
+    """Close the blocks attached by a task once its views are gone, so workers never keep old stages mapped"""
+    for name, block in list(_attached_blocks.items()):
+        try:
+            block.close()
+        except BufferError:
+            # Still viewed (e.g. by the traceback of a failed task): retried after the next task
+            continue
+        del _attached_blocks[name]
+
+
+def _init_worker():
+    """Drop the blocks a forked worker inherited from its parent; workers attach to what their tasks name"""
+    for block in list(_owned_blocks.values()) + list(_attached_blocks.values()):
+        try:
+            block.close()
+        except BufferError:
+            pass
+    _owned_blocks.clear()
+    _attached_blocks.clear()
+
+
+def _prefixed(arrays, prefix):
+    return {key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)}
+
+
+def _shadow_range(task):
+    """Shadows of the buildings start..stop, returned packed"""
+    try:
+        return _shadows_of_range(*task)
+    finally:
+        _detach()
+
+
+def _shadows_of_range(spec, start, stop, azimuth, altitude, mode, bounds):
+    arrays = _arrays(spec)
+    footprints = unpack_polygons(_prefixed(arrays, 'footprint_'), start, stop)
+    buildings = gpd.GeoDataFrame({'height': arrays['heights'][start:stop].copy()}, geometry=footprints)
+    shadows = Class_Shadow.generate_shadows(buildings, azimuth, altitude, mode=mode, bounds=bounds)
+    return pack_polygons(shadows.to_numpy())
+
+
+def _coverage_range(task):
+    """Shaded lengths of the edges start..stop, written into the shared output"""
+    try:
+        return _coverage_of_range(*task)
+    finally:
+        _detach()
+
+
+def _coverage_of_range(spec, start, stop, tile_size):
+    arrays = _arrays(spec)
+    coords, counts = _gather(arrays['edge_offsets'], np.arange(start, stop))
+    edges = shapely.linestrings(arrays['edge_coords'][coords], indices=np.repeat(np.arange(stop - start), counts))
+
+    # Dissolve only the cells of a grid anchored at the origin that these edges touch, so neighboring
+    # ranges share few cells, and only with the shadow parts whose bounds reach those cells
+    x0, y0, x1, y1 = np.floor(shapely.bounds(edges) / tile_size).astype(np.int64).T
+    columns, count = x1 - x0 + 1, (x1 - x0 + 1) * (y1 - y0 + 1)
+    edge = np.repeat(np.arange(len(count)), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    cells = np.unique(np.column_stack([x0[edge] + k % columns[edge], y0[edge] + k // columns[edge]]), axis=0)
+    boxes = shapely.box(cells[:, 0] * tile_size, cells[:, 1] * tile_size, (cells[:, 0] + 1) * tile_size,
+                        (cells[:, 1] + 1) * tile_size)
+    xmin, ymin, xmax, ymax = shapely.total_bounds(boxes)
+    bounds = arrays['shadow_bounds']
+    near = np.flatnonzero((bounds[:, 0] <= xmax) & (bounds[:, 2] >= xmin) & (bounds[:, 1] <= ymax)
+                          & (bounds[:, 3] >= ymin))
+    shadows = polygon_parts(_prefixed(arrays, 'shadow_'), near)
+    engine = ShadowCoverage(shadows, tile_size=tile_size, boxes=boxes)
+    arrays['shaded'][start:stop] = engine.shaded_lengths(edges)
+    return stop - start
+
+
+class SharedExecutor:
+    """
+    Process pool for the shadow and coverage stages that shares its inputs instead of pickling them.
+
+    Footprints, heights, edge coordinates and shadows are flattened into coordinate and offset arrays
+    (see pack_polygons) and copied once into multiprocessing.shared_memory blocks. Tasks are only
+    (block names, index range) tuples; a shadow task returns the packed shadows of its buildings and a
+    coverage task writes its shaded lengths straight into a shared output array. Buildings and edges are
+    put in Hilbert curve order first, so every index range is a compact area and a coverage task only
+    rebuilds the shadows near its edges.
+
+    processes=1 runs the tasks in this process, None uses one worker per core. The pool is kept between
+    calls; use the executor as a context manager or call close() when done.
+    """
+
+    def __init__(self, processes=None, chunk_size=2000, tile_size=100.0):
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def start(self):
+        """
+        Start the pool. Every stage calls this before sharing its arrays, so workers are forked before
+        any block of the stage exists; the worker initializer also drops any block a child inherited.
+        """
+        if self.processes != 1 and self.executor is None:
+            # Workers share the resource tracker of this process, which forgets a block when it is unlinked here
+            resource_tracker.ensure_running()
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker)
+            # Fork all the workers now instead of at the first task
+            self.executor.submit(int).result()
+        return self
+
+    def _map(self, function, tasks):
+        if self.processes == 1:
+            return list(map(function, tasks))
+        self.start()
+        return list(self.executor.map(function, tasks))
+
+    def _ranges(self, n):
+        """Index ranges of about chunk_size items, at least four per worker when there are few items"""
+        workers = self.processes or os.cpu_count() or 1
+        step = max(1, min(self.chunk_size, -(-n // (4 * workers))))
+        return [(start, min(start + step, n)) for start in range(0, n, step)]
+
+    @staticmethod
+    def _share(arrays):
+        """Copy arrays into new shared memory blocks; returns the spec {key: (block name, shape, dtype)}"""
+        spec = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            _owned_blocks[block.name] = block
+            spec[key] = (block.name, array.shape, array.dtype.str)
+        return spec
+
+    @staticmethod
+    def _release(spec):
+        for name, _, _ in spec.values():
+            block = _owned_blocks.pop(name)
+            block.close()
+            block.unlink()
+
+    @staticmethod
+    def hilbert_order(x, y):
+        """Positions of points sorted along a Hilbert curve over their extent"""
+        if len(x) == 0:
+            return np.array([], dtype=np.int64)
+        distance = gpd.GeoSeries(shapely.points(x, y)).hilbert_distance()
+        return np.argsort(distance.to_numpy(), kind='stable')
+
+    @staticmethod
+    def part_bounds(packed):
+        """(minx, miny, maxx, maxy) of every part of a packed array, from its exterior ring"""
+        first = packed['ring_offsets'][packed['part_offsets'][:-1]]
+        if len(first) == 0:
+            return np.empty((0, 4))
+        coords = packed['coords']
+        # Every reduction runs to the next part, so it also sees the holes, which lie inside the exterior
+        x_min = np.minimum.reduceat(coords[:, 0], first)
+        y_min = np.minimum.reduceat(coords[:, 1], first)
+        x_max = np.maximum.reduceat(coords[:, 0], first)
+        y_max = np.maximum.reduceat(coords[:, 1], first)
+        return np.column_stack([x_min, y_min, x_max, y_max])
+
+    def _packed_shadows(self, buildings, azimuth, altitude, mode, bounds):
+        """Packed shadows of the buildings in Hilbert order, and that order"""
+        footprints = buildings.geometry.to_numpy()
+        heights = pd.to_numeric(buildings['height'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        centers = shapely.bounds(footprints)
+        order = self.hilbert_order(np.nan_to_num((centers[:, 0] + centers[:, 2]) / 2),
+                                   np.nan_to_num((centers[:, 1] + centers[:, 3]) / 2))
+        packed = pack_polygons(footprints[order])
+        self.start()
+        spec = self._share({'heights': heights[order], **{'footprint_' + key: value for key, value in packed.items()}})
+        try:
+            tasks = [(spec, start, stop, azimuth, altitude, mode, bounds) for start, stop in self._ranges(len(order))]
+            shadows = concat_packed(self._map(_shadow_range, tasks)) if tasks else pack_polygons([])
+        finally:
+            self._release(spec)
+        return shadows, order
+
+    def shadows(self, buildings, azimuth, altitude, mode='distorted', bounds=None):
+        """Class_Shadow.generate_shadows of all buildings, computed by the pool"""
+        azimuth, altitude = Class_Shadow._scalar(azimuth), Class_Shadow._scalar(altitude)
+        with Profiling.stage('parallel_shadows', items=len(buildings)):
+            packed, order = self._packed_shadows(buildings, azimuth, altitude, mode, bounds)
+            result = np.full(len(order), None, dtype=object)
+            result[order] = unpack_polygons(packed, 0, len(order))
+        return gpd.GeoSeries(result, index=buildings.index, crs=buildings.crs)
+
+    def _packed_edges(self, edges):
+        """Edge coordinates and offsets in Hilbert order of the edge end points, from LineStrings or a GraphStore"""
+        if isinstance(edges, GraphStore):
+            coords, offsets = edges.coords, edges.geometry_offsets
+        else:
+            coords, edge_idx = shapely.get_coordinates(np.asarray(edges, dtype=object), return_index=True)
+            offsets = np.searchsorted(edge_idx, np.arange(len(edges) + 1))
+        ends = np.maximum(offsets[1:] - 1, offsets[:-1])
+        order = self.hilbert_order((coords[offsets[:-1], 0] + coords[ends, 0]) / 2,
+                                   (coords[offsets[:-1], 1] + coords[ends, 1]) / 2) if len(coords) else np.arange(len(ends))
+        rows, counts = _gather(offsets, order)
+        return coords[rows], np.concatenate([[0], np.cumsum(counts)]), order
+
+    def _shaded_lengths(self, edges, shadows_packed):
+        edge_coords, edge_offsets, order = self._packed_edges(edges)
+        shaded = np.zeros(len(order))
+        if len(order) == 0:
+            return shaded
+        self.start()
+        spec = self._share({'edge_coords': edge_coords, 'edge_offsets': edge_offsets,
+                            'shadow_bounds': self.part_bounds(shadows_packed), 'shaded': np.zeros(len(order)),
+                            **{'shadow_' + key: value for key, value in shadows_packed.items()}})
+        try:
+            tasks = [(spec, start, stop, self.tile_size) for start, stop in self._ranges(len(order))]
+            self._map(_coverage_range, tasks)
+            output = _arrays({'shaded': spec['shaded']})['shaded']
+            shaded[order] = output
+            del output
+        finally:
+            self._release(spec)
+        return shaded
+
+    def shaded_lengths(self, edges, shadows):
+        """
+        ShadowCoverage(shadows).shaded_lengths(edges), computed by the pool. edges is an array of
+        LineStrings or a GraphStore (whose coordinate buffer is shared as is).
+        """
+        with Profiling.stage('parallel_coverage', items=len(edges.edge_u) if isinstance(edges, GraphStore) else len(edges)):
+            return self._shaded_lengths(edges, pack_polygons(shadows))
+
+    def apply_to_graph(self, G, shadows):
+        """Same attributes and table as ShadowCoverage.apply_to_graph"""
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        return ShadowCoverage.write_coverage(G, edge_keys, edge_geoms, self.shaded_lengths(edge_geoms, shadows))
+
+    def run(self, G, buildings, azimuth, altitude, mode='distorted', bounds=None):
+        """
+        Shadows of all buildings (in the CRS of G) and coverage of all edges of G; the shadows stay packed
+        between the two stages. Writes 'shadow_coverage' and 'shaded_length' on G and returns
+        (coverage table, shadows as a GeoSeries aligned with buildings).
+        """
+        azimuth, altitude = Class_Shadow._scalar(azimuth), Class_Shadow._scalar(altitude)
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        with Profiling.stage('parallel_shadows', items=len(buildings)):
+            packed, order = self._packed_shadows(buildings, azimuth, altitude, mode, bounds)
+        with Profiling.stage('parallel_coverage', items=len(edge_keys)):
+            shaded = self._shaded_lengths(edge_geoms, packed)
+        table = ShadowCoverage.write_coverage(G, edge_keys, edge_geoms, shaded)
+        shadows = np.full(len(order), None, dtype=object)
+        shadows[order] = unpack_polygons(packed, 0, len(order))
+        return table, gpd.GeoSeries(shadows, index=buildings.index, crs=buildings.crs)
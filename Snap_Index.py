@@ -0,0 +1,52 @@
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+from Class_Shadow import ShadowCoverage
+
+
+class SnapIndex:
+    """
+    Spatial index of a graph built once, for snapping batches of points to nodes and edges.
+
+    Nodes are kept in a KD-tree and edge geometries in an STRtree, so a lookup is one vectorized query
+    instead of rebuilding a tree per call like ox.distance.nearest_nodes. Coordinates are in the CRS of
+    the graph.
+    """
+
+    def __init__(self, G):
+        self.node_ids = np.array(list(G.nodes))
+        self.node_coords = np.array([(data['x'], data['y']) for _, data in G.nodes(data=True)], dtype=np.float64)
+        self.node_tree = cKDTree(self.node_coords)
+        self.edge_keys, self.edge_geoms = ShadowCoverage.edge_arrays(G)
+        self.edge_tree = shapely.STRtree(self.edge_geoms)
+
+    def nearest_nodes(self, x, y, return_dist=False):
+        """
+        Nearest node id of every point (scalars in, scalar out, like ox.distance.nearest_nodes).
+        """
+        scalar = np.ndim(x) == 0
+        points = np.column_stack([np.atleast_1d(x), np.atleast_1d(y)]).astype(np.float64)
+        distances, positions = self.node_tree.query(points)
+        nodes = self.node_ids[positions]
+        if scalar:
+            nodes, distances = nodes[0], distances[0]
+        return (nodes, distances) if return_dist else nodes
+
+    def nearest_edges(self, x, y):
+        """
+        Nearest edge of every point.
+
+        Returns (edge_idx, distance, offset): edge_idx indexes self.edge_keys ((u, v, key) sorted), distance
+        is from the point to the edge, and offset is the position of the snapped point along the edge
+        geometry, measured from u.
+        """
+        points = shapely.points(np.atleast_1d(x), np.atleast_1d(y))
+        (point_idx, edge_idx), distances = self.edge_tree.query_nearest(points, return_distance=True,
+                                                                        all_matches=False)
+        # query_nearest returns pairs ordered by point, one pair per point with all_matches=False
+        edge_of_point = np.empty(len(points), dtype=np.int64)
+        distance = np.empty(len(points))
+        edge_of_point[point_idx] = edge_idx
+        distance[point_idx] = distances
+        offset = shapely.line_locate_point(self.edge_geoms[edge_of_point], points)
+        return edge_of_point, distance, offset
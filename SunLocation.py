@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 import pvlib
 from datetime import datetime,date
 import pytz
@@ -23,7 +25,8 @@ class Location:
         self.time_zone = tz
         self.location_obj = self.make_location()
 
-        self.time = datetime(YEAR, MONTH, DAY, HOUR, DAY, tzinfo=pytz.timezone(self.time_zone))
+        # localize() instead of tzinfo=, which would pick the zone's historical LMT offset
+        self.time = pytz.timezone(self.time_zone).localize(datetime(YEAR, MONTH, DAY, HOUR, MINUTE))
 
 
     def make_location(self):
@@ -42,6 +45,79 @@ class SunLocation:
         self.azimuth = self.solar_position['azimuth']
         self.altitude = self.solar_position['apparent_elevation']
 
+    def solar_table(self, start, end, freq='1min'):
+        """Solar positions between start and end (every minute by default) at this location"""
+        return SolarTable.for_range(self.location, start, end, freq)
 
     def is_sunset(self):
-        pass   
\ No newline at end of file
+        """True when the sun is below the horizon at the set time (no shadows to compute)"""
+        return float(np.asarray(self.altitude).ravel()[0]) <= 0
+
+
+class SolarTable:
+    """
+    Azimuth and apparent elevation for a whole DatetimeIndex, computed with one vectorized pvlib call.
+
+    The table keeps only three NumPy arrays (UTC nanoseconds as int64, azimuth and altitude as float32)
+    and answers lookups for any timestamps inside its range by linear interpolation.
+    """
+
+    def __init__(self, times, azimuth, altitude, time_zone=TIME_ZONE) -> None:
+        self.times = np.asarray(times, dtype=np.int64)
+        self.azimuth = np.asarray(azimuth, dtype=np.float32)
+        self.altitude = np.asarray(altitude, dtype=np.float32)
+        self.time_zone = time_zone
+
+    @classmethod
+    def from_times(cls, location, times):
+        """Compute the table for a DatetimeIndex (naive times are in the location's time zone)"""
+        times = pd.DatetimeIndex(times)
+        if times.tz is None:
+            times = times.tz_localize(location.time_zone)
+        solar_position = location.location_obj.get_solarposition(times)
+        return cls(times.tz_convert('UTC').as_unit('ns').asi8,
+                   solar_position['azimuth'].to_numpy(),
+                   solar_position['apparent_elevation'].to_numpy(),
+                   location.time_zone)
+
+    @classmethod
+    def for_range(cls, location, start, end, freq='1min'):
+        return cls.from_times(location, pd.date_range(start, end, freq=freq, tz=location.time_zone))
+
+    def _to_ns(self, times):
+        times = pd.DatetimeIndex(np.atleast_1d(pd.to_datetime(times)))
+        if times.tz is None:
+            times = times.tz_localize(self.time_zone)
+        return times.tz_convert('UTC').as_unit('ns').asi8
+
+    def lookup(self, times):
+        """
+        Interpolated (azimuth, altitude) arrays for the given timestamps.
+
+        Azimuth is interpolated along the shorter arc, so passing through north (360 -> 0) is handled.
+        """
+        query = self._to_ns(times)
+        if len(self.times) == 0 or query.min() < self.times[0] or query.max() > self.times[-1]:
+            raise ValueError("Requested times are outside the range of the solar table.")
+
+        right = np.clip(np.searchsorted(self.times, query, side='right'), 1, len(self.times) - 1)
+        left = right - 1
+        span = (self.times[right] - self.times[left]).astype(np.float64)
+        weight = np.divide((query - self.times[left]).astype(np.float64), span,
+                           out=np.zeros(len(query)), where=span > 0)
+
+        azimuth_left = self.azimuth[left].astype(np.float64)
+        azimuth_step = (self.azimuth[right] - azimuth_left + 180.0) % 360.0 - 180.0
+        azimuth = (azimuth_left + weight * azimuth_step) % 360.0
+        altitude_left = self.altitude[left].astype(np.float64)
+        altitude = altitude_left + weight * (self.altitude[right] - altitude_left)
+        return azimuth, altitude
+
+    def save(self, path):
+        np.savez(path, times=self.times, azimuth=self.azimuth, altitude=self.altitude,
+                 time_zone=np.array(self.time_zone))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['times'], data['azimuth'], data['altitude'], str(data['time_zone']))
@@ -0,0 +1,124 @@
+import math
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import networkx as nx
+import shapely
+
+CRS = 'EPSG:32636'
+# South west corner of the generated city, near Beer Sheva in UTM zone 36N
+ORIGIN = (670000.0, 3455000.0)
+
+
+class SyntheticCity:
+    """
+    Deterministic city of square blocks for benchmarks and offline tests.
+
+    The outputs have the shapes Open_Street_Map produces after its preparation steps: the building table
+    of prepare_buildings ('height', 'levels', 'addr:housenumber' in the (element, id) index of osmnx
+    features), and a projected walk MultiDiGraph with 'x'/'y' nodes and two way edges carrying 'osmid',
+    'highway', 'oneway', 'reversed', 'length' and 'geometry'. The same arguments always give the same city.
+    """
+
+    def __init__(self, n_buildings=1000, seed=0, block_size=90.0, street_width=14.0, slots_per_side=3,
+                 crs=CRS, origin=ORIGIN):
+        self.n_buildings = n_buildings
+        self.seed = seed
+        self.block_size = block_size
+        self.street_width = street_width
+        self.slots_per_side = slots_per_side
+        self.crs = crs
+        self.origin = origin
+        # Square grid of blocks with a few free slots so that not every block is full
+        slots_per_block = slots_per_side * slots_per_side
+        self.blocks_per_side = max(1, math.ceil(math.sqrt(n_buildings / (0.8 * slots_per_block))))
+
+    @staticmethod
+    def generate(n_buildings=1000, seed=0, crs=CRS):
+        """(G, buildings) of a city with n_buildings buildings"""
+        city = SyntheticCity(n_buildings, seed, crs=crs)
+        return city.walk_graph(), city.buildings()
+
+    def buildings(self):
+        rng = np.random.default_rng(self.seed)
+        n = self.n_buildings
+        side = self.slots_per_side
+        slot_size = (self.block_size - self.street_width) / side
+
+        # Pick n distinct slots of the whole grid, then place one footprint inside each slot
+        total_slots = self.blocks_per_side ** 2 * side * side
+        slot = np.sort(rng.choice(total_slots, size=n, replace=False))
+        block, cell = np.divmod(slot, side * side)
+        block_x, block_y = np.divmod(block, self.blocks_per_side)
+        cell_x, cell_y = np.divmod(cell, side)
+        x0 = self.origin[0] + block_x * self.block_size + self.street_width / 2 + cell_x * slot_size
+        y0 = self.origin[1] + block_y * self.block_size + self.street_width / 2 + cell_y * slot_size
+
+        width = rng.uniform(0.45, 0.9, n) * slot_size
+        depth = rng.uniform(0.45, 0.9, n) * slot_size
+        x0 = x0 + rng.uniform(0, 1, n) * (slot_size - width)
+        y0 = y0 + rng.uniform(0, 1, n) * (slot_size - depth)
+        x1, y1 = x0 + width, y0 + depth
+
+        # About one building in five is L shaped (a concave footprint), the rest are rectangles
+        l_shaped = rng.random(n) < 0.2
+        cut_x = x0 + width * rng.uniform(0.4, 0.7, n)
+        cut_y = y0 + depth * rng.uniform(0.4, 0.7, n)
+        geometry = np.empty(n, dtype=object)
+        rectangles = np.stack([np.stack([x0, y0], axis=1), np.stack([x1, y0], axis=1),
+                               np.stack([x1, y1], axis=1), np.stack([x0, y1], axis=1)], axis=1)
+        geometry[~l_shaped] = shapely.polygons(rectangles[~l_shaped])
+        l_rings = np.stack([np.stack([x0, y0], axis=1), np.stack([x1, y0], axis=1),
+                            np.stack([x1, cut_y], axis=1), np.stack([cut_x, cut_y], axis=1),
+                            np.stack([cut_x, y1], axis=1), np.stack([x0, y1], axis=1)], axis=1)
+        geometry[l_shaped] = shapely.polygons(l_rings[l_shaped])
+
+        # Heights as they come out of Open_Street_Map.prepare_buildings: levels * 2.7 where only levels are tagged
+        levels = rng.integers(1, 13, n).astype(np.float64)
+        tagged = rng.random(n) < 0.7
+        height = np.where(tagged, levels * 2.7, np.round(rng.uniform(3.0, 30.0, n), 1))
+        ids = 100000000 + np.arange(n, dtype=np.int64)
+        index = pd.MultiIndex.from_arrays([np.full(n, 'way'), ids], names=['element', 'id'])
+        return gpd.GeoDataFrame({
+            'height': height.astype(np.float32),
+            'levels': np.where(tagged, levels, np.nan).astype(np.float32),
+            'addr:housenumber': pd.array((np.arange(n) % 120 + 1).astype(str), dtype='string'),
+        }, geometry=geometry, index=index, crs=self.crs)
+
+    def walk_graph(self):
+        rng = np.random.default_rng(self.seed + 1)
+        count = self.blocks_per_side + 1
+        node_x, node_y = np.divmod(np.arange(count * count), count)
+        node_ids = 1000000000 + np.arange(count * count, dtype=np.int64)
+        x = self.origin[0] + node_x * self.block_size
+        y = self.origin[1] + node_y * self.block_size
+
+        G = nx.MultiDiGraph(crs=self.crs, simplified=True)
+        for node, node_x_value, node_y_value in zip(node_ids.tolist(), x.tolist(), y.tolist()):
+            G.add_node(node, x=node_x_value, y=node_y_value, street_count=0)
+
+        # Streets between neighboring intersections: east-west then north-south
+        position = np.arange(count * count).reshape(count, count)
+        u = np.concatenate([position[:-1, :].ravel(), position[:, :-1].ravel()])
+        v = np.concatenate([position[1:, :].ravel(), position[:, 1:].ravel()])
+        # Every street bends slightly at its middle so edge geometries are not plain node to node lines
+        bend = rng.uniform(-0.05, 0.05, len(u)) * self.block_size
+        east_west = np.arange(len(u)) < (count - 1) * count
+        mid_x = (x[u] + x[v]) / 2 + np.where(east_west, 0.0, bend)
+        mid_y = (y[u] + y[v]) / 2 + np.where(east_west, bend, 0.0)
+        lines = np.stack([np.stack([x[u], y[u]], axis=1), np.stack([mid_x, mid_y], axis=1),
+                          np.stack([x[v], y[v]], axis=1)], axis=1)
+        geometry = shapely.linestrings(lines)
+        length = shapely.length(geometry)
+        highway = np.where(rng.random(len(u)) < 0.6, 'footway', 'residential')
+        osmid = 500000000 + np.arange(len(u))
+
+        edges = []
+        for i, (a, b) in enumerate(zip(node_ids[u].tolist(), node_ids[v].tolist())):
+            data = {'osmid': int(osmid[i]), 'highway': str(highway[i]), 'oneway': False, 'length': float(length[i])}
+            edges.append((a, b, 0, dict(data, reversed=False, geometry=geometry[i])))
+            edges.append((b, a, 0, dict(data, reversed=True, geometry=geometry[i].reverse())))
+        G.add_edges_from(edges)
+        for node, degree in G.degree():
+            G.nodes[node]['street_count'] = degree // 2
+        return G
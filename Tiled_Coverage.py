@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+import Profiling
+
+
+def _run_tile(task):
+    """
+    Shadows and edge coverage of one tile, in a worker process.
+
+    Returns (edge_idx, shaded lengths of those edges, building_idx of the owned buildings, their shadows).
+    """
+    edge_idx, edge_geoms, building_idx, footprints, heights, owned, azimuth, altitude, coverage_tile_size = task
+    buildings = gpd.GeoDataFrame({'height': heights}, geometry=footprints)
+    shadows = Class_Shadow.generate_shadows(buildings, azimuth, altitude).to_numpy()
+    shaded = ShadowCoverage(shadows, tile_size=coverage_tile_size).shaded_lengths(edge_geoms)
+    return edge_idx, shaded, building_idx[owned], shadows[owned]
+
+
+class TiledCoverage:
+    """
+    Shadow and coverage stages of a large area, split into square tiles processed in parallel.
+
+    Every edge belongs to the tile of its middle point and every building to the tile of its centroid.
+    A tile computes the shadows of all buildings whose halo (the farthest their shadow reaches at the
+    current sun position, see shadow_reach) touches its own edges, so the shaded length of an owned edge
+    is the same as with the whole area in one piece. Workers only receive the geometries
+    of their tile; the results are stitched back in the edge_arrays order and written on the graph.
+    """
+
+    def __init__(self, tile_size=1000.0, processes=None, coverage_tile_size=100.0):
+        self.tile_size = tile_size
+        self.processes = processes
+        self.coverage_tile_size = coverage_tile_size
+
+    @staticmethod
+    def shadow_reach(footprints, heights, azimuth, altitude):
+        """
+        Box around every footprint that contains its generate_shadows polygon: the halo of the building.
+
+        A vertex moves away from the sun by shadow_length * max(0.2, 0.5 + projection / (2 * height)), the
+        projection being at most the bounding box diagonal (the vertex mean used as centroid lies inside
+        the box), and the result is buffered by 0.5 m. The box is grown only in the shadow direction, so
+        low sun does not inflate it on the sunny side.
+        """
+        heights = np.asarray(heights, dtype=np.float64)
+        bounds = shapely.bounds(np.asarray(footprints, dtype=object))
+        radius = np.hypot(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        shadow_length = heights / max(0.1, np.tan(np.radians(altitude)))
+        stretch = np.maximum(0.2, 0.5 + np.divide(radius, 2 * heights, out=np.zeros_like(radius), where=heights > 0))
+        reach = np.where(heights > 0, shadow_length * stretch, 0.0)
+        azimuth_radians = np.radians(azimuth)
+        dx, dy = -np.sin(azimuth_radians) * reach, -np.cos(azimuth_radians) * reach
+        return shapely.box(bounds[:, 0] + np.minimum(dx, 0) - 0.5, bounds[:, 1] + np.minimum(dy, 0) - 0.5,
+                           bounds[:, 2] + np.maximum(dx, 0) + 0.5, bounds[:, 3] + np.maximum(dy, 0) + 0.5)
+
+    def tile_of(self, points, bounds):
+        """(column, row) tile of every point, the grid starting at the lower left corner of bounds"""
+        x, y = shapely.get_x(points), shapely.get_y(points)
+        columns = max(1, int(np.ceil((bounds[2] - bounds[0]) / self.tile_size)))
+        rows = max(1, int(np.ceil((bounds[3] - bounds[1]) / self.tile_size)))
+        column = np.clip(((x - bounds[0]) // self.tile_size).astype(np.int64), 0, columns - 1)
+        row = np.clip(((y - bounds[1]) // self.tile_size).astype(np.int64), 0, rows - 1)
+        return column * rows + row
+
+    def tasks(self, edge_geoms, buildings, azimuth, altitude, bounds):
+        footprints = buildings.geometry.to_numpy()
+        # Same coercion as generate_shadows, so the halos match the shadows actually cast
+        heights = pd.to_numeric(buildings['height'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+        edge_tile = self.tile_of(shapely.line_interpolate_point(edge_geoms, 0.5, normalized=True), bounds)
+        building_tile = self.tile_of(shapely.centroid(footprints), bounds)
+        tree = shapely.STRtree(self.shadow_reach(footprints, heights, azimuth, altitude))
+
+        for tile in np.union1d(edge_tile, building_tile):
+            edge_idx = np.flatnonzero(edge_tile == tile)
+            owned_idx = np.flatnonzero(building_tile == tile)
+            # Buildings whose shadow halo reaches the extent of the owned edges
+            if len(edge_idx):
+                near_idx = tree.query(shapely.box(*shapely.total_bounds(edge_geoms[edge_idx])))
+            else:
+                near_idx = np.array([], dtype=np.int64)
+            building_idx = np.union1d(near_idx, owned_idx)
+            owned = np.isin(building_idx, owned_idx)
+            yield (edge_idx, edge_geoms[edge_idx], building_idx, footprints[building_idx], heights[building_idx],
+                   owned, azimuth, altitude, self.coverage_tile_size)
+
+    def run(self, G, buildings, azimuth, altitude, bounds=None):
+        """
+        Compute the shadows of all buildings and the coverage of all edges of G tile by tile.
+
+        buildings must be in the CRS of G with a 'height' column. bounds (minx, miny, maxx, maxy) anchors
+        the tile grid, by default the combined extent of the edges and buildings (see
+        Open_Street_Map.combined_bounds). Writes 'shadow_coverage' and 'shaded_length' on G and returns
+        (coverage table, shadows as a GeoSeries aligned with buildings).
+        """
+        azimuth = Class_Shadow._scalar(azimuth)
+        altitude = Class_Shadow._scalar(altitude)
+        edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+        if bounds is None:
+            bounds = shapely.total_bounds(np.concatenate([edge_geoms, buildings.geometry.to_numpy()]))
+
+        shaded = np.zeros(len(edge_keys))
+        shadows = np.full(len(buildings), None, dtype=object)
+        with Profiling.stage('tiled_coverage', items=len(edge_keys)):
+            tasks = self.tasks(edge_geoms, buildings, azimuth, altitude, bounds)
+            if self.processes == 1:
+                outputs = map(_run_tile, tasks)
+            else:
+                executor = ProcessPoolExecutor(max_workers=self.processes)
+                outputs = executor.map(_run_tile, tasks)
+            try:
+                for edge_idx, tile_shaded, building_idx, tile_shadows in outputs:
+                    shaded[edge_idx] = tile_shaded
+                    shadows[building_idx] = tile_shadows
+            finally:
+                if self.processes != 1:
+                    executor.shutdown()
+
+        table = ShadowCoverage.write_coverage(G, edge_keys, edge_geoms, shaded)
+        return table, gpd.GeoSeries(shadows, index=buildings.index, crs=buildings.crs)
@@ -0,0 +1,85 @@
+import json
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Compiled_Graph import CompiledGraph
+from Shade_Timetable import ShadeTimetable
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def city():
+    G, buildings = SyntheticCity.generate(100, 2)
+    ShadowCoverage(Class_Shadow.generate_shadows(buildings, 135.0, 30.0)).apply_to_graph(G)
+    Class_Shadow.make_new_weights(G)
+    return G, buildings
+
+
+def write_timetable(path, edge_keys, fractions):
+    np.save(path + '.npy', np.asarray(fractions, dtype=np.float16))
+    meta = {'edges': [list(key) for key in edge_keys], 'days': ['2024-06-01'], 'time_zone': 'Asia/Jerusalem',
+            'bin_minutes': 15, 'start_minute': 300, 'bins_per_day': fractions.shape[1], 'scale': 1}
+    with open(path + '.json', 'w') as file:
+        json.dump(meta, file)
+    return ShadeTimetable(path)
+
+
+def test_time_slot_costs_follow_the_edge_keys(city, tmp_path):
+    G, _ = city
+    compiled = CompiledGraph.from_graph(G)
+    edge_keys = compiled.edge_keys
+    fractions = np.random.default_rng(0).integers(0, 5, (len(edge_keys), 2)) / 4
+    # Timetable rows in reverse order: the costs must still land on the right edges
+    timetable = write_timetable(str(tmp_path / 'reversed'), edge_keys[::-1], fractions[::-1])
+    compiled.add_time_slot_costs(timetable, 1, delta=[2.0])
+    expected = compiled.length * (1 - fractions[:, 1]) + compiled.length * fractions[:, 1] / 2.0
+    np.testing.assert_allclose(compiled.costs['cost_1@1'], expected, rtol=1e-3)
+
+
+def test_time_slot_costs_reject_another_graph(city, tmp_path):
+    G, _ = city
+    compiled = CompiledGraph.from_graph(G)
+    other_keys = [(u + 10 ** 9, v, key) for u, v, key in compiled.edge_keys]
+    timetable = write_timetable(str(tmp_path / 'other'), other_keys, np.zeros((len(other_keys), 1)))
+    with pytest.raises(ValueError):
+        compiled.add_time_slot_costs(timetable, 0)
+
+
+def test_cost_columns_match_the_edge_attributes(city):
+    G, _ = city
+    compiled = CompiledGraph.from_graph(G, ['cost_3']).add_shade_costs()
+    edges = [G.edges[key] for key in compiled.edge_keys]
+    np.testing.assert_allclose(compiled.length, [edge['geometry'].length for edge in edges])
+    np.testing.assert_allclose(compiled.shaded_length, [edge['shaded_length'] for edge in edges])
+    for name in ('cost_1', 'cost_2', 'cost_3', 'cost_4'):
+        np.testing.assert_allclose(compiled.costs[name], [edge[name] for edge in edges])
+
+
+def test_shortest_path_matches_networkx(city):
+    G, _ = city
+    G = G.copy()
+    # A cheaper parallel edge must win when the matrix collapses (u, v) pairs
+    u, v, key = next(iter(G.edges(keys=True)))
+    data = dict(G.edges[u, v, key])
+    data['geometry'] = LineString([(G.nodes[u]['x'], G.nodes[u]['y']), (G.nodes[v]['x'], G.nodes[v]['y'])])
+    data['length'] = data['geometry'].length
+    G.add_edge(u, v, key + 1, **data)
+    Class_Shadow.make_new_weights(G)
+    compiled = CompiledGraph.from_graph(G).add_shade_costs()
+
+    nodes = sorted(G.nodes)
+    rng = np.random.default_rng(1)
+    for weight in ('length', 'cost_2'):
+        for orig, dest in rng.choice(nodes, size=(10, 2)).tolist():
+            route, cost, length, shaded = compiled.shortest_path(orig, dest, weight)
+            assert cost == pytest.approx(nx.shortest_path_length(G, orig, dest, weight=weight), abs=1e-6)
+            assert route[0] == orig and route[-1] == dest
+            assert nx.path_weight(G, route, weight) == pytest.approx(cost, abs=1e-6)
+            if weight == 'length':
+                assert length == pytest.approx(cost)
+            assert 0 <= shaded <= length + 1e-9
+    matrix = compiled.matrix('length')[0]
+    orig, dest = compiled.node_index([u, v])
+    assert matrix[orig, dest] == pytest.approx(min(G.edges[u, v, k]['length'] for k in G[u][v]))
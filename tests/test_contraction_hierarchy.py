@@ -0,0 +1,46 @@
+import networkx as nx
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Compiled_Graph import CompiledGraph
+from Contraction_Hierarchy import ContractionHierarchy
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def compiled():
+    G, buildings = SyntheticCity.generate(300, 6)
+    ShadowCoverage(Class_Shadow.generate_shadows(buildings, 250.0, 20.0)).apply_to_graph(G)
+    return G, CompiledGraph.from_graph(G).add_shade_costs()
+
+
+@pytest.mark.parametrize('weight', ['length', 'cost_3'])
+def test_queries_match_dijkstra(compiled, weight):
+    G, compiled = compiled
+    hierarchy = ContractionHierarchy.build(compiled, weight)
+    rng = np.random.default_rng(2)
+    origins = rng.choice(len(compiled.node_ids), 8, replace=False)
+    distances = dijkstra(compiled.matrix(weight)[0], indices=origins)
+    for row, orig in enumerate(origins.tolist()):
+        for dest in rng.choice(len(compiled.node_ids), 10).tolist() + [orig]:
+            route, cost = hierarchy.query(compiled.node_ids[orig], compiled.node_ids[dest])
+            assert cost == pytest.approx(distances[row, dest], abs=1e-6)
+            # Shortcuts unpack to a walkable route of the same cost
+            assert route[0] == compiled.node_ids[orig] and route[-1] == compiled.node_ids[dest]
+            if weight == 'length':
+                assert nx.path_weight(G, route, 'length') == pytest.approx(cost, abs=1e-6)
+            edges = compiled.pair_edges(weight, compiled.node_index(route))
+            assert compiled.costs[weight][edges].sum() == pytest.approx(cost, abs=1e-6)
+
+
+def test_save_and_load(compiled, tmp_path):
+    _, compiled = compiled
+    hierarchy = ContractionHierarchy.build(compiled, 'cost_2', time_slot=7)
+    hierarchy.save(str(tmp_path / 'hierarchy.npz'))
+    loaded = ContractionHierarchy.load(str(tmp_path / 'hierarchy.npz'))
+    assert loaded.weight == 'cost_2' and loaded.time_slot == '7'
+    orig, dest = compiled.node_ids[0], compiled.node_ids[-1]
+    assert loaded.query(orig, dest) == hierarchy.query(orig, dest)
+    with pytest.raises(KeyError):
+        loaded.query(orig, compiled.node_ids.max() + 1)
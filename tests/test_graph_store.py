@@ -0,0 +1,48 @@
+import networkx as nx
+from shapely.geometry import LineString
+from Graph_Store import GraphStore
+
+
+def small_graph():
+    G = nx.MultiDiGraph(crs='EPSG:32636')
+    for node, (x, y) in {1: (0.0, 0.0), 2: (10.0, 0.0), 3: (10.0, 10.0)}.items():
+        G.add_node(node, x=x, y=y)
+    G.add_edge(1, 2, 0, osmid=11, lanes=2, highway='footway', length=10.0,
+               geometry=LineString([(0, 0), (5, 1), (10, 0)]))
+    G.add_edge(2, 3, 0, osmid=[12, 13], highway='residential', length=10.0)
+    G.add_edge(3, 1, 0, osmid=14, lanes=4, highway='footway', length=14.1, maxspeed=30)
+    return G
+
+
+def test_round_trip():
+    G = small_graph()
+    H = GraphStore.from_graph(G).to_graph()
+    assert H.graph == G.graph
+    assert dict(H.nodes(data=True)) == dict(G.nodes(data=True))
+    assert sorted(H.edges(keys=True)) == sorted(G.edges(keys=True))
+    for u, v, key, data in G.edges(keys=True, data=True):
+        other = H.edges[u, v, key]
+        assert set(other) == set(data)
+        for name, value in data.items():
+            if name == 'geometry':
+                assert other[name].equals_exact(value, 0)
+            else:
+                assert other[name] == value
+    assert 'geometry' not in H.edges[2, 3, 0]
+
+
+def test_partially_present_int_attribute():
+    G = small_graph()
+    H = GraphStore.from_graph(G).to_graph()
+    assert 'lanes' not in H.edges[2, 3, 0]
+    assert 'maxspeed' not in H.edges[1, 2, 0]
+    for edge, lanes in [((1, 2, 0), 2), ((3, 1, 0), 4)]:
+        assert H.edges[edge]['lanes'] == lanes
+        assert type(H.edges[edge]['lanes']) is int
+    assert type(H.edges[3, 1, 0]['maxspeed']) is int
+
+
+def test_int_column_as_float():
+    store = GraphStore.from_graph(small_graph())
+    lanes = store.column('lanes')
+    assert lanes[0] == 2.0 and lanes[2] == 4.0 and lanes[1] != lanes[1]
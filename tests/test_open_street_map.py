@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from Open_Street_Map import Open_Street_Map
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture
+def osm_object():
+    G, buildings = SyntheticCity.generate(50, 4)
+    return Open_Street_Map.from_data(G, buildings)
+
+
+def test_snap_index_follows_the_graph(osm_object):
+    G = osm_object.G
+    node = next(iter(G.nodes))
+    x, y = G.nodes[node]['x'], G.nodes[node]['y']
+    assert osm_object.get_nearest_node(x, y) == node
+
+    # A new graph without that node gets a new index
+    osm_object.G = G.copy()
+    osm_object.G.remove_node(node)
+    assert osm_object.get_nearest_node(x, y) != node
+
+    # Nodes moved in place need an explicit invalidation
+    other = next(iter(osm_object.G.nodes))
+    osm_object.G.nodes[other]['x'], osm_object.G.nodes[other]['y'] = x, y
+    osm_object.invalidate_snap_index()
+    assert osm_object.get_nearest_node(x, y) == other
+    assert np.array_equal(osm_object.snap_index().node_ids, np.array(list(osm_object.G.nodes)))
+
+
+OSM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" lat="31.2620" lon="34.8010" version="1"/>
+  <node id="2" lat="31.2620" lon="34.8020" version="1"/>
+  <node id="3" lat="31.2620" lon="34.8030" version="1"/>
+  <node id="4" lat="31.2630" lon="34.8020" version="1"/>
+  <node id="5" lat="31.2610" lon="34.8020" version="1"/>
+  <node id="11" lat="31.2622" lon="34.8012" version="1"/>
+  <node id="12" lat="31.2622" lon="34.8016" version="1"/>
+  <node id="13" lat="31.2625" lon="34.8016" version="1"/>
+  <node id="14" lat="31.2625" lon="34.8012" version="1"/>
+  <way id="100" version="1"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="footway"/></way>
+  <way id="101" version="1"><nd ref="4"/><nd ref="2"/><tag k="highway" v="residential"/></way>
+  <way id="102" version="1"><nd ref="2"/><nd ref="5"/><tag k="highway" v="motorway"/></way>
+  <way id="200" version="1"><nd ref="11"/><nd ref="12"/><nd ref="13"/><nd ref="14"/><nd ref="11"/>
+    <tag k="building" v="yes"/><tag k="height" v="12 m"/></way>
+</osm>
+"""
+
+
+def test_load_osm_file(tmp_path):
+    path = tmp_path / 'extract.osm'
+    path.write_text(OSM_XML)
+    G, buildings = Open_Street_Map.load_osm_file(str(path))
+    assert G.graph['crs'] == 'epsg:4326'
+    # The motorway is filtered out and the graph is simplified around the junction at node 2
+    assert sorted(G.nodes) == [1, 2, 3, 4]
+    assert sorted((u, v) for u, v, _ in G.edges(keys=True)) == [(1, 2), (2, 1), (2, 3), (2, 4), (3, 2), (4, 2)]
+    assert len(buildings) == 1 and buildings['height'].iloc[0] == '12 m'
+
+
+def test_load_osm_file_rejects_pbf():
+    with pytest.raises(ValueError):
+        Open_Street_Map.load_osm_file('extract.osm.pbf')
+
+
+def test_download_restores_osmnx_settings(monkeypatch, tmp_path):
+    import osmnx as ox
+    seen = {}
+
+    def graph_from_place(*args, **kwargs):
+        seen['settings'] = (ox.settings.use_cache, ox.settings.cache_folder)
+        raise ConnectionError("offline")
+
+    before = (ox.settings.use_cache, ox.settings.cache_folder)
+    monkeypatch.setattr(ox, 'graph_from_place', graph_from_place)
+    with pytest.raises(ConnectionError):
+        Open_Street_Map.download('Somewhere', cache_dir=str(tmp_path))
+    assert seen['settings'] == (True, str(tmp_path / 'http'))
+    assert (ox.settings.use_cache, ox.settings.cache_folder) == before
+
+
+def test_snapshot_round_trip(osm_object, tmp_path):
+    osm_object.save_snapshot(str(tmp_path))
+    G, buildings = Open_Street_Map.load_snapshot(str(tmp_path))
+    assert sorted(G.edges(keys=True)) == sorted(osm_object.G.edges(keys=True))
+    assert list(buildings.columns) == list(osm_object.Buildings.columns)
+    assert (buildings.dtypes == osm_object.Buildings.dtypes).all()
+    assert buildings.index.equals(osm_object.Buildings.index)
+    assert buildings.geometry.geom_equals_exact(osm_object.Buildings.geometry, 0).all()
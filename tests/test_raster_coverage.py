@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Raster_Coverage import RasterCoverage
+from Synthetic_City import SyntheticCity
+
+
+def test_error_within_the_documented_bound():
+    rng = np.random.default_rng(3)
+    # Axis aligned shadows on a 10 m grid crossed by horizontal, vertical (90 degree crossings) and diagonal
+    # (45 degree) edges; straight edges run between grid lines so none runs along a shadow side
+    corners = rng.integers(0, 40, (60, 2)) * 10.0
+    sizes = rng.integers(1, 5, (60, 2)) * 10.0
+    shadows = shapely.box(corners[:, 0], corners[:, 1], corners[:, 0] + sizes[:, 0], corners[:, 1] + sizes[:, 1])
+    starts = rng.integers(0, 30, (300, 2)) * 10.0 + 5.0 + rng.uniform(-3, 3, (300, 2))
+    directions = np.array([[1.0, 0.0], [0.0, 1.0], [np.sqrt(0.5), np.sqrt(0.5)]])[np.arange(300) % 3]
+    edges = shapely.linestrings(np.stack([starts, starts + directions * rng.uniform(20, 150, (300, 1))], axis=1))
+    sine = np.where(np.arange(300) % 3 == 2, np.sqrt(0.5), 1.0)
+
+    exact = ShadowCoverage(shadows).shaded_lengths(edges)
+    points = shapely.intersection(edges, shapely.union_all(shadows).boundary)
+    crossings = np.where(shapely.is_empty(points), 0, shapely.get_num_geometries(points))
+    assert (crossings == 0).sum() > 30 and crossings.sum() > 200
+    for resolution, spacing in [(1.0, 2.0), (0.5, 1.0), (2.0, 4.0)]:
+        approximate = RasterCoverage(edges, resolution, spacing).shaded_lengths(shadows)
+        bound = crossings * (spacing + resolution * np.sqrt(2) / sine)
+        assert np.all(np.abs(approximate - exact) <= bound + 1e-9)
+        # Edges that never cross a boundary are exact
+        assert np.allclose(approximate[crossings == 0], exact[crossings == 0])
+
+
+def test_samples_match_the_grid_and_the_sweep():
+    G, buildings = SyntheticCity.generate(80, 7)
+    raster = RasterCoverage.from_graph(G, resolution=1.0, spacing=2.0)
+    shadows = Class_Shadow.generate_shadows(buildings, 120.0, 35.0)
+    grid = raster.rasterize(shadows)
+    ys, xs = np.divmod(np.arange(grid.size), raster.width)
+    centers = (raster.x0 + (xs + 0.5) * raster.resolution, raster.y0 + (ys + 0.5) * raster.resolution)
+    inside = shapely.contains_xy(shapely.union_all(shadows), *centers).reshape(grid.shape)
+    assert (grid != inside).mean() < 1e-4
+    np.testing.assert_array_equal(raster.sample(shadows), grid.ravel()[raster.cells])
+
+    fractions = raster.sweep(buildings, [120.0, 300.0], [35.0, -5.0])
+    np.testing.assert_allclose(fractions[:, 0], raster.fractions(raster.sample(shadows)))
+    np.testing.assert_array_equal(fractions[:, 1], 1.0)
+    table = raster.apply_to_graph(G, shadows)
+    assert table['shaded_length'].to_numpy() == pytest.approx(raster.shaded_lengths(shadows))
@@ -0,0 +1,58 @@
+import networkx as nx
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from Algorithmica import Algorithmic
+from Class_Shadow import Class_Shadow, ShadowCoverage, DELTAS
+from Open_Street_Map import Open_Street_Map
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def city():
+    G, buildings = SyntheticCity.generate(400, 3)
+    engine = ShadowCoverage(Class_Shadow.generate_shadows(buildings, 200.0, 25.0))
+    engine.apply_to_graph(G)
+    Class_Shadow.make_new_weights(G)
+    return G, engine, Algorithmic(Open_Street_Map.from_data(G, buildings))
+
+
+def od_pairs(G, count, seed=0):
+    nodes = np.array(sorted(G.nodes))
+    rng = np.random.default_rng(seed)
+    return [tuple(pair) for pair in rng.choice(nodes, size=(count, 2)).tolist()]
+
+
+def test_pareto_front_contains_every_cost_route(city):
+    G, _, algorithm = city
+    for orig, dest in od_pairs(G, 5):
+        front = algorithm.pareto_routes(orig, dest)
+        distances = [distance for distance, _, _ in front]
+        suns = [sun for _, sun, _ in front]
+        # Sorted by distance with strictly less sun, i.e. no route dominates another
+        assert distances == sorted(distances) and all(np.diff(suns) < 0)
+        assert front[0][0] == pytest.approx(nx.shortest_path_length(G, orig, dest, weight='length'), abs=1e-6)
+        for i, delta in enumerate(DELTAS, start=1):
+            expected = nx.shortest_path_length(G, orig, dest, weight=f'cost_{i}')
+            best = min(sun + (distance - sun) / delta for distance, sun, _ in front)
+            assert best == pytest.approx(expected, abs=1e-6)
+        for distance, _, route in front:
+            assert route[0] == orig and route[-1] == dest
+            assert distance == pytest.approx(nx.path_weight(G, route, 'length'), abs=1e-6)
+
+
+@pytest.mark.parametrize('weight', ['length', 'cost_2', 'cost_4'])
+def test_astar_and_bidirectional_match_dijkstra(city, weight):
+    G, _, algorithm = city
+    compiled = algorithm.compiled_graph([weight])
+    pairs = od_pairs(G, 20, seed=1) + [(sorted(G.nodes)[0], sorted(G.nodes)[0])]
+    origins = compiled.node_index([orig for orig, _ in pairs])
+    distances = dijkstra(compiled.matrix(weight)[0], indices=origins)
+    for row, (orig, dest) in enumerate(pairs):
+        expected = distances[row, compiled.node_index([dest])[0]]
+        for search in (algorithm.astar_path, algorithm.bidirectional_path):
+            for use_heuristic in (True, False):
+                route, cost, _ = search(orig, dest, weight, use_heuristic=use_heuristic)
+                assert cost == pytest.approx(expected, abs=1e-6)
+                assert route[0] == orig and route[-1] == dest
+                assert nx.path_weight(G, route, weight) == pytest.approx(expected, abs=1e-6)
@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+from Open_Street_Map import Open_Street_Map
+from Routing_Service import RoutingService
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def service():
+    G, buildings = SyntheticCity.generate(200, 1)
+    service = RoutingService(Open_Street_Map.from_data(G, buildings), when='2024-06-01 12:00', workers=1)
+    service.prepare()
+    yield service
+    service.executor.shutdown()
+
+
+def test_cancelled_request_does_not_block_the_batch(service):
+    nodes = service.compiled.node_ids.tolist()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        batch = [({'origin_node': nodes[i], 'destination_node': nodes[-1 - i], 'cost': cost}, loop.create_future())
+                 for i, cost in [(0, 'length'), (1, 'length'), (2, 'cost_2'), (3, 'unknown')]]
+        batch[0][1].cancel()
+        await service.run_batch(batch)
+        return [future for _, future in batch]
+
+    cancelled, first, second, unknown = asyncio.run(run())
+    assert cancelled.cancelled()
+    assert first.result()['route'][0] == nodes[1] and first.result()['route'][-1] == nodes[-2]
+    assert second.result()['route'][0] == nodes[2]
+    assert isinstance(unknown.exception(), ValueError)
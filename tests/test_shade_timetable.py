@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Shade_Timetable import ShadeTimetable
+from SunLocation import Location, SolarTable, LATITUDE, LONGITUDE, TIME_ZONE
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def built(tmp_path_factory):
+    G, buildings = SyntheticCity.generate(60, 5)
+    location = Location(LATITUDE, LONGITUDE, TIME_ZONE)
+    path = str(tmp_path_factory.mktemp('timetable') / 'shade')
+    timetable = ShadeTimetable.build(path, G, buildings, location, ['2024-06-01', '2024-12-01'], bin_minutes=60,
+                                     start_hour=10, end_hour=13)
+    return G, buildings, location, timetable
+
+
+def test_bin_index(built):
+    *_, timetable = built
+    assert timetable.fractions.shape[1] == 6 and isinstance(timetable.fractions, np.memmap)
+    times = ['2024-06-03 10:00', '2024-06-03 12:59', '2024-11-20 11:30', '2025-01-05 10:15',
+             '2024-06-03 09:59', '2024-06-03 13:00']
+    np.testing.assert_array_equal(timetable.bin_index(times), [0, 2, 4, 3, -1, -1])
+    for time, column in zip(times, timetable.bin_index(times)):
+        assert timetable.column_at(*timetable.departure_clock(time)) == column
+    # Aware times are converted to the timetable's zone (UTC+3 in June)
+    assert timetable.bin_index(pd.Timestamp('2024-06-03 08:00', tz='UTC'))[0] == 1
+
+
+def test_columns_are_the_coverage_at_the_bin_middle(built):
+    G, buildings, location, timetable = built
+    edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+    assert timetable.edge_keys == edge_keys
+    middle = pd.Timestamp('2024-12-01 12:30', tz=TIME_ZONE)
+    (azimuth,), (altitude,) = SolarTable.from_times(location, [middle]).lookup([middle])
+    shaded = ShadowCoverage(Class_Shadow.generate_shadows(buildings, azimuth, altitude)).shaded_lengths(edge_geoms)
+    expected = shaded / shapely.length(edge_geoms)
+    column = timetable.bin_index(middle)[0]
+    np.testing.assert_allclose(timetable.fractions[:, column] / timetable.scale, expected, atol=0.5 / 255 + 1e-6)
+
+    rows = timetable.edge_rows(edge_keys[:3])
+    np.testing.assert_allclose(timetable.shade_fraction(rows, middle), timetable.fractions[:3, column] / 255)
+    np.testing.assert_array_equal(timetable.shade_fraction(rows, '2024-12-01 20:00'), 1.0)
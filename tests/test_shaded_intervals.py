@@ -0,0 +1,85 @@
+import networkx as nx
+import numpy as np
+import pytest
+import shapely
+from shapely.ops import substring
+from Algorithmica import Algorithmic
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Open_Street_Map import Open_Street_Map
+from Shaded_Intervals import ShadedIntervals
+from Synthetic_City import SyntheticCity
+
+
+@pytest.fixture(scope='module')
+def city():
+    G, buildings = SyntheticCity.generate(400, 3)
+    shadows = Class_Shadow.generate_shadows(buildings, 200.0, 30.0)
+    engine = ShadowCoverage(shadows)
+    engine.apply_to_graph(G)
+    Class_Shadow.make_new_weights(G)
+    return G, engine, ShadedIntervals.from_coverage(engine, G), Algorithmic(Open_Street_Map.from_data(G, buildings))
+
+
+def shade_of(engine, line):
+    return engine.shaded_lengths(np.array([line], dtype=object))[0]
+
+
+def test_shade_of_edge_parts(city):
+    G, engine, intervals, _ = city
+    edge_keys, edge_geoms = ShadowCoverage.edge_arrays(G)
+    np.testing.assert_allclose(intervals.shaded_lengths(), engine.shaded_lengths(edge_geoms), atol=1e-3)
+
+    rng = np.random.default_rng(4)
+    edges = rng.choice(np.flatnonzero(intervals.shaded_lengths() > 0), 30)
+    start = rng.uniform(0, 1, 30) * intervals.lengths[edges]
+    end = rng.uniform(0, 1, 30) * intervals.lengths[edges]
+    expected = [shade_of(engine, substring(edge_geoms[edge], a, b)) for edge, a, b in zip(edges, start, end)]
+    # float32 stretch bounds: millimeters
+    np.testing.assert_allclose(intervals.shaded_between(edges, start, end), expected, atol=1e-3)
+    np.testing.assert_allclose(intervals.shaded_between(edges, end, start), expected, atol=1e-3)
+
+    profile = intervals.profile(edges[:5], start[:5], end[:5])
+    assert profile['length'].sum() == pytest.approx(np.abs(end[:5] - start[:5]).sum())
+    assert profile.loc[profile['shaded'], 'length'].sum() == pytest.approx(sum(expected[:5]), abs=5e-3)
+    assert (profile['shaded'].to_numpy()[1:] != profile['shaded'].to_numpy()[:-1]).all()
+
+
+def brute_force_cost(G, engine, snap_index, orig_xy, dest_xy, weight):
+    """Cost of the best walk on a copy of G with the snapped points added as nodes splitting their edges"""
+    edge_keys, edge_geoms = snap_index.edge_keys, snap_index.edge_geoms
+    H = G.copy()
+    edges, _, offsets = snap_index.nearest_edges([orig_xy[0], dest_xy[0]], [orig_xy[1], dest_xy[1]])
+
+    def piece(line):
+        costs = Class_Shadow.edge_costs([line.length], [shade_of(engine, line)])
+        return dict(length=line.length, **{name: float(values[0]) for name, values in costs.items()})
+
+    for name, edge, offset, incoming in [('O', edges[0], offsets[0], False), ('D', edges[1], offsets[1], True)]:
+        u, v, _ = edge_keys[edge]
+        geometry = edge_geoms[edge]
+        for node, line in [(u, substring(geometry, offset, 0)), (v, substring(geometry, offset, geometry.length))]:
+            H.add_edge(*((node, name) if incoming else (name, node)), **piece(line))
+    (u0, v0, _), (u1, v1, _) = edge_keys[edges[0]], edge_keys[edges[1]]
+    if edges[0] == edges[1] or (u0, v0) == (v1, u1):
+        geometry = edge_geoms[edges[0]]
+        end = offsets[1] if edges[0] == edges[1] else geometry.length - offsets[1]
+        H.add_edge('O', 'D', **piece(substring(geometry, offsets[0], end)))
+    return nx.shortest_path_length(H, 'O', 'D', weight=weight)
+
+
+@pytest.mark.parametrize('weight', ['length', 'cost_2'])
+def test_partial_route_matches_split_edges(city, weight):
+    G, engine, intervals, algorithm = city
+    snap_index = algorithm.open_street_map_object.snap_index()
+    x0, y0, x1, y1 = shapely.total_bounds(snap_index.edge_geoms)
+    rng = np.random.default_rng(5)
+    for trial in range(12):
+        orig = (rng.uniform(x0, x1), rng.uniform(y0, y1))
+        # Every third pair is close by, often on the same street
+        dest = ((orig[0] + rng.uniform(-60, 60), orig[1] + rng.uniform(-60, 60)) if trial % 3 == 0
+                else (rng.uniform(x0, x1), rng.uniform(y0, y1)))
+        result = algorithm.partial_route(orig, dest, intervals, weight)
+        assert result['cost'] == pytest.approx(brute_force_cost(G, engine, snap_index, orig, dest, weight), abs=1e-3)
+        profile = result['profile']
+        assert profile['length'].sum() == pytest.approx(result['length'])
+        assert profile.loc[profile['shaded'], 'length'].sum() == pytest.approx(result['shaded_length'], abs=1e-6)
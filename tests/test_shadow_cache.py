@@ -0,0 +1,30 @@
+import pandas as pd
+from Synthetic_City import SyntheticCity
+from Shadow_Cache import ShadowCache
+
+
+def test_evicted_shadows_are_not_written_twice(tmp_path):
+    buildings = SyntheticCity(n_buildings=40, seed=1).buildings()
+    cache = ShadowCache(max_items=10, path=str(tmp_path))
+    first = cache.shadows(buildings, 135.0, 30.0)
+    cache.flush()
+    # Most of the flushed shadows were evicted from the LRU; they come back from the store
+    again = cache.shadows(buildings, 135.0, 30.0)
+    assert cache.misses == len(buildings) and not cache.pending
+    assert first.geom_equals_exact(again, 0).all()
+
+    # Evicted but not yet flushed shadows are written once per building
+    cache.shadows(buildings, 200.0, 30.0)
+    cache.shadows(buildings, 200.0, 30.0)
+    cache.flush()
+    table = pd.read_parquet(tmp_path)
+    assert len(table) == 2 * len(buildings)
+    assert not table.duplicated(['building', 'azimuth', 'altitude']).any()
+
+
+def test_pending_is_flushed_when_full(tmp_path):
+    buildings = SyntheticCity(n_buildings=40, seed=1).buildings()
+    cache = ShadowCache(path=str(tmp_path), flush_every=30)
+    cache.shadows(buildings, 135.0, 30.0)
+    assert not cache.pending
+    assert len(pd.read_parquet(tmp_path)) == len(buildings)
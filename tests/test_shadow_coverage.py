@@ -0,0 +1,88 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+import shapely.affinity
+from shapely.geometry import LineString, MultiPolygon, Polygon, box
+from Class_Shadow import Class_Shadow, ShadowCoverage
+
+
+def sampled_length(edge, shadow, step=0.01):
+    """Shaded length of an edge by sampling points along it"""
+    along = np.arange(0.0, edge.length, step) + step / 2
+    return shapely.contains_xy(shadow, *shapely.get_coordinates(shapely.line_interpolate_point(edge, along)).T).sum() * step
+
+
+def test_looping_edge():
+    # Crosses itself in the shadow and comes back to pass it again
+    edges = np.array([
+        LineString([(0, 0), (100, 100), (100, 0), (0, 100), (0, 20), (150, 20)]),
+        LineString([(0, 0), (200, 0), (200, 50), (0, 50), (0, 0)]),
+        LineString([(0, 30), (300, 30)]),
+    ], dtype=object)
+    shadow = box(30, 10, 70, 60)
+    engine = ShadowCoverage([shadow], tile_size=25.0)
+
+    lengths = engine.shaded_lengths(edges)
+    np.testing.assert_allclose(lengths, shapely.length(shapely.intersection(edges, shadow)), atol=1e-6)
+
+    edge_idx, starts, ends = engine.shaded_intervals(edges)
+    for i, edge in enumerate(edges):
+        mine = edge_idx == i
+        assert (starts[mine][1:] > ends[mine][:-1]).all()
+        # Every stretch is in the shadow, checked at its middle
+        middle = shapely.line_interpolate_point(edge, (starts[mine] + ends[mine]) / 2)
+        assert shapely.contains(shadow.buffer(1e-6), middle).all()
+        assert abs((ends[mine] - starts[mine]).sum() - sampled_length(edge, shadow)) < 0.05
+
+
+def test_simple_edge_intervals():
+    edge = LineString([(0, 0), (100, 0), (100, 100)])
+    shadows = [Polygon([(10, -5), (30, -5), (30, 5), (10, 5)]), box(95, 40, 105, 45)]
+    edge_idx, starts, ends = ShadowCoverage(shadows, tile_size=20.0).shaded_intervals(np.array([edge]))
+    np.testing.assert_array_equal(edge_idx, [0, 0])
+    np.testing.assert_allclose(starts, [10.0, 140.0])
+    np.testing.assert_allclose(ends, [30.0, 145.0])
+
+
+def swept_footprint(footprint, vector, steps=400):
+    """Shadow by brute force: the union of many copies of the footprint along the shadow vector"""
+    return shapely.union_all([shapely.affinity.translate(footprint, *(vector * t))
+                              for t in np.linspace(0.0, 1.0, steps)])
+
+
+def test_prism_shadows_match_a_dense_sweep():
+    footprints = [
+        box(0, 0, 10, 20),
+        Polygon([(40, 0), (60, 0), (60, 8), (48, 8), (48, 25), (40, 25)]),
+        Polygon([(80, 0), (110, 0), (110, 30), (80, 30)], [[(88, 8), (102, 8), (102, 22), (88, 22)]]),
+        MultiPolygon([box(0, 60, 6, 66), box(20, 60, 26, 70)]),
+    ]
+    heights = [12.0, 20.0, 9.0, 15.0]
+    buildings = gpd.GeoDataFrame({'height': heights + [0.0]}, geometry=footprints + [box(0, 90, 5, 95)],
+                                 crs='EPSG:32636')
+    azimuth, altitude = 230.0, 35.0
+    shadows = Class_Shadow.generate_shadows(buildings, azimuth, altitude, mode='prism')
+    direction = np.array([-np.sin(np.radians(azimuth)), -np.cos(np.radians(azimuth))])
+    for footprint, height, shadow in zip(footprints, heights, shadows):
+        vector = direction * height / np.tan(np.radians(altitude))
+        expected = swept_footprint(footprint, vector)
+        # The sweep lies inside the exact shadow and misses at most one step between copies
+        step = np.hypot(*vector) / 399
+        assert shadow.buffer(1e-6).contains(expected)
+        assert expected.buffer(step * 1.01).contains(shadow)
+        assert shadow.area == pytest.approx(expected.area, rel=1e-2)
+    assert shadows.iloc[-1] is None
+    # The courtyard is shaded only where the walls cast into it
+    assert not shadows.iloc[2].contains(shapely.Point(101, 21))
+
+
+def test_prism_shadows_with_bounds_and_low_sun():
+    buildings = gpd.GeoDataFrame({'height': [30.0]}, geometry=[box(0, 0, 10, 10)], crs='EPSG:32636')
+    bounds = (-50.0, -50.0, 60.0, 60.0)
+    shadow = Class_Shadow.generate_shadows(buildings, 90.0, 0.5, mode='prism', bounds=bounds).iloc[0]
+    # Due west of the building, cut at the bounds instead of several kilometers long
+    assert shapely.bounds(shadow) == pytest.approx([-50.0, 0.0, 10.0, 10.0])
+    assert Class_Shadow.generate_shadows(buildings, 90.0, -3.0, mode='prism').isna().all()
+    with pytest.raises(ValueError):
+        Class_Shadow.generate_shadows(buildings, 90.0, 30.0, mode='flat')
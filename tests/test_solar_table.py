@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from SunLocation import Location, SolarTable, LATITUDE, LONGITUDE, TIME_ZONE
+
+
+def test_lookup_across_north():
+    times = pd.date_range('2024-06-01 00:00', periods=3, freq='10min', tz='UTC').as_unit('ns').asi8
+    table = SolarTable(times, [358.0, 2.0, 6.0], [-10.0, -12.0, -14.0], 'UTC')
+    azimuth, altitude = table.lookup(pd.DatetimeIndex(['2024-06-01 00:02:30', '2024-06-01 00:05',
+                                                       '2024-06-01 00:07:30', '2024-06-01 00:15']))
+    np.testing.assert_allclose(azimuth, [359.0, 0.0, 1.0, 4.0], atol=1e-4)
+    np.testing.assert_allclose(altitude, [-10.5, -11.0, -11.5, -13.0], atol=1e-4)
+
+
+def test_lookup_matches_pvlib_between_samples():
+    location = Location(LATITUDE, LONGITUDE, TIME_ZONE)
+    table = SolarTable.for_range(location, '2024-12-09 06:00', '2024-12-09 18:00', freq='1min')
+    times = pd.date_range('2024-12-09 06:00:20', '2024-12-09 17:59', freq='7min', tz=TIME_ZONE)
+    azimuth, altitude = table.lookup(times)
+    exact = location.location_obj.get_solarposition(times)
+    # Refraction bends the apparent elevation sharply right at the horizon, so compare the daylight
+    up = exact['apparent_elevation'].to_numpy() > 2
+    assert up.sum() > 50
+    assert np.abs(altitude - exact['apparent_elevation'].to_numpy())[up].max() < 0.01
+    assert np.abs((azimuth - exact['azimuth'].to_numpy() + 180) % 360 - 180).max() < 0.01
+
+
+def test_lookup_outside_the_table():
+    location = Location(LATITUDE, LONGITUDE, TIME_ZONE)
+    table = SolarTable.for_range(location, '2024-12-09 06:00', '2024-12-09 07:00')
+    with pytest.raises(ValueError):
+        table.lookup('2024-12-09 07:01')
+
+
+def test_save_and_load(tmp_path):
+    location = Location(LATITUDE, LONGITUDE, TIME_ZONE)
+    table = SolarTable.for_range(location, '2024-12-09 06:00', '2024-12-09 07:00', freq='15min')
+    table.save(str(tmp_path / 'table.npz'))
+    loaded = SolarTable.load(str(tmp_path / 'table.npz'))
+    assert loaded.time_zone == TIME_ZONE
+    np.testing.assert_array_equal(loaded.times, table.times)
+    np.testing.assert_array_equal(loaded.azimuth, table.azimuth)
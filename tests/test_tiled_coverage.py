@@ -0,0 +1,17 @@
+import numpy as np
+from Class_Shadow import Class_Shadow, ShadowCoverage
+from Synthetic_City import SyntheticCity
+from Tiled_Coverage import TiledCoverage
+
+
+def test_tiles_match_one_query_with_string_heights():
+    G, buildings = SyntheticCity.generate(300, 2)
+    buildings = buildings.copy()
+    buildings['height'] = buildings['height'].astype(object)
+    buildings.iloc[:3, buildings.columns.get_loc('height')] = ['12 m', '15', None]
+
+    table, _ = TiledCoverage(200.0, processes=1).run(G.copy(), buildings, 135.0, 30.0)
+    engine = ShadowCoverage(Class_Shadow.generate_shadows(buildings, 135.0, 30.0))
+    expected = engine.apply_to_graph(G.copy())
+    tiled = table.sort_values(['u', 'v', 'key'])['shaded_length'].to_numpy()
+    np.testing.assert_allclose(tiled, expected['shaded_length'].to_numpy(), atol=1e-6)
@@ -16,30 +16,20 @@ print("\nBuilding Levels:")
 print(osm_object.Buildings['levels'])
 print(osm_object.Buildings.crs)
 
-# Reproject buildings to a suitable CRS (e.g., UTM zone 36N for Israel)
-osm_object.Buildings = osm_object.Buildings.to_crs(epsg=32636)  # Use EPSG code corresponding to UTM zone
-
+# Buildings are already in the graph CRS (UTM zone 36N) with heights filled by Open_Street_Map
 
 # Step 3: Calculate the area in square meters
 osm_object.Buildings['area'] = osm_object.Buildings['geometry'].area
 
-# Ensure height column exists
-if 'height' not in osm_object.Buildings.columns:
-    osm_object.Buildings['height'] = 0  # Initialize with 0 if not present
-
-# Replace NaN values in height with 0
-osm_object.Buildings['height'] = osm_object.Buildings['height'].fillna(0)
-
 # Debug: Print buildings with updated height values
 print("\nBuildings with Updated Heights:")
 print(osm_object.Buildings[['height', 'geometry']])
 
 
 # buildings = osm_object.Buildings.to_crs(epsg=32636)
-osm_object.Buildings['shadow_geometry'] = osm_object.Buildings.apply(lambda b: Class_Shadow.generate_distorted_shadow(b, azimuth, altitude), axis=1)
+osm_object.Buildings['shadow_geometry'] = Class_Shadow.generate_shadows(osm_object.Buildings, azimuth, altitude)
 
 osm_object.buildings_with_only_shadows = osm_object.Buildings.copy()
-osm_object.buildings_with_only_shadows = osm_object.buildings_with_only_shadows.to_crs(epsg=32636)
 osm_object.buildings_with_only_shadows['shadow_only_geometry'] = osm_object.buildings_with_only_shadows.apply(
     lambda row: row['shadow_geometry'].difference(row['geometry']) if row['shadow_geometry'] is not None else None,
     axis=1